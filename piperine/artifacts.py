@@ -0,0 +1,201 @@
+""" Registry of the constraint files left by the design of a sequence set
+
+call_design with cleanup=False leaves the spuriousSSM files tempname.st, .wc,
+.eq and .sp behind. The .wc and .eq files depend only on the compiled system,
+and the last full line of the .sp file holds the sequences spuriousSSM
+designed, in the layout of the .st template. Together they are the
+constraint files of the designed sequences, which Spurious_Weighted_Score
+would otherwise rebuild by compiling the system again with every domain
+fixed.
+
+The registry maps the domain sequences of a design and the parameters it was
+compiled with to the files written for it. When an entry is registered, each
+strand of the designed sequence is split into the domain sequences and
+complements it is made of. An entry is dropped as soon as one of its files is
+missing or has changed since it was registered, e.g. because a later rep wrote
+over it, or when the sequence in its .sp file is no longer the one built from
+the domain sequences, e.g. because the file was edited with its modification
+time kept. The scorer then compiles as before.
+
+    registry = get_registry()
+    registry.register(domain_seqs, design_params, basename)
+    entry = registry.lookup(domain_seqs, design_params)   # None if stale
+    st, wc, eq = entry.constraints()
+"""
+from __future__ import division, print_function
+
+import os
+import hashlib
+
+from . import wsi
+
+complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+
+def make_key(domain_seqs, compile_params):
+    """ Hash the domain sequences of a design and its compile parameters
+
+    Args:
+        domain_seqs: Dictionary of domain names to sequences
+        compile_params: Parameters given to the system file
+    Returns:
+        key: Hex digest identifying the design
+    """
+    fields = ['{} {}'.format(name, domain_seqs[name].upper())
+              for name in sorted(domain_seqs)]
+    fields.append(' '.join(str(p) for p in compile_params))
+    return hashlib.sha1('\n'.join(fields).encode('utf-8')).hexdigest()
+
+def domain_pieces(domain_seqs):
+    """ Sequences of domains and their complements
+
+    Returns:
+        pieces: Dictionary of (name, complemented) to upper case sequence
+    """
+    pieces = dict()
+    for name, seq in domain_seqs.items():
+        seq = seq.upper()
+        pieces[(name, False)] = seq
+        pieces[(name, True)] = ''.join(complement.get(b, b)
+                                       for b in reversed(seq))
+    return pieces
+
+def segment(strand, pieces):
+    """ Split a strand sequence into domain sequences
+
+    Args:
+        strand: Sequence of one strand
+        pieces: Dictionary of keys to sequences, as domain_pieces
+    Returns:
+        keys: Keys of pieces whose sequences make up strand, in order, or None
+            if strand is not made of them
+    """
+    paths = {0: []}
+    for i in range(len(strand)):
+        if i not in paths:
+            continue
+        for key, seq in pieces.items():
+            end = i + len(seq)
+            if seq and end not in paths and strand.startswith(seq, i):
+                paths[end] = paths[i] + [key]
+    return paths.get(len(strand))
+
+def stamp(filename):
+    """ Size and modification time of a file, or None if it is missing """
+    try:
+        info = os.stat(filename)
+    except OSError:
+        return None
+    return (info.st_size, info.st_mtime)
+
+class Artifacts(object):
+    """ Constraint files of one design
+
+    Args:
+        tempname: Path prefix the files were written with
+
+    Attributes:
+        files: Dictionary of extension to filename
+        stamps: Dictionary of extension to (size, mtime) at registration
+        layout: For each strand of the designed sequence (and empty string
+            between complexes), the domain_pieces keys it is made of
+    """
+    extensions = ['.st', '.wc', '.eq', '.sp']
+
+    def __init__(self, tempname):
+        self.files = dict((ext, tempname + ext) for ext in self.extensions)
+        self.stamps = dict((ext, stamp(name))
+                           for ext, name in self.files.items())
+        self.layout = None
+
+    def fresh(self):
+        """ Whether every file exists, unchanged since registration """
+        return all(self.stamps[ext] is not None and
+                   stamp(name) == self.stamps[ext]
+                   for ext, name in self.files.items())
+
+    def constraints(self):
+        """ Designed sequence and constraints, as wsi.read_constraints
+
+        The sequence is the last full line of the .sp file. It must have the
+        layout of the .st template, otherwise ValueError is raised.
+        """
+        st, wc, eq = wsi.read_constraints(self.files['.st'],
+                                          self.files['.wc'],
+                                          self.files['.eq'])
+        with open(self.files['.sp']) as f:
+            lines = f.read().split('\n')
+        designed = lines[-2] if len(lines) > 1 else ''
+        if len(designed) != len(st) or \
+           any((a == ' ') != (b == ' ') for a, b in zip(designed, st)):
+            raise ValueError('{} does not end with a sequence in the layout '
+                             'of {}'.format(self.files['.sp'],
+                                            self.files['.st']))
+        return designed, wc, eq
+
+    def sequence(self, domain_seqs):
+        """ The designed sequence built from domain sequences and layout """
+        pieces = domain_pieces(domain_seqs)
+        return ' '.join(''.join(pieces[key] for key in keys)
+                        for keys in self.layout)
+
+    def matches(self, domain_seqs):
+        """ Whether the .sp file holds the sequence built from domain_seqs """
+        try:
+            designed = self.constraints()[0]
+            return designed == self.sequence(domain_seqs)
+        except (ValueError, KeyError, IOError):
+            return False
+
+class Registry(object):
+    """ Constraint files of the designs made in this process, by key """
+    def __init__(self):
+        self.entries = dict()
+
+    def register(self, domain_seqs, compile_params, tempname):
+        """ Record the files written with tempname for a design
+
+        Returns:
+            entry: The Artifacts recorded, or None if a file is missing, the
+                .sp file holds no designed sequence, or a strand of it is not
+                made of the domain sequences
+        """
+        entry = Artifacts(tempname)
+        key = make_key(domain_seqs, compile_params)
+        self.entries.pop(key, None)
+        if not entry.fresh():
+            return None
+        try:
+            designed = entry.constraints()[0]
+        except ValueError:
+            return None
+        pieces = domain_pieces(domain_seqs)
+        layout = [segment(strand, pieces) for strand in designed.split(' ')]
+        if any(keys is None for keys in layout):
+            return None
+        entry.layout = layout
+        self.entries[key] = entry
+        return entry
+
+    def lookup(self, domain_seqs, compile_params):
+        """ Files of a design, or None if unknown or stale """
+        key = make_key(domain_seqs, compile_params)
+        entry = self.entries.get(key)
+        if entry is not None and not (entry.fresh() and
+                                      entry.matches(domain_seqs)):
+            del self.entries[key]
+            entry = None
+        return entry
+
+_registry = None
+
+def set_registry():
+    """ Start an empty process-wide registry """
+    global _registry
+    _registry = Registry()
+    return _registry
+
+def get_registry():
+    """ The process-wide registry """
+    if _registry is None:
+        set_registry()
+    return _registry
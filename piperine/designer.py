@@ -10,6 +10,9 @@ import importlib
 
 from . import energyfuncs_james
 from . import DSDClasses
+from . import profiling
+from . import incremental
+from . import artifacts
 
 small_crn = pkg_resources.resource_filename('piperine', "data/small.crn")
 data_dir = os.path.dirname(small_crn)
@@ -84,9 +87,24 @@ def call_design(basename,
     design(basename, infilename, outfilename, cleanup, verbose, reuse,
               just_files, struct_orient, old_output, tempname, extra_pars,
               findmfe, spuriousbinary)
-    if not os.path.isfile(outfilename):
+    if not just_files and not os.path.isfile(outfilename):
         raise RuntimeError('Expected MFE not created, expect SSM failure')
 
+def register_artifacts(basename, seq_file, design_params):
+    """ Record the constraint files left by call_design(cleanup=False)
+
+    The .st, .wc, .eq and .sp files written under basename are registered
+    for the domain sequences of seq_file, so WSI scoring of these sequences
+    uses them instead of compiling the system again. (see artifacts)
+
+    Returns:
+        entry: The artifacts.Artifacts registered, or None
+    """
+    from .tdm import Read_Finished
+    domain_seqs = Read_Finished(seq_file)[0]
+    return artifacts.get_registry().register(domain_seqs, design_params,
+                                             basename)
+
 def call_finish(basename,
                 savename=None,
                 designname=None,
@@ -265,12 +283,31 @@ def write_toehold_file(toehold_file, strands, toeholds, n_th):
 
     f.close()
 
+def read_toehold_file(toehold_file):
+    """ Reads the toehold constraints of a fixed file
+
+    Args:
+        toehold_file: File written by write_toehold_file
+    Returns:
+        toeholds: Dictionary of toehold sequences keyed by domain name
+    """
+    toeholds = dict()
+    with open(toehold_file) as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if len(line) == 4 and line[0] == 'sequence' and line[2] == '=':
+                toeholds[line[1]] = line[3].lower()
+    return toeholds
+
 def toehold_wrapper(n_ths,
                     thold_l=7,
                     thold_e=7.7,
                     e_dev=1,
                     m_spurious=0.5,
-                    e_module=energyfuncs_james):
+                    e_module=energyfuncs_james,
+                    n_jobs=1,
+                    th_library=False,
+                    oldends=()):
     """ Wrapper generating toeholds, calls gen_th
 
     Args:
@@ -280,6 +317,11 @@ def toehold_wrapper(n_ths,
         e_dev: Allowable standard deviation in kCal/mole (1)
         m_spurious: Maximum spurious dG as fraction of thold_e (0.5)
         e_module: Thermodynamics used by stickydesign (energyfuncs_james)
+        n_jobs: Toehold searches raced at once (1)
+        th_library: Draw toeholds from a stored toehold library, searching
+            only if the library is too small (False)
+        oldends: Toeholds already in the design, which the new toeholds must
+            be compatible with. The library is not used if any are given. (())
     Returns:
         ths: Toeholds, listed as tupled-pairs
         th_score: average toehold dG and the range of dG's
@@ -288,7 +330,14 @@ def toehold_wrapper(n_ths,
     # Grab parameters from the dictionary or set defaults
     # Toehold length (basepairs)
     thold_l = int(thold_l)
-    ths = get_toeholds(n_ths, thold_l, thold_e, e_dev, m_spurious, e_module)
+    if th_library and not len(oldends):
+        from .thlibrary import get_library
+        library = get_library(thold_l, thold_e, e_dev, m_spurious, e_module,
+                              n_jobs=n_jobs)
+        if len(library) >= n_ths:
+            return library.toeholds(library.draw(n_ths, disjoint=True))
+    ths = get_toeholds(n_ths, thold_l, thold_e, e_dev, m_spurious, e_module,
+                       n_jobs=n_jobs, oldends=oldends)
     return ths
 
 def write_sys_file(basename,
@@ -415,7 +464,10 @@ def generate_seqs(basename,
                   seq_file=None,
                   fixed_file=None,
                   save_file=None,
-                  strands_file=None):
+                  strands_file=None,
+                  n_jobs=1,
+                  th_library=False,
+                  old_toeholds=None):
     """ Produce sequences for a scheme
 
     This function accepts a base file name, a list of gate objects, a list of
@@ -442,6 +494,11 @@ def generate_seqs(basename,
         fixed_file: Filename of the peppercompiler fixed file (basename + .fixed)
         save_file: Filename of the peppercompiler save file (basename + .save)
         strands_file: Filename of the peppercompiler strands file (basename + _strands.txt)
+        n_jobs: Toehold searches raced at once (1)
+        th_library: Draw toeholds from a stored toehold library (False)
+        old_toeholds: Toehold sequences from an earlier design, keyed by
+            domain name, as read_toehold_file. Toehold domains found here keep
+            their sequences and only the rest are generated. (None)
     Returns:
         toeholds:
     """
@@ -478,14 +535,31 @@ def generate_seqs(basename,
     for strand in strands:
         tdomains += strand.get_ths()
     tdomains = list(set(tdomains))
-    n_toeholds = len(tdomains)
-
-    toeholds = toehold_wrapper(n_toeholds,
-                               thold_l=thold_l,
-                               thold_e=thold_e,
-                               e_dev=e_dev,
-                               m_spurious=m_spurious,
-                               e_module=e_module)
+    # Keep the toeholds of an earlier design, in write_toehold_file's order
+    if old_toeholds is None:
+        old_toeholds = dict()
+    kept = [th for th in sorted(tdomains) if th in old_toeholds]
+    new_names = [th for th in sorted(tdomains) if th not in old_toeholds]
+    n_toeholds = len(new_names)
+
+    if n_toeholds > 0:
+        new_ths = toehold_wrapper(n_toeholds,
+                                  thold_l=thold_l,
+                                  thold_e=thold_e,
+                                  e_dev=e_dev,
+                                  m_spurious=m_spurious,
+                                  e_module=e_module,
+                                  n_jobs=n_jobs,
+                                  th_library=th_library,
+                                  oldends=[old_toeholds[th] for th in kept])
+        if new_ths == -1:
+            raise ValueError('No toeholds found for {}'.format(
+                             ', '.join(new_names)))
+    else:
+        new_ths = []
+    th_seqs = dict(zip(new_names, new_ths))
+    th_seqs.update((th, old_toeholds[th]) for th in kept)
+    toeholds = [th_seqs[th] for th in sorted(tdomains)]
 
     # Write the fixed file for the toehold sequences and compile the sys file to PIL
     write_toehold_file(fixed_file, strands, toeholds, n_th)
@@ -501,6 +575,7 @@ def generate_seqs(basename,
     # "Finish" the sequence generation
     call_finish(basename, savename=save_file, designname=mfe_file, \
                 seqname=seq_file, strandsname=strands_file, run_kin=False)
+    register_artifacts(basename, seq_file, design_params)
     return toeholds
 
 def selection(scores):
@@ -655,7 +730,13 @@ def run_designer(basename=small_crn[:-4],
                  extra_pars="",
                  temp_files=True,
                  quick=False,
-                 includes=None
+                 includes=None,
+                 n_jobs=1,
+                 batch=False,
+                 profile=False,
+                 native_wsi=False,
+                 th_library=False,
+                 keep_toeholds=False
                 ):
     """ Generate and score sequences
 
@@ -679,11 +760,26 @@ def run_designer(basename=small_crn[:-4],
         extra_pars: Options sent to spurious designer. ('')
         quick: Make random scores instead of computing heursitics. Skips time
                consuming computations for debugging purposes. (False)
+        includes: path to folder holding component files referenced by .sys.
+        n_jobs: NUPACK processes run at once for pairwise scoring, and
+                toehold searches raced at once. None uses all cores. (1)
+        batch: Score all strand pairs, and all single strands, each from a
+            single NUPACK run (False)
+        profile: Write per-stage scoring times and NUPACK call statistics for
+            each rep (False)
+        native_wsi: Compute the WSI scores in process instead of running
+            spuriousSSM. Experimental: the total is not yet known to match
+            spuriousSSM's. (False)
+        th_library: Draw each rep's toeholds from a stored toehold library,
+            without repeats until the library is used up (False)
+        keep_toeholds: Keep the toeholds in basename.fixed from an earlier
+            design, generating only those of new toehold domains (False)
     Returns:
         Nothing, but writes many basename + extension files, such as:
             system file (.sys)
             sequences (.seq)
             scores (_scores.csv)
+            scoring profile (_profile.json), if profile is set
     """
     # If module inputs are strings, import them
     if type(trans_module) is str:
@@ -702,8 +798,15 @@ def run_designer(basename=small_crn[:-4],
     (gates, strands) = \
         generate_scheme(basename, design_params, trans_module)
 
+    # Read the toeholds of the last design before the reps overwrite them
+    if keep_toeholds and os.path.isfile(fixed_file):
+        old_toeholds = read_toehold_file(fixed_file)
+    else:
+        old_toeholds = None
+
     if reps >= 1:
         scoreslist = []
+        profiles = []
         for i in range(reps):
             testname = basename + str(i) + '.txt'
             try:
@@ -718,17 +821,27 @@ def run_designer(basename=small_crn[:-4],
                                          m_spurious=m_spurious,
                                          e_module=e_module,
                                          strands_file=testname,
-                                         extra_pars=extra_pars)
-
-                scores, score_names = tdm.EvalCurrent(basename,
-                                                      gates,
-                                                      strands,
-                                                      testname=testname,
-                                                      compile_params=design_params,
-                                                      quick=quick,
-                                                      includes=includes,
-                                                      energetics_module=e_module,
-                                                      targetdG = thold_e)
+                                         extra_pars=extra_pars,
+                                         n_jobs=n_jobs,
+                                         th_library=th_library,
+                                         old_toeholds=old_toeholds)
+
+                out = tdm.EvalCurrent(basename,
+                                      gates,
+                                      strands,
+                                      testname=testname,
+                                      compile_params=design_params,
+                                      quick=quick,
+                                      includes=includes,
+                                      energetics_module=e_module,
+                                      targetdG = thold_e,
+                                      n_jobs=n_jobs,
+                                      batch=batch,
+                                      profile=profile,
+                                      native_wsi=native_wsi)
+                scores, score_names = out[:2]
+                if profile:
+                    profiles.append(out[2])
                 scores = [i] + scores
                 scoreslist.append(scores)
             except KeyError as e:
@@ -746,6 +859,8 @@ def run_designer(basename=small_crn[:-4],
             f.write('\n')
             f.writelines( [ ','.join(map(str, l)) + '\n' for l in scoreslist ])
             f.write("Winner : {}".format(winner))
+        if profile:
+            profiling.write_json(profiles, basename+'_profile.json')
 
     return (gates, strands, winner, scoreslist)
 
@@ -763,7 +878,12 @@ def score_fixed(fixed_file,
                  trans_module=DSDClasses,
                  e_module=energyfuncs_james,
                  includes=None,
-                 quick=False):
+                 quick=False,
+                 n_jobs=1,
+                 batch=False,
+                 profile=False,
+                 state_file=None,
+                 native_wsi=False):
     """ Score a sequence set
 
     This function takes in a fixed file, crn file, and reaction scheme specification
@@ -781,6 +901,19 @@ def score_fixed(fixed_file,
         design_params: A tuple of parameters to the system file ( (7, 15, 2) )
         trans_module: Module containing scheme variables and classes (DSDClasses)
         quick: Skip time-consuming steps of minimizing sequence symetry and scoring (False)
+        n_jobs: NUPACK processes run at once for pairwise scoring. None uses
+                all cores. (1)
+        batch: Score all strand pairs, and all single strands, each from a
+            single NUPACK run (False)
+        profile: Write per-stage scoring times and NUPACK call statistics
+            beside the score file, as _profile.json (False)
+        state_file: JSON file keeping the per-pair, per-complex and
+            per-strand results of the last scoring of this design. Only
+            items whose sequences changed since are scored again, and the
+            file is updated. (None)
+        native_wsi: Compute the WSI scores in process instead of running
+            spuriousSSM. Experimental: the total is not yet known to match
+            spuriousSSM's. (False)
     Returns:
         scores: A list containing the scores generated by EvalCurrent
         score_names: A list of strings describing the scores
@@ -830,14 +963,29 @@ def score_fixed(fixed_file,
     # "Finish" the sequence generation
     call_finish(basename, savename=save_file, designname=mfe_file, \
                 seqname=seq_file, run_kin=False)
-    scores, score_names = tdm.EvalCurrent(basename,
-                                          gates,
-                                          strands,
-                                          compile_params=design_params,
-                                          quick=quick,
-                                          includes=includes,
-                                          energetics_module=e_module,
-                                          targetdG = thold_e)
+    register_artifacts(basename, seq_file, design_params)
+    state = None
+    if state_file is not None:
+        state = incremental.ScoreState.load(state_file)
+    out = tdm.EvalCurrent(basename,
+                          gates,
+                          strands,
+                          compile_params=design_params,
+                          quick=quick,
+                          includes=includes,
+                          energetics_module=e_module,
+                          targetdG = thold_e,
+                          n_jobs=n_jobs,
+                          batch=batch,
+                          profile=profile,
+                          state=state,
+                          native_wsi=native_wsi)
+    scores, score_names = out[:2]
+    if state is not None and not quick:
+        state.save(state_file)
+    if profile:
+        profiling.write_json(out[2],
+                             os.path.splitext(score_file)[0] + '_profile.json')
     with open(score_file, 'w') as f:
         f.write(','.join(score_names))
         f.write('\n')
@@ -846,7 +994,10 @@ def score_fixed(fixed_file,
 
 if __name__ == "__main__":
     import argparse
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        epilog='NUPACK results are cached in ~/.piperine/nupack_cache.sqlite. '
+               'Set PIPERINE_CACHE to use another file, or to an empty '
+               'string to disable the cache.')
     parser.add_argument("-b", "--basename", help='Basename.[small]', type=str)
     parser.add_argument("-l", "--length", help='Toehold length.[7]', type=int)
     parser.add_argument("-e", "--energy", help='Target toehold binding energy'+
@@ -868,6 +1019,19 @@ if __name__ == "__main__":
     parser.add_argument("-x", '--extrapars', help='Parameters sent to SpuriousSSM[]', type=str)
     parser.add_argument("-q", '--quick', action='store_true',
                         help='Make random numbers instead of computing heuristics to save time[False]')
+    parser.add_argument('--batch', action='store_true',
+                        help='Score all strand pairs, and all single strands, each from a single NUPACK run[False]')
+    parser.add_argument('--profile', action='store_true',
+                        help='Write per-stage scoring times to basename_profile.json[False]')
+    parser.add_argument('--native-wsi', action='store_true',
+                        help='Experimental: compute WSI scores in process instead of running spuriousSSM[False]')
+    parser.add_argument('--toehold-library', action='store_true',
+                        help='Draw toeholds from a stored library of compatible toeholds[False]')
+    parser.add_argument('--keep-toeholds', action='store_true',
+                        help='Keep the toeholds in basename.fixed, generating only new ones[False]')
+    parser.add_argument("-j", '--jobs', help='Concurrent NUPACK processes for pairwise'+
+                        ' NUPACK scoring, and toehold searches raced at once[1]',
+                        type=int, default=1)
     args = parser.parse_args()
     ############## Interpret arguments
     if args.basename:
@@ -941,5 +1105,10 @@ if __name__ == "__main__":
                "m_spurious":m_spurious, "e_module":energetics}
 
     gates, strands, winner = run_designer(basename, reps, th_params, design_params, trans_module,
-                                    extra_pars=extra_pars, quick=args.quick)
+                                    extra_pars=extra_pars, quick=args.quick,
+                                    n_jobs=args.jobs, batch=args.batch,
+                                    profile=args.profile,
+                                    native_wsi=args.native_wsi,
+                                    th_library=args.toehold_library,
+                                    keep_toeholds=args.keep_toeholds)
     print('Winning sequence set is index {}'.format(winner))
@@ -3,9 +3,181 @@ from pkg_resources import Requirement, resource_stream
 import numpy as np
 import itertools
 import logging
+import hashlib
+import io
+import os
+
+from stickydesign import endarray
+
+# The compiled reduction of uniform_danglemismatch; often missing where
+# stickydesign's extension could not be built, in which case
+# running_min_sum is used
+try:
+    from stickydesign._stickyext import fastsub
+except ImportError:
+    fastsub = None
 
 nt = { 'a': 0, 'c': 1, 'g': 2, 't': 3 }
 tops = lambda s: 4*s[:,:-1]+s[:,1:]
+
+# The parameter tables derived from the CSV files are kept in an .npz file,
+# tagged with a hash of the CSV contents, so they are only parsed when the
+# CSVs change. The location is read from the PIPERINE_PARAMS environment
+# variable (~/.piperine/energyfuncs_james.npz if unset); an empty string keeps
+# the tables in memory only.
+default_params_file = os.path.join(os.path.expanduser('~'), '.piperine',
+                                   'energyfuncs_james.npz')
+table_names = ['nndG_full', 'dgldG_full', 'nndG', 'dgldG', 'dgldG_fixedC']
+_tables = None
+
+def read_param_csvs():
+    """ Contents of dnastackingbig.csv and dnadangle.csv, as bytes """
+    try:
+        dsb = resource_stream('stickydesign', 'stickydesign/params/dnastackingbig.csv')
+    except:
+        try:
+            dsb = resource_stream('stickydesign', 'params/dnastackingbig.csv')
+        except IOError:
+            raise IOError("Error loading dnastackingbig.csv")
+    try:
+        dgl = resource_stream('piperine', 'data/dnadangle.csv')
+    except:
+        try:
+            this_dir, this_filename = os.path.split(__file__)
+            dgl = open( os.path.join(this_dir, "data", "dnadangle.csv"), 'rb' )
+        except IOError:
+            raise IOError("Error loading dnadangle.csv")
+    with dsb, dgl:
+        return dsb.read(), dgl.read()
+
+def build_tables(dsb, dgl):
+    """ Derive the energyfuncs parameter tables from the CSV contents """
+    tables = dict()
+    tables['nndG_full'] = -np.loadtxt(io.BytesIO(dsb), delimiter=',')
+    tables['dgldG_full'] = -np.loadtxt(io.BytesIO(dgl), delimiter=',')
+    tables['nndG'] = tables['nndG_full'][np.arange(0,16),15-np.arange(0,16)]
+    # 30-01-15: The only dangle contexts we are interested in are 3' dangle
+    # s. Select those from the Santa Lucia table. We'll have to flip the
+    # order of the vector, though, to mach the 5->3 orientation of the gene
+    # rated toeholds. To flip, we need to count up to 15 with the opposite-
+    # endian order, in terms of quaternary representation
+    indcs = 4*np.tile(np.arange(4), 4) + np.repeat(np.arange(4), 4)
+    tables['dgldG'] = tables['dgldG_full'][1, indcs]
+    # 30-01-15: As of now, the dangle base is set to C, so make a lookup ta
+    # ble ordered by terminating toehold base
+    tables['dgldG_fixedC'] = tables['dgldG_full'][1, np.arange(4) + 4 * nt['c']]
+    return tables
+
+def load_tables(filename=None):
+    """ Parameter tables, from the .npz file if it matches the CSVs
+
+    The .npz file is rewritten when it is missing, unreadable or was built
+    from different CSV contents. Tables are read once per process; the arrays
+    are shared by every energyfuncs instance and are read-only. They are
+    loaded eagerly rather than memory-mapped: together they hold a few hundred
+    floats, so reading them costs less than the stat calls and page faults of
+    a mapping, and the saving is in not parsing the CSVs again.
+
+    Args:
+        filename: .npz file (PIPERINE_PARAMS or default_params_file if None)
+    Returns:
+        tables: Dictionary of table name to array
+    """
+    global _tables
+    default = filename is None
+    if default and _tables is not None:
+        return _tables
+    if default:
+        filename = os.environ.get('PIPERINE_PARAMS', default_params_file)
+    dsb, dgl = read_param_csvs()
+    digest = hashlib.sha1(dsb + b'\0' + dgl).hexdigest()
+    tables = None
+    if filename and os.path.isfile(filename):
+        try:
+            with np.load(filename) as npz:
+                if str(npz['digest']) == digest:
+                    tables = dict((name, npz[name]) for name in table_names)
+        except (IOError, ValueError, KeyError):
+            tables = None
+    if tables is None:
+        tables = build_tables(dsb, dgl)
+        if filename:
+            try:
+                dirname = os.path.dirname(filename)
+                if dirname and not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+                with open(tmpname, 'wb') as f:
+                    np.savez(f, digest=np.array(digest), **tables)
+                os.replace(tmpname, filename)
+            except (IOError, OSError):
+                logging.warning('Could not write parameter tables to %s',
+                                filename)
+    for table in tables.values():
+        table.setflags(write=False)
+    if default:
+        _tables = tables
+    return tables
+
+def ordered_sum(vals, lengths):
+    """ Sum the leading values of rows in the order np.sum adds them
+
+    np.sum adds fewer than 8 values in sequence and longer rows in 8
+    interleaved partial sums, so summing rows masked to a common width would
+    round differently from summing each row alone. Row k of vals holds
+    lengths[k] values; the finite values after them are ignored. Rows of up
+    to 128 values are supported.
+
+    Args:
+        vals: Array of shape (..., rows, width)
+        lengths: Number of values in each row, at least 1
+    Returns:
+        sums: Array of shape (..., rows)
+    """
+    width = vals.shape[-1]
+    column = lambda t, keep: np.where(keep, vals[..., t], -0.0)
+    # Rows of fewer than 8 values end before column 7
+    sums = vals[..., 0]
+    for t in range(1, min(width, 7)):
+        sums = sums + column(t, t < lengths)
+    if width < 8:
+        return sums
+    # Values in whole blocks of 8 go to the partial sums; the rest of the row
+    # is then added in sequence
+    whole = lengths - lengths % 8
+    r = [vals[..., j] for j in range(8)]
+    for t in range(8, width):
+        r[t % 8] = r[t % 8] + column(t, t < whole)
+    pairwise = ((r[0] + r[1]) + (r[2] + r[3])) + ((r[4] + r[5]) + (r[6] + r[7]))
+    for t in range(8, width):
+        pairwise = pairwise + column(t, (t >= whole) & (t < lengths))
+    return np.where(lengths >= 8, pairwise, sums)
+
+def running_min_sum(m, chunk_size=4096):
+    """ Lowest running sum of each row, restarting at zeros, as fastsub
+
+    Rows are reduced chunk_size at a time, one column at a time across the
+    rows of a chunk, adding in the same order as fastsub so the results are
+    bit-identical.
+
+    Args:
+        m: Array of shape (rows, columns)
+        chunk_size: Rows reduced at a time
+    Returns:
+        r: Array of the lowest running sum of each row, at most 0
+    """
+    step = max(int(chunk_size), 1)
+    r = np.zeros(m.shape[0])
+    for start in range(0, m.shape[0], step):
+        cols = np.ascontiguousarray(m[start:start+step].T)
+        g = np.zeros(cols.shape[1])
+        gm = np.zeros(cols.shape[1])
+        for y in cols:
+            g = np.where(y == 0, 0.0, g + y)
+            np.minimum(gm, g, out=gm)
+        r[start:start+step] = gm
+    return r
+
 class energyfuncs:
     """
     Energy functions based on SantaLucia's 2004 paper.
@@ -15,40 +187,15 @@ class energyfuncs:
     it takes the maximum interaction of the 'loop' and 'dangle' options.
     """
     def __init__(self, mismatchtype='max', targetdG=7):
-        import os
-        try:
-            dsb = resource_stream('stickydesign', 'stickydesign/params/dnastackingbig.csv')
-        except:
-            try:
-                dsb = resource_stream('stickydesign', 'params/dnastackingbig.csv')
-            except IOError:
-                raise IOError("Error loading dnastackingbig.csv")
-        try:
-            dgl = resource_stream('piperine', 'data/dnadangle.csv')
-        except:
-            try:
-                this_dir, this_filename = os.path.split(__file__)
-                dgl = open( os.path.join(this_dir, "data", "dnadangle.csv") )
-            except IOError:
-                raise IOError("Error loading dnadangle.csv")
+        tables = load_tables()
         self.targetdG=targetdG
-        self.nndG_full = -np.loadtxt(dsb ,delimiter=',')
-        self.dgldG_full = -np.loadtxt(dgl ,delimiter=',')
+        self.nndG_full = tables['nndG_full']
+        self.dgldG_full = tables['dgldG_full']
         self.taildG = 1.3
-        dsb.close()
-        dgl.close()
         self.initdG = 0.0 # 1.96 DISABLED FOR NOW
-        self.nndG = self.nndG_full[np.arange(0,16),15-np.arange(0,16)]
-        # 30-01-15: The only dangle contexts we are interested in are 3' dangle
-        # s. Select those from the Santa Lucia table. We'll have to flip the
-        # order of the vector, though, to mach the 5->3 orientation of the gene
-        # rated toeholds. To flip, we need to count up to 15 with the opposite-
-        # endian order, in terms of quaternary representation
-        indcs = 4*np.tile(np.arange(4), 4) + np.repeat(np.arange(4), 4)
-        self.dgldG = self.dgldG_full[1, indcs]
-        # 30-01-15: As of now, the dangle base is set to C, so make a lookup ta
-        # ble ordered by terminating toehold base
-        self.dgldG_fixedC = self.dgldG_full[1, np.arange(4) + 4 * nt['c']]
+        self.nndG = tables['nndG']
+        self.dgldG = tables['dgldG']
+        self.dgldG_fixedC = tables['dgldG_fixedC']
         if mismatchtype == 'max':
             self.uniform = lambda x,y: np.maximum( self.uniform_loopmismatch(x,y), \
                                                    self.uniform_danglemismatch(x,y) \
@@ -95,7 +242,23 @@ class energyfuncs:
                                 np.abs(dG_internal - self.targetdG)
         return np.choose(external_further_bool, [dG_internal, dG_external])
 
-    def uniform_loopmismatch(self, seqs1, seqs2):
+    def uniform_loopmismatch(self, seqs1, seqs2, chunk_size=1024, full=False):
+        """ Strongest loop-mismatch interaction of each pair of ends
+
+        Every shift of seqs2 against seqs1 is scored at once, from the table
+        of every stack of one end facing every stack of the other. Pairs are
+        handled chunk_size at a time, so memory is bounded by chunk_size
+        times the squared end length unless full is set. Results are
+        bit-identical to scoring one shift at a time.
+
+        Args:
+            seqs1, seqs2: Stickydesign endarrays of the same type
+            chunk_size: Pairs scored at a time
+            full: Return the energy of every shift instead of the maximum
+        Returns:
+            en: Maximum energy of each pair, or if full, an array of shape
+                (pairs, 2*(endlen-1)) of the energy of each shift
+        """
         if seqs1.shape != seqs2.shape:
             if seqs1.ndim == 1:
                 seqs1 = endarray( np.repeat(np.array([seqs1]),seqs2.shape[0],0), seqs1.endtype )
@@ -123,22 +286,63 @@ class energyfuncs:
             ps2 = seqs2[:,::-1][:,1:-1]*4+seqs2[:,::-1][:,2:]
             pa2 = seqs2[:,-2]*4+seqs2[:,-1]
             pac2 = (seqs1[:,0])*4+(3-seqs2[:,-1])
+        n = ps1.shape[0]
+        step = max(int(chunk_size), 1)
 
         # Shift here is considering the first strand as fixed, and the second one as
         # shifting.  The shift is the offset of the bottom one in terms of pair
         # sequences (thus +2 and -1 instead of +1 and 0).
-        en = np.zeros( (ps1.shape[0], 2*plen) )
-        for shift in range(-plen+1,plen):
-            #import pdb
-            #pdb.set_trace()
-            en[:,plen+shift-1] = np.sum( \
-                    self.nndG_full[ ps1[:,max(shift,0):plen+shift], \
-                               ps2[:,max(-shift,0):plen-shift] ], \
-                               axis=1)
-        en[:,plen-1] = en[:,plen-1] + self.nndG_full[pa1,pac1] + self.nndG_full[pa2,pac2]
-        return np.amax(en,1) - self.initdG
-
-    def uniform_danglemismatch(self, seqs1,seqs2,fast=True):
+        # stacks[k, i, j] is the energy of stack i of ps1 facing stack j of ps2,
+        # so the stacks facing each other at a shift lie on a diagonal, which
+        # starts at (shift, 0) for shift >= 0 and at (0, -shift) otherwise.
+        # The diagonals are read through strided views; their reads past the
+        # end of a diagonal land in the next pair or the spare block and are
+        # ignored by ordered_sum, which adds the stacks of each shift in the
+        # order np.sum did when the shifts were scored one at a time.
+        lengths = plen - np.abs(np.arange(-plen+1, plen))
+        table = self.nndG_full.ravel()
+        if full:
+            out = np.empty((n, 2*plen))
+        else:
+            out = np.empty(n)
+        for start in range(0, n, step):
+            sl = slice(start, start + step)
+            m = ps1[sl].shape[0]
+            stacks = np.zeros((m + 1, plen, plen))
+            np.take(table, 16*np.asarray(ps1[sl])[:, :, None] +
+                    np.asarray(ps2[sl])[:, None, :], out=stacks[:m])
+            s0, s1, s2 = stacks.strides
+            below = np.lib.stride_tricks.as_strided(
+                stacks[0, 0, plen-1:], shape=(m, plen-1, plen),
+                strides=(s0, -s2, s1+s2), writeable=False)
+            above = np.lib.stride_tricks.as_strided(
+                stacks, shape=(m, plen, plen), strides=(s0, s1, s1+s2),
+                writeable=False)
+            en = np.zeros((m, 2*plen))
+            en[:, :plen-1] = ordered_sum(below, lengths[:plen-1])
+            en[:, plen-1:-1] = ordered_sum(above, lengths[plen-1:])
+            en[:,plen-1] = en[:,plen-1] + self.nndG_full[pa1[sl],pac1[sl]] + \
+                           self.nndG_full[pa2[sl],pac2[sl]]
+            if full:
+                out[sl] = en - self.initdG
+            else:
+                out[sl] = np.amax(en,1) - self.initdG
+        return out
+
+    def uniform_danglemismatch(self, seqs1,seqs2,fast=True,chunk_size=65536):
+        """ Strongest dangle-mismatch interaction of each pair of ends
+
+        The reduction uses stickydesign's compiled fastsub when it is
+        available, or running_min_sum otherwise; fast=False uses the plain
+        Python loop. Pairs are handled chunk_size at a time to bound memory.
+        """
+        if seqs2.shape[0] > chunk_size and seqs2.ndim == 2:
+            step = max(int(chunk_size), 1)
+            return np.concatenate([
+                self.uniform_danglemismatch(
+                    seqs1 if seqs1.ndim == 1 else seqs1[i:i+step],
+                    seqs2[i:i+step], fast, step)
+                for i in range(0, seqs2.shape[0], step)])
         if seqs1.shape != seqs2.shape:
             if seqs1.ndim == 1:
                 seqs1 = endarray( np.repeat(np.array([seqs1]),seqs2.shape[0],0), seqs1.endtype )
@@ -189,10 +393,10 @@ class energyfuncs:
                 i+=1
                 if not i%1000:
                     print("%d/%d" % (i,im))
+        elif fastsub is not None:
+            fastsub(m,r)
         else:
-            from stickydesign import _stickyext
-            x = m
-            _stickyext.fastsub(x,r)
+            r = running_min_sum(m)
 
         return r-self.initdG
 
@@ -0,0 +1,154 @@
+""" Mass-action equilibrium of small DNA tubes, solved in NumPy
+
+Given the free energies NUPACK's 'complexes' reports for every complex in a
+tube, the equilibrium concentrations follow from the convex dual problem of
+Dirks et al. (SIAM Review, 2007), the same problem NUPACK's 'concentrations'
+solves. Here many tubes that share a stoichiometry matrix are solved at once
+with a damped Newton iteration, so scoring thousands of strand pairs does not
+need thousands of processes.
+
+Concentrations are handled internally as mole fractions, using NUPACK's
+temperature-dependent molarity of water.
+"""
+from __future__ import division, print_function
+
+import numpy as np
+
+# Boltzmann constant in kcal/(mol K), matching NUPACK 3
+kB = 0.0019872041
+zero_C = 273.15
+
+def water_density(T=25.0):
+    """ Molarity of water at T degrees celsius, as computed by NUPACK
+
+    Uses the fit of Tanaka et al. (Metrologia 2001) to the density of water.
+    """
+    a1 = -3.983035
+    a2 = 301.797
+    a3 = 522528.9
+    a4 = 69.34881
+    a5 = 999.974950
+    return a5 * (1 - (T+a1)*(T+a1)*(T+a2)/a3/(T+a4)) / 18.0152
+
+def kT(T=25.0):
+    """ Thermal energy in kcal/mol at T degrees celsius """
+    return kB * (T + zero_C)
+
+def solve_tubes(stoich, dG, x0, T=25.0, tol=1e-10, maxiter=500):
+    """ Equilibrium complex concentrations for a batch of tubes
+
+    Every tube contains the same set of complexes, described by one
+    stoichiometry matrix, but each tube may have its own free energies and
+    strand concentrations.
+
+    Args:
+        stoich: (complexes, strands) array of strand counts in each complex
+        dG: (tubes, complexes) or (complexes,) free energies in kcal/mol, as
+            reported by NUPACK's complexes
+        x0: (tubes, strands) or (strands,) total strand concentrations in
+            molar. All must be positive.
+        T: Temperature in celsius
+        tol: Convergence tolerance on the relative mass-balance error
+        maxiter: Maximum number of Newton iterations
+    Returns:
+        conc: (tubes, complexes) equilibrium concentrations in molar
+    """
+    A = np.asarray(stoich, dtype=float)
+    n_cmplx, n_strands = A.shape
+    dG = np.asarray(dG, dtype=float)
+    x0 = np.asarray(x0, dtype=float)
+    n_tubes = max(dG.shape[0] if dG.ndim == 2 else 1,
+                  x0.shape[0] if x0.ndim == 2 else 1)
+    G = np.broadcast_to(dG / kT(T), (n_tubes, n_cmplx))
+    rho = water_density(T)
+    x0 = np.broadcast_to(x0 / rho, (n_tubes, n_strands))
+
+    # Start from every strand free as a monomer, where monomers exist.
+    lam = np.log(x0)
+    for i in range(n_strands):
+        unit = np.zeros(n_strands)
+        unit[i] = 1
+        rows = np.where((A == unit).all(1))[0]
+        if len(rows) > 0:
+            lam[:, i] = lam[:, i] + G[:, rows[0]]
+
+    def concentrations(lam, G):
+        # log x_c = -G_c + sum_i A_ci lam_i, clipped to keep exp finite
+        return np.exp(np.minimum(lam.dot(A.T) - G, 700.))
+
+    x = concentrations(lam, G)
+    f = x.sum(1) - (x0 * lam).sum(1)
+    for it in range(maxiter):
+        grad = x.dot(A) - x0
+        err = np.abs(grad / x0).max(1)
+        active = err > tol
+        if not active.any():
+            break
+        idx = np.where(active)[0]
+        xa = x[idx]
+        hess = np.einsum('tc,ci,cj->tij', xa, A, A)
+        # Solve with the Hessian scaled to unit diagonal for conditioning.
+        # Far from equilibrium a dominant complex can make it numerically
+        # singular, so add a small ridge.
+        d = np.sqrt(np.einsum('tii->ti', hess))
+        hess_s = hess / d[:, :, None] / d[:, None, :]
+        hess_s = hess_s + 1e-10 * np.eye(n_strands)
+        step = -np.linalg.solve(hess_s, (grad[idx] / d)[:, :, None])[:, :, 0] / d
+        slope = (grad[idx] * step).sum(1)
+        # Backtracking line search on the convex objective
+        t = np.ones(len(idx))
+        pending = np.ones(len(idx), dtype=bool)
+        new_lam = lam[idx].copy()
+        new_x = xa.copy()
+        new_f = f[idx].copy()
+        for ls in range(60):
+            sub = np.where(pending)[0]
+            trial_lam = lam[idx[sub]] + t[sub, None] * step[sub]
+            trial_x = concentrations(trial_lam, G[idx[sub]])
+            x0_sub = x0[idx[sub]]
+            trial_f = trial_x.sum(1) - (x0_sub * trial_lam).sum(1)
+            slack = 1e-13 * (np.abs(f[idx[sub]]) + trial_x.sum(1))
+            ok = trial_f <= f[idx[sub]] + 1e-4 * t[sub] * slope[sub] + slack
+            accept = sub[ok]
+            new_lam[accept] = trial_lam[ok]
+            new_x[accept] = trial_x[ok]
+            new_f[accept] = trial_f[ok]
+            pending[accept] = False
+            if not pending.any():
+                break
+            t[pending] = t[pending] / 2
+        lam[idx] = new_lam
+        x[idx] = new_x
+        f[idx] = new_f
+    else:
+        raise RuntimeError('Equilibrium solver did not converge in {} '
+                           'iterations'.format(maxiter))
+    return x * rho
+
+def dimer_tubes(dG_mono, dG_dimer, pairs, conc=1e-6, T=25.0):
+    """ Equilibrium of two-strand tubes built from one complexes run
+
+    NUPACK reports free energies for every monomer and dimer of a strand
+    list. Each pair (i, j) defines a tube holding strands i and j at conc,
+    with complexes i, j, ii, ij and jj. When i == j the tube holds two
+    distinguishable copies of the same sequence, so the heterodimer loses
+    the rotational symmetry correction included in the homodimer energy.
+
+    Args:
+        dG_mono: (strands,) monomer free energies in kcal/mol
+        dG_dimer: (strands, strands) symmetric dimer free energies
+        pairs: Sequence of (i, j) strand index pairs
+        conc: Concentration of each strand in molar
+        T: Temperature in celsius
+    Returns:
+        conc: (pairs, 5) concentrations of i, j, ii, ij and jj in molar
+    """
+    dG_mono = np.asarray(dG_mono, dtype=float)
+    dG_dimer = np.asarray(dG_dimer, dtype=float)
+    pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+    i, j = pairs[:, 0], pairs[:, 1]
+    het = dG_dimer[i, j] - (i == j) * kT(T) * np.log(2)
+    dG = np.column_stack([dG_mono[i], dG_mono[j], dG_dimer[i, i], het,
+                          dG_dimer[j, j]])
+    stoich = [[1, 0], [0, 1], [2, 0], [1, 1], [0, 2]]
+    return solve_tubes(stoich, dG, [conc, conc], T)
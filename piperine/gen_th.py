@@ -1,10 +1,44 @@
 from __future__ import division, print_function
 import numpy as np
 import re
+import importlib
+import multiprocessing
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
 from time import time
+from scipy import sparse
 import stickydesign as sd
 from . import energyfuncs_james as efj
 
+# Energy models shared within the process, by (module, targetdG, mismatchtype)
+_energyfuncs = dict()
+
+def get_energyfuncs(e_module=efj, targetdG=7.7, mismatchtype='max'):
+    """ Energy model of e_module for a target toehold energy
+
+    Models are built once per process and shared, so the parameter tables are
+    only read the first time a (module, targetdG, mismatchtype) is asked for.
+    Callers must not change the attributes of the returned model.
+
+    Args:
+        e_module: Energetics module providing the energyfuncs class
+        targetdG: Target binding energy for the toeholds in kcal/mol
+        mismatchtype: How mismatches are considered ('max', 'loop', 'dangle')
+    Returns:
+        ef: e_module.energyfuncs instance
+    """
+    key = (e_module, targetdG, mismatchtype)
+    if key not in _energyfuncs:
+        _energyfuncs[key] = e_module.energyfuncs(mismatchtype=mismatchtype,
+                                                 targetdG=targetdG)
+    return _energyfuncs[key]
+
+def clear_energyfuncs():
+    """ Forget the energy models built so far """
+    _energyfuncs.clear()
+
 def flatten(x):
     if type(x) in [list, tuple]:
         return [ z for y in x for z in flatten(y)]
@@ -12,8 +46,76 @@ def flatten(x):
         return [x]
 
 
+def toehold_attempt(n_ths, thold_l, thold_e, e_dev, m_spurious, ef, avoid_list):
+    """ One run of stickydesign for toeholds
+
+    Returns:
+        th_cands: At least n_ths toeholds with their adjacent bases, or None if
+                  the run found too few or failed
+    """
+    try:
+        ends = sd.easyends('TD', thold_l, interaction=thold_e,
+                           fdev=e_dev/thold_e, alphabet='h', adjs=['c','g'],
+                           maxspurious=m_spurious, energetics=ef,
+                           oldends=avoid_list)
+    except ValueError:
+        return None
+    if len(ends) < n_ths + len(avoid_list):
+        return None
+    # remove "avoid" sequences
+    return ends.tolist()[len(avoid_list):]
+
+def _race_worker(results, args):
+    # Repeat toehold_attempt until it succeeds or the deadline passes, and put
+    # the toeholds (or None) on results. The energetics module is passed by
+    # name so the arguments can be pickled.
+    seed, deadline, n_ths, thold_l, thold_e, e_dev, m_spurious, e_name, \
+        avoid_list = args
+    np.random.seed(seed)
+    ef = get_energyfuncs(importlib.import_module(e_name), thold_e)
+    th_cands = None
+    while th_cands is None and time() < deadline:
+        th_cands = toehold_attempt(n_ths, thold_l, thold_e, e_dev, m_spurious,
+                                   ef, avoid_list)
+    results.put(th_cands)
+
+def race_toeholds(n_jobs, deadline, n_ths, thold_l, thold_e, e_dev, m_spurious,
+                  e_module, avoid_list):
+    """ Run independently seeded toehold searches in separate processes
+
+    Returns:
+        th_cands: The first toeholds found, as toehold_attempt, or None if no
+                  search succeeded before deadline (a time() value)
+    """
+    seeds = np.random.randint(0, 2**31 - 1, n_jobs)
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(
+                 target=_race_worker,
+                 args=(results, (int(seed), deadline, n_ths, thold_l, thold_e,
+                                 e_dev, m_spurious, e_module.__name__,
+                                 avoid_list)))
+             for seed in seeds]
+    for proc in procs:
+        proc.daemon = True
+        proc.start()
+    try:
+        for n in range(n_jobs):
+            try:
+                th_cands = results.get(timeout=max(deadline - time(), 0))
+            except Empty:
+                return None
+            if th_cands is not None:
+                return th_cands
+        return None
+    finally:
+        # Stop the searches still running
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join()
+
 def get_toeholds(n_ths=6, thold_l=int(7.0), thold_e=7.7, e_dev=0.5, m_spurious=0.4,
-                 e_module=efj, timeout=8):
+                 e_module=efj, timeout=8, n_jobs=1, oldends=()):
     """ Generate specified stickyends for the Soloveichik DSD approach
 
     A given run of stickydesign may not generate toeholds that match the
@@ -21,6 +123,11 @@ def get_toeholds(n_ths=6, thold_l=int(7.0), thold_e=7.7, e_dev=0.5, m_spurious=0
     or not. Otherwise, the toeholds are matched to respect the backwards
     strand back-to-back toeholds.
 
+    With n_jobs above 1, that many independently seeded searches race in
+    separate processes and the first to find n_ths toeholds wins. The others
+    are stopped then, or once timeout has passed, even mid-run. A single
+    search only checks the timeout between runs of stickydesign.
+
     Args:
         ef: Stickydesign easyends object
         n_ths: Number of signal strand species to generate toeholds for
@@ -29,35 +136,39 @@ def get_toeholds(n_ths=6, thold_l=int(7.0), thold_e=7.7, e_dev=0.5, m_spurious=0
         e_dev: Allowable energy deviation in kcal/mol
         m_spurious: Maximum spurious interaction strength as a ratio of target
                     energy
+        e_module: Energetics module providing the energyfuncs class
+        timeout: Seconds to search before giving up
+        n_jobs: Searches run at once. None uses every core.
+        oldends: Toeholds already in the design. Only n_ths new toeholds are
+                 found, and they meet the spurious limit against these too.
     Returns:
-        ends_all: Stickydesign stickyends object
+        ends_all: Stickydesign stickyends object, or -1 on timeout
         (e_avg, e_rng): Average and range (max minus min) of toehold energies
     """
-    # Give the energetics instance the target energy
-    ef = e_module.energyfuncs(targetdG = thold_e)
-
     # Give StickyDesign a set of trivial, single-nucleotide toeholds to avoid poor
     # designs. I'm not sure if this helps now, but it did once.
     avoid_list = [i * int(thold_l + 2) for i in ['a', 'c', 't']]
+    # Existing toeholds take the adjacent bases score_toeholds gives them
+    avoid_list += ['c' + th.lower() + 'c' for th in oldends]
 
     # Generate toeholds
-    notoes = True
     startime = time()
-    while notoes:
-        try:
-            ends = sd.easyends('TD', thold_l, interaction=thold_e,
-                               fdev=e_dev/thold_e, alphabet='h', adjs=['c','g'],
-                               maxspurious=m_spurious, energetics=ef,
-                               oldends=avoid_list)
-            notoes = len(ends) < n_ths + len(avoid_list)
-        except ValueError as e:
-            if (time() - startime) > timeout:
-                return -1
-            noetoes = True
-
-    th_cands = ends.tolist()
-    # remove "avoid" sequences
-    th_cands = th_cands[len(avoid_list):]
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs > 1:
+        th_cands = race_toeholds(n_jobs, startime + timeout, n_ths, thold_l,
+                                 thold_e, e_dev, m_spurious, e_module,
+                                 avoid_list)
+    else:
+        # Give the energetics instance the target energy
+        ef = get_energyfuncs(e_module, thold_e)
+        th_cands = None
+        while th_cands is None and (time() - startime) <= timeout:
+            th_cands = toehold_attempt(n_ths, thold_l, thold_e, e_dev,
+                                       m_spurious, ef, avoid_list)
+    if th_cands is None:
+        return -1
+
     # Make as many end in c as possible
     th_cands = th_cands[:n_ths]
     th_all = [ th[1:-1] for th in th_cands]
@@ -65,19 +176,145 @@ def get_toeholds(n_ths=6, thold_l=int(7.0), thold_e=7.7, e_dev=0.5, m_spurious=0
     ends_all = sd.endarray(th_all, 'TD')
     return ends_all.tolist()
 
-def score_toeholds(toeholds, targetdG=7.7, e_module=efj):
-    toeholds_flanked = [ 'c' + th.lower() + 'c' for th in toeholds]
-    ef = e_module.energyfuncs(targetdG=targetdG)
-    ends = sd.endarray(toeholds_flanked, 'TD')
-    e_vec = ef.matching_uniform(ends)
-    e_vec_ext = ef.th_external_dG(ends)
-    e_vec_int = ef.th_internal_dG(ends)
-    e_vec_avg = (e_vec_ext + e_vec_int) / 2
-    e_vec_all = np.concatenate( (e_vec_int, e_vec_ext))
-    e_avg = e_vec_all.mean()
-    e_rng = e_vec_all.max() - e_vec_all.min()
+def toehold_codes(toeholds):
+    """ Base codes (0-3 for a, c, g, t) of a stack of toehold sets
+
+    Args:
+        toeholds: Array of shape (sets, toeholds, length) holding base codes or
+            single-letter bases, or a list of sets of toehold strings. All
+            toeholds must have the same length.
+    Returns:
+        codes: Integer array of shape (sets, toeholds, length)
+    """
+    arr = np.asarray(toeholds)
+    if arr.dtype.kind in 'US':
+        if arr.ndim == 2:
+            arr = np.array([[list(th) for th in ths] for ths in arr.tolist()])
+        try:
+            arr = np.array([efj.nt[b.lower()] for b in arr.ravel().tolist()],
+                           dtype=int).reshape(arr.shape)
+        except KeyError as e:
+            raise ValueError('Toeholds hold a base other than ACGT: {}'.format(e))
+    if arr.ndim != 3:
+        raise ValueError('Expected (sets, toeholds, length) toeholds, got shape '
+                         '{}'.format(arr.shape))
+    return arr.astype(int)
+
+def score_toeholds_batch(toeholds, targetdG=7.7, e_module=efj):
+    """ Average and range of toehold energies of many toehold sets at once
+
+    Each toehold is flanked by c on both sides and scored in its external and
+    internal contexts, as in score_toeholds. All sets are scored in one pass.
+
+    Args:
+        toeholds: Stack of toehold sets, as accepted by toehold_codes
+        targetdG: Target binding energy for the toeholds in kcal/mol
+        e_module: Energetics module providing the energyfuncs class
+    Returns:
+        (e_avg, e_rng): Vectors of the average and range (max minus min) of the
+            toehold energies of each set
+    """
+    codes = toehold_codes(toeholds)
+    n_sets, n_ths, length = codes.shape
+    ef = get_energyfuncs(e_module, targetdG)
+    flanked = np.full((n_sets * n_ths, length + 2), efj.nt['c'], dtype=int)
+    flanked[:, 1:-1] = codes.reshape(-1, length)
+    ends = sd.endarray(flanked, 'TD')
+    e_vec_ext = ef.th_external_dG(ends).reshape(n_sets, n_ths)
+    e_vec_int = ef.th_internal_dG(ends).reshape(n_sets, n_ths)
+    e_vec_all = np.concatenate((e_vec_int, e_vec_ext), axis=1)
+    e_avg = e_vec_all.mean(axis=1)
+    e_rng = e_vec_all.max(axis=1) - e_vec_all.min(axis=1)
     return (e_avg, e_rng)
 
+def score_toeholds(toeholds, targetdG=7.7, e_module=efj):
+    e_avg, e_rng = score_toeholds_batch([toeholds], targetdG, e_module)
+    return (e_avg[0], e_rng[0])
+
+def spurious_tile(seqs, ef, rows, cols, threshold):
+    """ Interactions above threshold between two slices of ends
+
+    Args:
+        seqs: Stickydesign endarray of ends followed by their complements
+        ef: Energy model computing the interactions
+        rows, cols: (start, stop) of the slices of seqs
+        threshold: Interactions at or below this energy are left out
+    Returns:
+        (i, j, e): Row and column indices in seqs, and energies of the
+            interactions above threshold
+    """
+    a = seqs[rows[0]:rows[1]]
+    b = seqs[cols[0]:cols[1]]
+    tile = ef.uniform(np.repeat(a, b.shape[0], 0),
+                      np.tile(b, (a.shape[0], 1))).reshape(a.shape[0],
+                                                           b.shape[0])
+    i, j = np.nonzero(tile > threshold)
+    return (i + rows[0], j + cols[0], tile[i, j])
+
+# Ends and energy model of a spurious_matrix pool worker
+_tile_state = None
+
+def _init_tile_worker(ends, e_name, targetdG):
+    # The energetics module is passed by name so the arguments can be pickled
+    global _tile_state
+    ends = sd.endarray(ends, 'TD')
+    _tile_state = (ends.ends.append(ends.comps),
+                   get_energyfuncs(importlib.import_module(e_name), targetdG))
+
+def _tile_worker(args):
+    seqs, ef = _tile_state
+    return spurious_tile(seqs, ef, *args)
+
+def spurious_matrix(ends, threshold=0.0, targetdG=7.7, e_module=efj,
+                    block_size=512, n_jobs=1):
+    """ Sparse all-vs-all interaction energies of ends and their complements
+
+    The interactions are computed block_size by block_size ends at a time,
+    and only those above threshold are kept, so the dense array of
+    sd.energy_array_uniform is never held in memory. The kept entries are
+    identical to the dense array's.
+
+    Args:
+        ends: Stickydesign endarray, or list of ends with their adjacent bases
+        threshold: Interactions at or below this energy in kcal/mol are left
+                   out (0.0)
+        targetdG: Target binding energy for the toeholds in kcal/mol
+        e_module: Energetics module providing the energyfuncs class
+        block_size: Rows and columns of each computed tile (512)
+        n_jobs: Processes computing tiles at once. None uses every core. (1)
+    Returns:
+        energies: scipy.sparse CSR matrix of shape (2n, 2n) for n ends, the
+            ends followed by their complements, as sd.energy_array_uniform
+    """
+    if not len(ends):
+        return sparse.csr_matrix((0, 0))
+    if not isinstance(ends, sd.endarray):
+        ends = sd.endarray(ends, 'TD')
+    n = 2 * len(ends)
+    starts = range(0, n, block_size)
+    tiles = [((r, min(r + block_size, n)), (c, min(c + block_size, n)),
+              threshold) for r in starts for c in starts]
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs > 1 and len(tiles) > 1:
+        pool = multiprocessing.Pool(min(n_jobs, len(tiles)),
+                                    initializer=_init_tile_worker,
+                                    initargs=(ends.tolist(), e_module.__name__,
+                                              targetdG))
+        try:
+            parts = list(pool.imap_unordered(_tile_worker, tiles))
+        except BaseException:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+    else:
+        seqs = ends.ends.append(ends.comps)
+        ef = get_energyfuncs(e_module, targetdG)
+        parts = [spurious_tile(seqs, ef, *tile) for tile in tiles]
+    i, j, e = [np.concatenate(x) for x in zip(*parts)]
+    return sparse.csr_matrix((e, (i, j)), shape=(n, n))
+
 
 def generate_pairs(n_ths=3, thold_l=int(7), thold_e=7.7, e_dev=0.5, m_spurious=0.4,
                  e_module='energyfuncs_james', labels=None):
@@ -217,7 +454,13 @@ if __name__ == "__main__":
             if ends_all == 3:
                 print("dunno")
 
-    # Plot energy array
-    e_array = sd.energy_array_uniform(ends_all, ef)
+    # Spurious interactions over the limit, leaving out each end with its
+    # own complement
+    e_array = spurious_matrix(ends_all, m_spurious * thold_e, thold_e,
+                              energetics).tocoo()
+    n_ends = len(ends_all)
+    over = abs(e_array.row - e_array.col) != n_ends
+    print('{} spurious interactions above {} kcal/mol'.format(
+          over.sum(), m_spurious * thold_e))
 
     print('Done!')
@@ -0,0 +1,102 @@
+""" Reuse of per-item heuristic results between scoring runs
+
+Most heuristics in tdm.EvalCurrent are sums, means or maxima over items that
+each depend on a few pepper names: strand pairs for TSI and toehold
+occupancy, complexes for the tube ensemble defect, single strands for the SS
+scores. A ScoreState records the result of every item together with the
+resolved sequence of every name. When a design is rescored with a few domains
+changed, every strand, complex and composite name built from those domains
+resolves to a new sequence, so only the items touching a changed name are
+computed again and the aggregates are rebuilt from the stored items.
+
+Items are keyed by the names they depend on, as a tuple, under a stage name.
+Results that depend on the whole design, such as WSI, are stored under the
+empty key and reused only when no name changed.
+
+    state = ScoreState.load('design.state')   # empty if missing
+    tdm.EvalCurrent(..., state=state)
+    state.save('design.state')
+"""
+from __future__ import division, print_function
+
+import os
+import json
+
+class ScoreState(object):
+    """ Per-item results of the last scoring run and the sequences they used
+
+    Attributes:
+        seqs: Dictionary of pepper names to the sequences last scored
+        params: Scoring parameters the items were computed with
+        items: Dictionary of stage name to a dictionary of name tuples to
+            results
+        changed: Names whose sequence changed in the last update
+        reused: Number of items served from the state since the last update
+    """
+    def __init__(self, seqs=None, params=None, items=None):
+        self.seqs = dict(seqs) if seqs else dict()
+        self.params = params
+        self.items = items if items else dict()
+        self.changed = set()
+        self.reused = 0
+
+    def update(self, seq_dict, params=None):
+        """ Move to a new set of sequences, dropping the stale items
+
+        Items depending on a name whose sequence changed, or that no longer
+        exists, are removed. All items are removed when params differ from
+        the ones they were computed with.
+
+        Returns:
+            changed: Set of names that are new or whose sequence changed
+        """
+        changed = set(name for name in seq_dict
+                      if self.seqs.get(name) != seq_dict[name])
+        gone = set(self.seqs) - set(seq_dict.keys())
+        if params != self.params:
+            self.items = dict()
+        stale = changed | gone
+        for stage, results in self.items.items():
+            if len(stale) == 0:
+                break
+            for key in list(results):
+                if len(key) == 0 or not stale.isdisjoint(key):
+                    del results[key]
+        self.seqs = dict(seq_dict.items())
+        self.params = params
+        self.changed = changed
+        self.reused = 0
+        return changed
+
+    def get(self, stage, key):
+        """ Stored result of an item, or None """
+        value = self.items.get(stage, dict()).get(tuple(key))
+        if value is not None:
+            self.reused += 1
+        return value
+
+    def put(self, stage, key, value):
+        """ Store the result of an item """
+        self.items.setdefault(stage, dict())[tuple(key)] = value
+
+    def save(self, filename):
+        """ Write the state to a JSON file """
+        items = dict((stage, [[list(key), value]
+                              for key, value in results.items()])
+                     for stage, results in self.items.items())
+        with open(filename, 'w') as f:
+            json.dump({'seqs': self.seqs, 'params': self.params,
+                       'items': items}, f)
+
+    @classmethod
+    def load(cls, filename):
+        """ Read a state written by save. A missing file gives an empty
+        state. """
+        if not os.path.isfile(filename):
+            return cls()
+        with open(filename) as f:
+            data = json.load(f)
+        items = dict((stage, dict((tuple(key), value)
+                                  for key, value in results))
+                     for stage, results in data['items'].items())
+        return cls(data['seqs'], data['params'], items)
@@ -0,0 +1,153 @@
+""" Resolution of composite pepper names into sequences
+
+tdm.make_pepper_seq_dict turns names such as 'r0-Gate' or 'x1-Top+r0-a' into
+sequences by replacing, in reverse-sorted order, every known name found inside
+them with its sequence. Names whose sequence contains an 'N' are skipped.
+
+A PepperNameResolver does that work once per scheme. A trie over the known
+names finds the names contained in each composite name, and the sequential
+replacement is replayed on placeholders, giving each composite name a list of
+literal text and name references. Resolving a design is then a join of the
+current sequences. Plans are kept per set of skipped names, so they are reused
+across reps as long as the same names hold an 'N'.
+
+Replaying on placeholders matches the sequential replacement unless a name
+applied after a sequence was inserted could match text of that sequence. Such
+names, and names referring to empty sequences, are resolved by direct
+replacement instead.
+"""
+from __future__ import division, print_function
+
+def replace_names(pname, s_keys, seq_dict):
+    """ Resolve one name by sequential replacement
+
+    Args:
+        pname: Composite pepper name
+        s_keys: Known names, sorted in reverse
+        seq_dict: Dictionary of known names to sequences
+    Returns:
+        pswap: pname with the known names replaced by their sequences
+        pmem: pname with the known names removed; empty when fully resolved
+    """
+    pswap = pname[:]
+    pmem = pname[:]
+    for key in s_keys:
+        if key in pname and 'N' not in seq_dict[key]:
+            pswap = pswap.replace(key, seq_dict[key])
+            pmem = pmem.replace(key, '')
+    return pswap, pmem
+
+class PepperNameResolver(object):
+    """ Resolver compiled for a list of composite names and a set of known names
+
+    Args:
+        pepperlist: Composite names to resolve
+        keys: Known names, the keys of the sequence dictionaries to be resolved
+    """
+    def __init__(self, pepperlist, keys):
+        self.names = list(pepperlist)
+        self.keys = sorted(keys, reverse=True)
+        self._plans = dict()
+        # Trie over the known names. The '' entry of a node holds the name
+        # ending there.
+        self._trie = dict()
+        for key in self.keys:
+            node = self._trie
+            for c in key:
+                node = node.setdefault(c, dict())
+            node[''] = key
+        rank = dict((key, r) for r, key in enumerate(self.keys))
+        self._contained = dict()
+        for name in set(self.names):
+            found = self.contained(name)
+            self._contained[name] = sorted(found, key=rank.get)
+
+    def contained(self, name):
+        """ Set of known names occurring in name """
+        found = set()
+        for i in range(len(name)):
+            node = self._trie
+            for c in name[i:]:
+                node = node.get(c)
+                if node is None:
+                    break
+                if '' in node:
+                    found.add(node[''])
+        return found
+
+    def plan(self, excluded):
+        """ Per-name resolution plans when the names in excluded are skipped
+
+        Each plan is (complete, tokens, risky, used). complete tells whether
+        every character of the name is covered by known names. tokens is a list
+        of (is_name, text) pieces. risky holds the characters of names applied
+        after a sequence had been inserted, and used the names referenced.
+        """
+        if excluded in self._plans:
+            return self._plans[excluded]
+        plans = dict()
+        for name, found in self._contained.items():
+            applied = [key for key in found if key not in excluded]
+            pmem = name
+            tokens = [(False, name)]
+            risky = set()
+            for key in applied:
+                pmem = pmem.replace(key, '')
+                if any(is_name for is_name, text in tokens):
+                    risky.update(key)
+                new = []
+                for is_name, text in tokens:
+                    if is_name:
+                        new.append((is_name, text))
+                        continue
+                    parts = text.split(key)
+                    for k, part in enumerate(parts):
+                        if k > 0:
+                            new.append((True, key))
+                        if part:
+                            new.append((False, part))
+                tokens = new
+            plans[name] = (pmem == '', tokens, frozenset(risky),
+                           frozenset(applied))
+        self._plans[excluded] = plans
+        return plans
+
+    def resolve(self, seq_dict, update=False):
+        """ Dictionary of composite names to sequences
+
+        Matches tdm.make_pepper_seq_dict: with update, only names fully
+        covered by known names are returned.
+        """
+        excluded = frozenset(key for key in self.keys if 'N' in seq_dict[key])
+        plans = self.plan(excluded)
+        alphabet = set()
+        for key in self.keys:
+            alphabet.update(seq_dict[key])
+        out = dict()
+        for name in self.names:
+            if name in out:
+                continue
+            complete, tokens, risky, used = plans[name]
+            if update and not complete:
+                continue
+            if '' in self._trie or risky & alphabet or \
+                    any(seq_dict[key] == '' for key in used):
+                out[name] = replace_names(name, self.keys, seq_dict)[0]
+            else:
+                out[name] = ''.join(seq_dict[text] if is_name else text
+                                    for is_name, text in tokens)
+        return out
+
+_resolvers = dict()
+max_resolvers = 8
+
+def get_resolver(pepperlist, keys):
+    """ Compiled resolver for pepperlist and keys, reused between calls """
+    cache_key = (tuple(pepperlist), tuple(sorted(keys)))
+    resolver = _resolvers.get(cache_key)
+    if resolver is None:
+        if len(_resolvers) >= max_resolvers:
+            _resolvers.pop(next(iter(_resolvers)))
+        resolver = PepperNameResolver(pepperlist, keys)
+        _resolvers[cache_key] = resolver
+    return resolver
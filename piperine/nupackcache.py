@@ -0,0 +1,202 @@
+""" Content-addressed, on-disk cache of NUPACK results
+
+The NUPACK wrappers in tdm are pure functions of their sequences and
+thermodynamic parameters, so their results can be stored and reused across
+design reps, rescoring runs, and repeated strand pairs. Entries live in a
+single SQLite file and are keyed by a hash of everything that determines the
+result. When the file grows past max_size, the least recently used entries are
+evicted. Access times of hits are kept in memory and written in one
+transaction every so many puts, before eviction, and on close, so that lookups
+never write to the file.
+
+The location of the default cache is read from the PIPERINE_CACHE environment
+variable (~/.piperine/nupack_cache.sqlite if unset). Setting PIPERINE_CACHE to
+an empty string disables caching.
+"""
+from __future__ import division, print_function
+
+import os
+import json
+import time
+import atexit
+import hashlib
+import sqlite3
+
+default_file = os.path.join(os.path.expanduser('~'), '.piperine',
+                            'nupack_cache.sqlite')
+default_max_size = 256 * 2**20
+
+def make_key(seqs, command, T, material, sodium, dangles, ComplexSize):
+    """ Hash the inputs that determine a NUPACK result
+
+    Args:
+        seqs: Ordered list of sequences given to NUPACK
+        command: String naming the NUPACK programs and any extra inputs
+                 (e.g. the target structure for 'defect')
+        T: Temperature in celsius
+        material: NUPACK parameter set ('dna')
+        sodium: Sodium concentration in molar
+        dangles: NUPACK dangle treatment ('some')
+        ComplexSize: Maximum complex size
+    Returns:
+        key: Hex digest identifying the result
+    """
+    fields = ['+'.join(s.upper() for s in seqs), command,
+              '{:.4f}'.format(T), material, '{:.4f}'.format(sodium), dangles,
+              str(ComplexSize)]
+    return hashlib.sha1('\n'.join(fields).encode('utf-8')).hexdigest()
+
+class NUPACKCache(object):
+    """ SQLite-backed key-value store with size-based eviction
+
+    Values are anything json can serialize. Connections are opened lazily and
+    per process, so one instance may be shared with multiprocessing workers.
+    hits and misses count lookups made by this process. Access times of hits
+    wait in memory until flush.
+    """
+    def __init__(self, filename=default_file, max_size=default_max_size):
+        self.filename = filename
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        self._puts = 0
+        self._atimes = dict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_pid'] = None
+        state['_atimes'] = dict()
+        return state
+
+    def _connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            dirname = os.path.dirname(self.filename)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            conn = sqlite3.connect(self.filename, timeout=60)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS results '
+                         '(key TEXT PRIMARY KEY, value TEXT, '
+                         'size INTEGER, atime REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS results_atime '
+                         'ON results (atime)')
+            conn.commit()
+            if self._pid is not None:
+                # Hits recorded by the parent process are its own to write
+                self._atimes = dict()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        """ Return the cached value for key, or None on a miss """
+        conn = self._connect()
+        row = conn.execute('SELECT value FROM results WHERE key = ?',
+                           (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._atimes[key] = time.time()
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """ Store value under key, checking the size limit every so often """
+        conn = self._connect()
+        text = json.dumps(value)
+        conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                     (key, text, len(key) + len(text), time.time()))
+        conn.commit()
+        self._puts += 1
+        if self._puts % 64 == 0:
+            self.evict()
+
+    def flush(self):
+        """ Write the access times of hits since the last flush """
+        if not self._atimes:
+            return
+        conn = self._connect()
+        conn.executemany('UPDATE results SET atime = ? WHERE key = ?',
+                         [(t, key) for key, t in self._atimes.items()])
+        conn.commit()
+        self._atimes = dict()
+
+    def close(self):
+        """ Flush access times and close this process's connection """
+        if self._conn is not None and self._pid == os.getpid():
+            self.flush()
+            self._conn.close()
+        self._conn = None
+        self._pid = None
+
+    def size(self):
+        """ Total bytes of keys and values held in the cache """
+        conn = self._connect()
+        return conn.execute('SELECT COALESCE(SUM(size), 0) FROM results'
+                            ).fetchone()[0]
+
+    def evict(self):
+        """ Drop least recently used entries until under 90% of max_size """
+        self.flush()
+        total = self.size()
+        if total <= self.max_size:
+            return
+        conn = self._connect()
+        target = total - int(0.9 * self.max_size)
+        freed = 0
+        stale = []
+        for key, size in conn.execute('SELECT key, size FROM results '
+                                      'ORDER BY atime'):
+            stale.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany('DELETE FROM results WHERE key = ?', stale)
+        conn.commit()
+
+    def clear(self):
+        """ Remove every entry and reset the counters """
+        conn = self._connect()
+        conn.execute('DELETE FROM results')
+        conn.commit()
+        self._atimes = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """ Dictionary of hit/miss counters and cache occupancy """
+        conn = self._connect()
+        entries = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': entries, 'size': self.size(),
+                'max_size': self.max_size, 'filename': self.filename}
+
+_cache = None
+_configured = False
+
+def set_cache(filename=default_file, max_size=default_max_size):
+    """ Configure the process-wide cache. A filename of None disables it. """
+    global _cache, _configured
+    _configured = True
+    if _cache is not None:
+        _cache.close()
+    if filename:
+        _cache = NUPACKCache(filename, max_size)
+    else:
+        _cache = None
+    return _cache
+
+def get_cache():
+    """ The process-wide cache, or None when caching is disabled """
+    if not _configured:
+        set_cache(os.environ.get('PIPERINE_CACHE', default_file))
+    return _cache
+
+@atexit.register
+def _close_cache():
+    # Write the access times of the process-wide cache's last hits
+    if _cache is not None:
+        _cache.close()
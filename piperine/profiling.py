@@ -0,0 +1,89 @@
+""" Per-stage timing of design scoring
+
+A Profile splits a scoring run into named stages and records, for each stage,
+its wall time and every external process launched through the runner, with a
+histogram of process latencies.
+
+    prof = Profile()
+    with prof.stage('TSI'):
+        ...
+    prof.as_dict()
+"""
+from __future__ import division, print_function
+
+import time
+import json
+import bisect
+from contextlib import contextmanager
+
+# Upper edges, in seconds, of the process latency histogram bins. The last bin
+# holds everything slower.
+latency_bins = [0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, 100]
+
+# Stage currently collecting process calls, if any
+_active = None
+
+def record_call(argv, seconds):
+    """ Count one external process against the active stage """
+    if _active is not None:
+        _active.add_call(argv, seconds)
+
+class Stage(object):
+    """ Wall time and process calls of one stage """
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.latencies = []
+        self.programs = dict()
+
+    def add_call(self, argv, seconds):
+        self.latencies.append(seconds)
+        program = argv[0].split('/')[-1] if len(argv) > 0 else ''
+        self.programs[program] = self.programs.get(program, 0) + 1
+
+    def as_dict(self):
+        counts = [0] * (len(latency_bins) + 1)
+        for t in self.latencies:
+            counts[bisect.bisect_left(latency_bins, t)] += 1
+        n = len(self.latencies)
+        return {'wall': self.wall,
+                'processes': n,
+                'programs': dict(self.programs),
+                'process_time': sum(self.latencies),
+                'latency_min': min(self.latencies) if n else None,
+                'latency_mean': sum(self.latencies) / n if n else None,
+                'latency_max': max(self.latencies) if n else None,
+                'latency_bins': list(latency_bins),
+                'latency_counts': counts}
+
+class Profile(object):
+    """ Ordered collection of Stages """
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        """ Time the enclosed block as stage name, collecting process calls """
+        global _active
+        current = Stage(name)
+        self.stages.append(current)
+        previous = _active
+        _active = current
+        start = time.time()
+        try:
+            yield current
+        finally:
+            current.wall += time.time() - start
+            _active = previous
+
+    def as_dict(self):
+        """ Dictionary of stage name to stage statistics, plus the total """
+        out = dict((s.name, s.as_dict()) for s in self.stages)
+        out['total'] = {'wall': sum(s.wall for s in self.stages),
+                        'processes': sum(len(s.latencies) for s in self.stages)}
+        return out
+
+def write_json(profiles, filename):
+    """ Write a profile dictionary, or a list of them, to a JSON file """
+    with open(filename, 'w') as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
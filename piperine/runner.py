@@ -0,0 +1,161 @@
+""" Launching of external tools (NUPACK, spuriousSSM)
+
+Commands are given as argv lists and started directly with
+asyncio.create_subprocess_exec, without a shell. A Runner bounds how many
+commands run at once, kills commands that exceed their timeout, and raises
+ToolError when a command fails, so a broken NUPACK install is reported where
+it happens instead of as a missing output file later on.
+
+    runner = get_runner()
+    runner.run(['complexes', '-T', '25.0', prefix], stdout=prefix + '.out')
+    runner.run_many([(argv1, out1), (argv2, out2)], max_jobs=8)
+"""
+from __future__ import division, print_function
+
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+
+from . import profiling
+
+class ToolError(Exception):
+    """ An external command failed, timed out, or could not be started """
+    def __init__(self, argv, message, returncode=None, stderr=''):
+        self.argv = list(argv)
+        self.returncode = returncode
+        self.stderr = stderr
+        text = '{}: {}'.format(' '.join(self.argv), message)
+        if stderr:
+            text += '\n' + stderr.strip()
+        super(ToolError, self).__init__(text)
+
+class Runner(object):
+    """ Runs argv lists with a concurrency limit and per-call timeouts
+
+    Args:
+        max_jobs: Most commands in flight at once in run_many. None uses the
+            number of cores.
+        timeout: Seconds before a command is killed. None waits forever.
+    """
+    def __init__(self, max_jobs=None, timeout=None):
+        if max_jobs is None or max_jobs < 1:
+            max_jobs = multiprocessing.cpu_count()
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+
+    async def run_async(self, argv, stdout=None, timeout=None, semaphore=None):
+        """ Coroutine running one command
+
+        Args:
+            argv: Command and arguments
+            stdout: Filename receiving the command's standard output, or None
+                to discard it
+            timeout: Seconds before the command is killed (self.timeout)
+            semaphore: Optional asyncio.Semaphore bounding concurrency
+        Returns:
+            returncode: Always 0; failures raise ToolError
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if semaphore is not None:
+            async with semaphore:
+                return await self._exec(argv, stdout, timeout)
+        return await self._exec(argv, stdout, timeout)
+
+    async def _exec(self, argv, stdout, timeout):
+        out = open(stdout, 'wb') if stdout else asyncio.subprocess.DEVNULL
+        start = time.time()
+        try:
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *argv, stdin=asyncio.subprocess.DEVNULL, stdout=out,
+                    stderr=asyncio.subprocess.PIPE)
+            except OSError as e:
+                raise ToolError(argv, 'could not start ({})'.format(e))
+            try:
+                _, err = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                await self._kill(proc)
+                raise ToolError(argv, 'timed out after {} s'.format(timeout),
+                                proc.returncode)
+            except asyncio.CancelledError:
+                await self._kill(proc)
+                raise
+        finally:
+            if stdout:
+                out.close()
+            profiling.record_call(argv, time.time() - start)
+        if proc.returncode != 0:
+            raise ToolError(argv, 'exited with status {}'.format(proc.returncode),
+                            proc.returncode, err.decode('utf-8', 'replace'))
+        return proc.returncode
+
+    async def _kill(self, proc):
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+
+    async def _run_all(self, jobs, max_jobs, timeout):
+        semaphore = asyncio.Semaphore(max_jobs)
+        tasks = [asyncio.ensure_future(self.run_async(argv, stdout, timeout,
+                                                      semaphore))
+                 for argv, stdout in jobs]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # On failure, stop the remaining commands before reporting
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run(self, argv, stdout=None, timeout=None):
+        """ Run one command and wait for it. See run_async. """
+        return self.run_many([(argv, stdout)], 1, timeout)[0]
+
+    def run_many(self, jobs, max_jobs=None, timeout=None):
+        """ Run (argv, stdout) jobs concurrently from one event loop
+
+        At most max_jobs (self.max_jobs) commands run at once. The first
+        failure cancels and kills the other commands and is raised.
+        """
+        if max_jobs is None or max_jobs < 1:
+            max_jobs = self.max_jobs
+        coro = self._run_all(list(jobs), max_jobs, timeout)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        # Called from inside a running loop (e.g. a notebook): use a private
+        # loop on a helper thread.
+        result = []
+        def target():
+            try:
+                result.append(asyncio.run(coro))
+            except BaseException as e:
+                result.append(e)
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+        if isinstance(result[0], BaseException):
+            raise result[0]
+        return result[0]
+
+_runner = None
+
+def set_runner(max_jobs=None, timeout=None):
+    """ Configure the process-wide runner """
+    global _runner
+    _runner = Runner(max_jobs, timeout)
+    return _runner
+
+def get_runner():
+    """ The process-wide runner. The timeout defaults to the
+    PIPERINE_TOOL_TIMEOUT environment variable, in seconds, if set. """
+    if _runner is None:
+        timeout = os.environ.get('PIPERINE_TOOL_TIMEOUT')
+        set_runner(timeout=float(timeout) if timeout else None)
+    return _runner
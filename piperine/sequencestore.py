@@ -0,0 +1,159 @@
+""" Packed storage of the sequences of a design
+
+A SequenceStore holds every domain, strand and complex sequence of a design in
+one buffer. Each sequence is a (offset, length) slice of it. Bases are kept as
+uint8 codes, A, C, G, T being 0 to 3 and any other character (N, '+', ...) a
+code of 4 or more, so sequences, their reverse complements and their k-mers
+are NumPy views and array operations rather than Python string loops.
+
+A store is a read-only mapping of names to sequence strings and can be passed
+wherever a seq_dict is expected.
+
+    store = SequenceStore(seq_dict)
+    store['r0-a']               # 'ACGT...'
+    store.codes('r0-a')         # uint8 view into the buffer
+    store.revcomp_codes('r0-a') # uint8 view into the reverse complement buffer
+"""
+from __future__ import division, print_function
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import numpy as np
+
+bases = 'ACGT'
+
+class SequenceStore(Mapping):
+    """ Read-only mapping of names to sequences backed by one packed buffer
+
+    Args:
+        seq_dict: Dictionary, or any mapping, of names to sequence strings
+
+    Attributes:
+        text: All sequences joined, in index order
+        buf: uint8 codes of text
+        rc_buf: Reverse complement of buf. The reverse complement of the
+            sequence at (offset, length) is rc_buf[n-offset-length:n-offset].
+        alphabet: Characters of the codes, alphabet[code] being the character
+        index: Dictionary of names to (offset, length)
+    """
+    def __init__(self, seq_dict):
+        names = list(seq_dict.keys())
+        seqs = [seq_dict[name] for name in names]
+        self.index = dict()
+        offset = 0
+        for name, seq in zip(names, seqs):
+            self.index[name] = (offset, len(seq))
+            offset += len(seq)
+        self.text = ''.join(seqs)
+        others = sorted(set(self.text) - set(bases))
+        self.alphabet = bases + ''.join(others)
+        if len(self.alphabet) > 256:
+            raise ValueError('Too many distinct characters for uint8 codes')
+        # Code of each character, looked up by code point
+        chars = np.frombuffer(self.text.encode('utf-32-le'), dtype=np.uint32)
+        points = np.array([ord(c) for c in self.alphabet], dtype=np.uint32)
+        order = np.argsort(points)
+        self.buf = order[np.searchsorted(points[order], chars)].astype(np.uint8)
+        # Complements of A, C, G, T; other characters are their own
+        complement = np.arange(len(self.alphabet), dtype=np.uint8)
+        complement[:4] = [3, 2, 1, 0]
+        self.rc_buf = complement[self.buf][::-1].copy()
+
+    def __getitem__(self, name):
+        offset, length = self.index[name]
+        return self.text[offset:offset+length]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def codes(self, name):
+        """ uint8 codes of a sequence, a view into buf """
+        offset, length = self.index[name]
+        return self.buf[offset:offset+length]
+
+    def revcomp_codes(self, name):
+        """ uint8 codes of the reverse complement of a sequence, a view into
+        rc_buf """
+        offset, length = self.index[name]
+        n = len(self.buf)
+        return self.rc_buf[n-offset-length:n-offset]
+
+    def decode(self, codes):
+        """ String of an array of codes """
+        return ''.join(self.alphabet[c] for c in np.asarray(codes).tolist())
+
+    def revcomp(self, name):
+        """ Reverse complement of a sequence """
+        return self.decode(self.revcomp_codes(name))
+
+    def kmers(self, name, k):
+        """ Integer code of every k-mer of a sequence
+
+        A k-mer of bases only is numbered in base 4, A being 0 and T 3, from
+        the first base. k-mers holding any other character are -1.
+
+        Returns:
+            kmers: int64 array with one entry per start position
+        """
+        return kmer_codes(self.codes(name), k)
+
+    def revcomp_kmers(self, name, k):
+        """ Integer code of the reverse complement of every k-mer of a
+        sequence, numbered as in kmers
+
+        Returns:
+            kmers: int64 array with one entry per start position, entry i
+                being the reverse complement of the k-mer starting at i
+        """
+        return kmer_codes(self.revcomp_codes(name), k)[::-1]
+
+    def concat(self, names):
+        """ Codes of several sequences, each followed by a separator
+
+        Separators are 256 + the position of the sequence in names, so they
+        differ from each other and from every code.
+
+        Returns:
+            codes: int64 array of the joined codes
+            doc: Position in names of the sequence of each entry
+            offset: Position within its sequence of each entry
+        """
+        spans = [self.index[name] for name in names]
+        lengths = np.array([length + 1 for offset, length in spans],
+                           dtype=np.int64)
+        total = int(lengths.sum())
+        doc = np.repeat(np.arange(len(spans), dtype=np.int64), lengths)
+        starts = np.cumsum(lengths) - lengths
+        offset = np.arange(total, dtype=np.int64) - starts[doc]
+        src = np.array([o for o, l in spans], dtype=np.int64)[doc] + offset
+        codes = np.empty(total, dtype=np.int64)
+        last = offset == lengths[doc] - 1
+        codes[~last] = self.buf[src[~last]]
+        codes[last] = 256 + doc[last]
+        return codes, doc, offset
+
+def kmer_codes(codes, k):
+    """ Integer code of every k-mer of an array of codes, as
+    SequenceStore.kmers """
+    if len(codes) < k:
+        return np.zeros(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    weights = 4 ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    out = windows.astype(np.int64).dot(weights)
+    out[(windows > 3).any(1)] = -1
+    return out
+
+def as_store(seq_dict):
+    """ seq_dict itself if it is a SequenceStore, otherwise a store of it """
+    if isinstance(seq_dict, SequenceStore):
+        return seq_dict
+    return SequenceStore(seq_dict)
@@ -0,0 +1,171 @@
+""" Generalized suffix array over a set of sequences
+
+The sequences are joined with a distinct separator after each one, so no
+common prefix runs from one sequence into the next. The suffix array is built
+by prefix doubling in NumPy and the LCP array by Kasai's algorithm.
+
+GeneralizedSuffixArray.common_substrings reports, for every pair of sequences
+sharing a substring of some minimum length, the length of their longest
+common substring. Adjacent suffixes are merged in order of decreasing LCP, so
+the first time two sequences end up in the same group is at the length of
+their longest common substring. The cost is near-linear in the total sequence
+length plus the number of sequence pairs met while merging.
+"""
+from __future__ import division, print_function
+
+import numpy as np
+
+def suffix_array(codes):
+    """ Suffix array of an integer array, by prefix doubling
+
+    Args:
+        codes: 1-D integer array
+    Returns:
+        sa: Start positions of the suffixes of codes in sorted order
+    """
+    codes = np.asarray(codes)
+    n = len(codes)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    rank = np.unique(codes, return_inverse=True)[1].astype(np.int64).ravel()
+    k = 1
+    while True:
+        second = np.full(n, -1, dtype=np.int64)
+        second[:n-k] = rank[k:]
+        sa = np.lexsort((second, rank))
+        first_sorted = rank[sa]
+        second_sorted = second[sa]
+        new = np.concatenate([[0], (first_sorted[1:] != first_sorted[:-1]) |
+                                   (second_sorted[1:] != second_sorted[:-1])])
+        rank = np.empty(n, dtype=np.int64)
+        rank[sa] = np.cumsum(new)
+        if rank.max() == n - 1 or k >= n:
+            return sa
+        k *= 2
+
+def lcp_array(codes, sa):
+    """ Longest common prefix of each suffix with the one before it in sa
+
+    lcp[0] is 0. Uses Kasai's linear-time algorithm.
+    """
+    codes = list(np.asarray(codes).tolist())
+    n = len(codes)
+    rank = [0] * n
+    for i, s in enumerate(sa.tolist()):
+        rank[s] = i
+    lcp = [0] * n
+    h = 0
+    sa_list = sa.tolist()
+    for i in range(n):
+        r = rank[i]
+        if r > 0:
+            j = sa_list[r - 1]
+            while i + h < n and j + h < n and codes[i + h] == codes[j + h]:
+                h += 1
+            lcp[r] = h
+            if h > 0:
+                h -= 1
+        else:
+            h = 0
+    return np.array(lcp, dtype=np.int64)
+
+class GeneralizedSuffixArray(object):
+    """ Suffix and LCP arrays over a list of sequences
+
+    Args:
+        seqs: List of strings. Repeated strings are indexed separately.
+        codes, doc, offset: Joined integer codes of seqs, with a distinct
+            separator after each sequence that sorts after every character,
+            and the matching doc and offset arrays. Built from seqs if not
+            given.
+
+    Attributes:
+        sa: Suffix array of the joined text
+        lcp: LCP array matching sa
+        doc: Index in seqs of the sequence each text position belongs to
+        offset: Position within its sequence of each text position
+    """
+    def __init__(self, seqs, codes=None, doc=None, offset=None):
+        self.seqs = list(seqs)
+        if codes is None:
+            codes = []
+            doc = []
+            offset = []
+            for k, seq in enumerate(self.seqs):
+                codes.extend(ord(c) for c in seq)
+                # Separators sort after every character and differ from each
+                # other
+                codes.append(0x110000 + k)
+                doc.extend([k] * (len(seq) + 1))
+                offset.extend(range(len(seq) + 1))
+        self.codes = np.array(codes, dtype=np.int64)
+        self.doc = np.array(doc, dtype=np.int64)
+        self.offset = np.array(offset, dtype=np.int64)
+        self.sa = suffix_array(self.codes)
+        self.lcp = lcp_array(self.codes, self.sa)
+
+    @classmethod
+    def from_store(cls, store, names):
+        """ Index of the sequences of names in a sequencestore.SequenceStore,
+        built from its packed codes """
+        codes, doc, offset = store.concat(names)
+        return cls([store[name] for name in names], codes, doc, offset)
+
+    def common_substrings(self, min_length=5):
+        """ Longest common substring of every pair of sequences sharing one
+
+        Args:
+            min_length: Shortest common substring to report (5)
+        Returns:
+            matches: Dictionary from (a, b), with a < b indices into seqs, to
+                (length, doc, offset). seqs[doc][offset:offset+length] is a
+                longest common substring of seqs[a] and seqs[b]. Pairs without
+                a common substring of min_length are left out.
+        """
+        n = len(self.sa)
+        parent = list(range(n))
+        members = [None] * n
+        sa_doc = self.doc[self.sa].tolist()
+        sa_list = self.sa.tolist()
+        doc = self.doc.tolist()
+        offset = self.offset.tolist()
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        def group(x):
+            root = find(x)
+            if members[root] is None:
+                members[root] = set([sa_doc[root]])
+            return root
+
+        matches = dict()
+        lcp = self.lcp
+        order = np.nonzero(lcp >= min_length)[0]
+        order = order[np.argsort(-lcp[order], kind='stable')]
+        for r in order.tolist():
+            h = int(lcp[r])
+            ra = group(r - 1)
+            rb = group(r)
+            if ra == rb:
+                continue
+            small, large = members[ra], members[rb]
+            if len(small) > len(large):
+                small, large = large, small
+            witness = (h, doc[sa_list[r]], offset[sa_list[r]])
+            for a in small:
+                for b in large:
+                    if a != b:
+                        key = (a, b) if a < b else (b, a)
+                        if key not in matches:
+                            matches[key] = witness
+            # Merge the smaller group into the larger one
+            if len(members[ra]) > len(members[rb]):
+                ra, rb = rb, ra
+            parent[ra] = rb
+            members[rb] |= members[ra]
+            members[ra] = None
+        return matches
@@ -2,7 +2,8 @@ from __future__ import division, print_function
 
 import os
 import sys
-from tempfile import mkstemp, mkdtemp
+import functools
+from tempfile import mkstemp
 
 nupackpath = os.environ['NUPACKHOME']+'/bin/'
 
@@ -11,7 +12,9 @@ import re
 import random
 whiteSpaceSearch = re.compile('\s+')
 
-from . import gen_th, energyfuncs_james
+from . import gen_th, energyfuncs_james, nupackcache, equilibrium, workspace
+from . import runner, profiling, suffixarray, nameresolver, sequencestore
+from . import wsi, artifacts
 
 class MyProgress(object):
     class ImproperInput(Exception):
@@ -37,6 +40,16 @@ class MyProgress(object):
         if self.clock >= self.clockmax:
             print('DONE')
 
+def tmp_prefix(tmpdir=None, suffix=''):
+    # Unique path prefix for temporary files. tmpdir may be a Workspace, a
+    # directory, or None for the system temp dir. Outside a Workspace an empty
+    # placeholder file is created at the returned path.
+    if isinstance(tmpdir, workspace.Workspace):
+        return tmpdir.prefix(suffix)
+    fid, prefix = mkstemp(suffix=suffix, dir=tmpdir)
+    os.close(fid)
+    return prefix
+
 def read_design(filename):
   from peppercompiler.nupack_out_grammar import document
   """Extracts the designed sequences and the mfe structures"""
@@ -77,39 +90,57 @@ def Read_Finished(filename):
     return (sequences, strands)
 
 def make_pepper_seq_dict(pepperlist, seq_dict, update=False):
-    Strandseq_dict = {}
-    s_keys = list(seq_dict.keys())
-    s_keys.sort(reverse=True)
-    for pname in pepperlist:
-        pswap = pname[:]
-        pmem = pname[:]
-        for key in s_keys:
-            if key in pname and 'N' not in seq_dict[key]:
-                pswap = pswap.replace(key, seq_dict[key])
-                pmem = pmem.replace(key, '')
-        if not update or pmem == '':
-            Strandseq_dict[pname] = pswap
-
-    return Strandseq_dict
+    # Names are resolved by a resolver compiled once per scheme and reused
+    # across reps; see nameresolver
+    resolver = nameresolver.get_resolver(pepperlist, seq_dict.keys())
+    return resolver.resolve(seq_dict, update)
+
+@functools.lru_cache(maxsize=4096)
+def kmer_positions(seq, k=5):
+    # Dictionary from each k-mer of seq to the list of its start positions
+    positions = dict()
+    for i in range(len(seq) - k + 1):
+        positions.setdefault(seq[i:i+k], []).append(i)
+    return positions
 
 def compare_sequence_notoe(s1, s2, toeholds):
-     siz = min((len(s1), len(s2)));
-     maxmatchsize = 0;
-     ismaxmatch = "FALSE";
-     mm_i = -1
-     mm_j = -1
-     for ll in range(5, siz + 1):
-         for i in range(0, len(s1) - ll + 1):
-             substr1 = s1[i:i+ll];
-             for j in range(0, len(s2) - ll + 1):
-                 substr2 = s2[j:j+ll];
-                 if ((substr1==substr2) and substr1 not in toeholds):
-                     maxmatchsize = ll;
-                     mm_i = i
-                     mm_j = j
-                     if (maxmatchsize==siz):
-                         ismaxmatch = "TRUE";
-     return [ismaxmatch, maxmatchsize, mm_i, mm_j]
+    # Find the longest substring, at least 5 nt long, shared by s1 and s2 that
+    # is not itself one of the toeholds. Returns whether the match spans the
+    # shorter sequence, the match length, and the starts of the match in s1 and
+    # s2. When several matches share the longest length, the one with the last
+    # start in s1, and then in s2, is reported. toeholds may be any container,
+    # preferably a set.
+    #
+    # A match of length 5 or more starting at (i, j) needs a shared 5-mer at
+    # (i, j). For those seed cells only, prefix[i, j], the length of the
+    # common prefix of s1[i:] and s2[j:], follows from the next cell on the
+    # diagonal: prefix[i+1, j+1] + 1 if that cell is a seed, and exactly 5
+    # otherwise.
+    siz = min((len(s1), len(s2)))
+    maxmatchsize = 0
+    ismaxmatch = "FALSE"
+    mm_i = -1
+    mm_j = -1
+    pos2 = kmer_positions(s2, 5)
+    prefix = dict()
+    for i in range(len(s1) - 5, -1, -1):
+        for j in pos2.get(s1[i:i+5], ()):
+            prefix[(i, j)] = prefix.get((i+1, j+1), 4) + 1
+    if len(prefix) == 0:
+        return [ismaxmatch, maxmatchsize, mm_i, mm_j]
+
+    # Seeds from the last start in s1, then in s2
+    seeds = sorted(prefix.items(), reverse=True)
+    for ll in range(max(prefix.values()), 4, -1):
+        for (i, j), p in seeds:
+            if p >= ll and s1[i:i+ll] not in toeholds:
+                maxmatchsize = ll
+                mm_i = i
+                mm_j = j
+                if maxmatchsize == siz:
+                    ismaxmatch = "TRUE"
+                return [ismaxmatch, maxmatchsize, mm_i, mm_j]
+    return [ismaxmatch, maxmatchsize, mm_i, mm_j]
 
 def get_seq_dicts(basename, heuristics_inputs, mfe_file=None, seq_file=None):
     if mfe_file is None:
@@ -137,7 +168,8 @@ def get_seq_dicts(basename, heuristics_inputs, mfe_file=None, seq_file=None):
 
     seq_dict = make_pepper_seq_dict(allpepperlist, seq_dict, update=True)
 
-    return seq_dict, cmplx_dict, domains_list
+    # All sequences in one packed buffer, shared by the heuristics
+    return sequencestore.SequenceStore(seq_dict), cmplx_dict, domains_list
 
 def get_heuristics_inputs(gates, strands):
     # Generate pepper-lists
@@ -181,7 +213,15 @@ def get_heuristics_inputs(gates, strands):
 def EvalCurrent(basename, gates, strands, compile_params=(7, 15, 2),
                 header=True, testname=None, seq_file=None, mfe_file=None,
                 quick=False, targetdG=7.7, energetics_module=energyfuncs_james,
-                includes=None, clean=True):
+                includes=None, clean=True, n_jobs=1, batch=False, profile=False,
+                state=None, native_wsi=False):
+    # With profile, a dictionary of per-stage wall times and external process
+    # statistics (see profiling.Profile) is appended to the returned values.
+    # With an incremental.ScoreState holding the results of a previous run,
+    # only the pairs, complexes and strands whose sequences changed are
+    # scored again, and the state is updated in place. With native_wsi, the
+    # WSI scores are computed by the wsi module rather than by spuriousSSM
+    # (experimental).
     if not testname:
         testname = basename
     if not seq_file:
@@ -196,89 +236,124 @@ def EvalCurrent(basename, gates, strands, compile_params=(7, 15, 2),
 
         seq_dict, cmplx_dict, domains_list = get_seq_dicts(basename, heuristics_inputs,
                                                            mfe_file, seq_file)
-
-
-    print('Start WSI computation')
-    if quick:
-        ssm_scores = np.random.rand(6)
-    else:
-        ssm_scores = Spurious_Weighted_Score(basename, domains_list, seq_dict,
-                                             compile_params=compile_params,
-                                             includes=includes, clean=clean)
-    ssm_names = ['WSI-Intra', 'WSI-Inter', \
-                 'WSI-Intra-1', 'WSI-Inter-1', \
-                 'Verboten', 'WSI']
-    print('')
-
-    # Score cross-strand spurious interactions
-    print('Start Cross-Strand spurious interactions computation')
-    if quick:
-        css_scores = np.random.rand(4)
-    else:
-        css_scores  = NUPACK_Eval(seq_dict, TopStrandlist, BaseStrandlist, \
-            NotToInteract, ComplexSize = 2, T = 25.0, material = 'dna',\
-             clean=clean, quiet=True)
-    css_names = ['TSI avg', 'TSI max', \
-                 'TO avg', 'TO max']
-    print('')
-
-    print('Start bad nucleotide percent computation')
-    if quick:
-        ted_scores = [np.random.rand(), 'BAD', np.random.rand()]
-    else:
-        ted_scores = NUPACK_Eval_bad_nucleotide(seq_dict, cmplx_dict, complex_names,\
-            prefix='tube_ensemble', clean=clean)
-    ted_names = ['Max Bad Nucleotide %', 'Max Defect Component',
-                 'Mean Bad Nucleotide %']
-    print('')
-
-    # Retrieve toeholds for BM score calculation
-    if not quick:
-        th_strs = [ s.get_ths() for s in strands ]
-        toeholds = [seq_dict[i] for ths in th_strs for i in ths]
-    th_names = ['TH energy avg', 'TH energy range']
-
-    # Score weighted spurious interactions
-    print('Start BM score computation')
-    if quick:
-        bm_scores = np.random.rand(2)
-    else:
-        bm_scores = BM_Eval(seq_dict, BMlist, toeholds)
-    bm_names = ['BM Score', 'Largest Match']
-    print('')
-
-    # Score intra-strand spurious interactions and toehold availability
-    print('Start Single-Strand spurious score computation')
-    if quick:
-        ss_scores = np.random.rand(4)
-    else:
-        ss_scores = SS_Eval(seq_dict, TopStranddict, T = 25.0, material = 'dna', clean=clean)
-    ss_names = ['SSU Min', 'SSU Avg', 'SSTU Min', 'SSTU Avg']
-    print('')
-
-    if quick:
-        th_scores = np.random.random((2,))
-    else:
-        th_scores = gen_th.score_toeholds(toeholds, targetdG, e_module=energetics_module)
-    th_names = ['Toehold Avg dG', 'Range of toehold dG\'s']
-
-    score_list = [css_scores, bm_scores, ss_scores, ted_scores,
-                  ssm_scores, th_scores]
-    names_list = [css_names, bm_names, ss_names, ted_names,
-                  ssm_names, th_names]
-    scores = [ elem for sub in score_list for elem in sub]
-    names  = [ elem for sub in names_list for elem in sub]
+        if state is not None:
+            changed = state.update(seq_dict,
+                                   {'compile_params': list(compile_params),
+                                    'includes': includes})
+            print('{} of {} sequences changed'.format(len(changed),
+                                                      len(seq_dict)))
+
+    prof = profiling.Profile()
+
+    # All temporary files of this evaluation go in one scratch directory,
+    # removed at the end unless clean is False
+    with workspace.Workspace(keep=not clean) as tmpdir:
+        print('Start WSI computation')
+        with prof.stage('WSI'):
+            # WSI depends on every domain, so it is reused only when no
+            # sequence changed
+            stored = None if quick or state is None else state.get('wsi', [])
+            if quick:
+                ssm_scores = np.random.rand(6)
+            elif stored is not None:
+                ssm_scores = stored
+            else:
+                ssm_scores = Spurious_Weighted_Score(basename, domains_list, seq_dict,
+                                                     compile_params=compile_params,
+                                                     includes=includes, clean=clean,
+                                                     tmpdir=tmpdir,
+                                                     native=native_wsi)
+                if state is not None:
+                    state.put('wsi', [], [float(x) for x in ssm_scores])
+        ssm_names = ['WSI-Intra', 'WSI-Inter', \
+                     'WSI-Intra-1', 'WSI-Inter-1', \
+                     'Verboten', 'WSI']
+        print('')
+
+        # Score cross-strand spurious interactions
+        print('Start Cross-Strand spurious interactions computation')
+        with prof.stage('TSI'):
+            if quick:
+                css_scores = np.random.rand(4)
+            else:
+                css_scores  = NUPACK_Eval(seq_dict, TopStrandlist, BaseStrandlist, \
+                    NotToInteract, ComplexSize = 2, T = 25.0, material = 'dna',\
+                     clean=clean, quiet=True, n_jobs=n_jobs, batch=batch,
+                     tmpdir=tmpdir, state=state)
+        css_names = ['TSI avg', 'TSI max', \
+                     'TO avg', 'TO max']
+        print('')
+
+        print('Start bad nucleotide percent computation')
+        with prof.stage('TED'):
+            if quick:
+                ted_scores = [np.random.rand(), 'BAD', np.random.rand()]
+            else:
+                ted_scores = NUPACK_Eval_bad_nucleotide(seq_dict, cmplx_dict, complex_names,\
+                    prefix='tube_ensemble', clean=clean, tmpdir=tmpdir,
+                    state=state)
+        ted_names = ['Max Bad Nucleotide %', 'Max Defect Component',
+                     'Mean Bad Nucleotide %']
+        print('')
+
+        # Retrieve toeholds for BM score calculation
+        if not quick:
+            th_strs = [ s.get_ths() for s in strands ]
+            toeholds = [seq_dict[i] for ths in th_strs for i in ths]
+        th_names = ['TH energy avg', 'TH energy range']
+
+        # Score weighted spurious interactions
+        print('Start BM score computation')
+        with prof.stage('BM'):
+            if quick:
+                bm_scores = np.random.rand(2)
+            else:
+                bm_scores = BM_Eval(seq_dict, BMlist, toeholds)
+        bm_names = ['BM Score', 'Largest Match']
+        print('')
+
+        # Score intra-strand spurious interactions and toehold availability
+        print('Start Single-Strand spurious score computation')
+        with prof.stage('SS'):
+            if quick:
+                ss_scores = np.random.rand(4)
+            else:
+                ss_scores = SS_Eval(seq_dict, TopStranddict, T = 25.0, material = 'dna', clean=clean,
+                                    batch=batch, tmpdir=tmpdir, state=state)
+        ss_names = ['SSU Min', 'SSU Avg', 'SSTU Min', 'SSTU Avg']
+        print('')
+
+        with prof.stage('TH'):
+            if quick:
+                th_scores = np.random.random((2,))
+            else:
+                th_scores = gen_th.score_toeholds(toeholds, targetdG, e_module=energetics_module)
+        th_names = ['Toehold Avg dG', 'Range of toehold dG\'s']
+        if state is not None:
+            print('Reused {} stored results'.format(state.reused))
+
+        score_list = [css_scores, bm_scores, ss_scores, ted_scores,
+                      ssm_scores, th_scores]
+        names_list = [css_names, bm_names, ss_names, ted_names,
+                      ssm_names, th_names]
+        scores = [ elem for sub in score_list for elem in sub]
+        names  = [ elem for sub in names_list for elem in sub]
 
     if header:
         output = (scores, names)
     else:
         output = scores
+    if profile:
+        if header:
+            output = output + (prof.as_dict(),)
+        else:
+            output = (output, prof.as_dict())
     return output
 
 def NUPACK_Eval_bad_nucleotide(mfe_seqs, ideal_structs, complex_names, \
                             ComplexSize=3, T=25.0, material='dna', \
                             clean=True, quiet=True, prefix='ted_calc',
-                            tmpdir=None):
+                            tmpdir=None, state=None):
     # This function takes in the design's sequences and intended interaction
     # structures and returns the tube ensemble defect, the concentration of incorr
     # ectly base-paired nucleotides in a tube. I think this is best prepared and t
@@ -286,7 +361,9 @@ def NUPACK_Eval_bad_nucleotide(mfe_seqs, ideal_structs, complex_names, \
     #  separate tubes and the concentration is summed over each of these tubes.
 
     # Loop through the complexes in all systems to calculate their contribution
-    # to the tube ensemble defect (ted) , the running sum of such contributions
+    # to the tube ensemble defect (ted) , the running sum of such contributions.
+    # With an incremental.ScoreState, complexes whose sequence is unchanged
+    # reuse their stored concentration and defect.
     # Set up empty lists
     ted_vec = np.empty(len(complex_names))
     name_list = list()
@@ -305,9 +382,18 @@ def NUPACK_Eval_bad_nucleotide(mfe_seqs, ideal_structs, complex_names, \
         params = [nseq, T, material, quiet, prefix]
         struct = ideal_structs[cmpx_name]
         bp = len(re.findall('[()]', struct))
-        # Retrieve the estimated complex concentration
-        est_conc = NUPACK_Cmpx_Conc(seq_list, params, clean=clean, tmpdir=tmpdir)
-        cmpx_defect = NUPACK_Cmpx_Defect(seq_list, struct, params, clean=clean, tmpdir=tmpdir)
+        # Retrieve the estimated complex concentration and ensemble defect
+        key = [cmpx_name, struct]
+        stored = None if state is None else state.get('complexes', key)
+        if stored is None:
+            est_conc, cmpx_defect = NUPACK_Cmpx_Conc_Defect(seq_list, struct,
+                                                            params, clean=clean,
+                                                            tmpdir=tmpdir)
+            if state is not None:
+                state.put('complexes', key,
+                          [float(est_conc), float(cmpx_defect)])
+        else:
+            est_conc, cmpx_defect = stored
         ted = cmpx_defect * min(est_conc, target_conc) + \
                len(seq) * max(target_conc - est_conc, 0)
         ted_vec[counter] = ted
@@ -323,47 +409,211 @@ def NUPACK_Eval_bad_nucleotide(mfe_seqs, ideal_structs, complex_names, \
     #return [Bad Nucleotide % max, max complex name, mean bad nuc]
     return [bad_nuc_max, bn_max_name, bad_nuc_vec.mean()]
 
+def unique_pairs(pairs, seq_dict):
+    """ Reduce (name1, name2) pairs to distinct unordered sequence pairs
+
+    Interaction scores depend only on the two sequences, not on their names or
+    order, so pairs that resolve to the same two sequences need scoring once.
+
+    Args:
+        pairs: List of (name1, name2) tuples, keys of seq_dict
+        seq_dict: Dictionary of pepper names to sequences
+    Returns:
+        uniq: List of (name1, name2) pairs, one per distinct sequence pair
+        inverse: For each entry of pairs, the index of its pair in uniq
+    """
+    uniq = []
+    index = dict()
+    inverse = []
+    for s1, s2 in pairs:
+        key = tuple(sorted([seq_dict[s1], seq_dict[s2]]))
+        if key not in index:
+            index[key] = len(uniq)
+            uniq.append((s1, s2))
+        inverse.append(index[key])
+    return uniq, inverse
+
+def score_pairs(pairs, seq_dict, ComplexSize=2, T=25.0, material='dna',
+                clean=True, prog=None, tmpdir=None, max_jobs=1):
+    """ Run NUPACKIntScore over a list of (name1, name2) pairs
+
+    Pairs missing from the cache are run through the shared runner with up to
+    max_jobs NUPACK processes in flight at once. Results come back in the
+    order of pairs.
+
+    Args:
+        pairs: List of (name1, name2) tuples, keys of seq_dict
+        seq_dict: Dictionary of pepper names to sequences
+        prog: Optional MyProgress instance, incremented once per pair
+        max_jobs: Concurrent NUPACK processes. None uses every core.
+    Returns:
+        scores: List of interaction scores, one per pair
+    """
+    if max_jobs is None or max_jobs < 1:
+        max_jobs = runner.get_runner().max_jobs
+    scores = [None] * len(pairs)
+    keys = [None] * len(pairs)
+    todo = []
+    cache = None
+    for n, (s1, s2) in enumerate(pairs):
+        cache, keys[n], scores[n] = cache_lookup(
+            [seq_dict[s1], seq_dict[s2]], 'complexes int_score', T, material,
+            ComplexSize)
+        if scores[n] is None:
+            todo.append(n)
+        elif prog is not None:
+            prog.inc()
+
+    # Hand the runner a few rounds of work at a time, so that progress is
+    # reported and only so many input files exist at once.
+    chunk = 16 * max_jobs
+    for start in range(0, len(todo), chunk):
+        block = todo[start:start+chunk]
+        seq_lists = [[seq_dict[pairs[n][0]], seq_dict[pairs[n][1]]]
+                     for n in block]
+        results = NUPACK_Complexes_many(seq_lists, ComplexSize, T, material,
+                                        clean=clean, tmpdir=tmpdir,
+                                        max_jobs=max_jobs)
+        for n, (ids, counts, energies, _, _) in zip(block, results):
+            scores[n] = int_score(counts, energies, T)
+            if cache is not None:
+                cache.put(keys[n], scores[n])
+            if prog is not None:
+                prog.inc()
+    return scores
+
+def score_pairs_batch(pairs, seq_dict, T=25.0, material='dna', clean=True,
+                      prog=None, tmpdir=None):
+    """ Score (name1, name2) pairs from a single NUPACK complexes run
+
+    Every strand appearing in an uncached pair is written to one complexes
+    input with ComplexSize=2. Each pair's two-strand tube is then solved
+    in-process from the monomer and dimer free energies, giving the same
+    score as NUPACKIntScore with one process launch in total.
+
+    Args:
+        pairs: List of (name1, name2) tuples, keys of seq_dict
+        seq_dict: Dictionary of pepper names to sequences
+        prog: Optional MyProgress instance, incremented once per pair
+    Returns:
+        scores: List of interaction scores, one per pair
+    """
+    ComplexSize = 2
+    conc = 1e-6
+    scores = [None] * len(pairs)
+    keys = [None] * len(pairs)
+    todo = []
+    cache = nupackcache.get_cache()
+    for n, (s1, s2) in enumerate(pairs):
+        if cache is not None:
+            _, keys[n], scores[n] = cache_lookup(
+                [seq_dict[s1], seq_dict[s2]], 'complexes batch int_score', T,
+                material, ComplexSize)
+        if scores[n] is None:
+            todo.append(n)
+        elif prog is not None:
+            prog.inc()
+
+    if len(todo) > 0:
+        seqs = []
+        index = {}
+        for n in todo:
+            for name in pairs[n]:
+                seq = seq_dict[name]
+                if seq not in index:
+                    index[seq] = len(seqs)
+                    seqs.append(seq)
+        dG_mono, dG_dimer = NUPACK_Dimer_Energies(seqs, T, material,
+                                                  clean=clean, tmpdir=tmpdir)
+        idx_pairs = [(index[seq_dict[pairs[n][0]]], index[seq_dict[pairs[n][1]]])
+                     for n in todo]
+        concs = equilibrium.dimer_tubes(dG_mono, dG_dimer, idx_pairs, conc, T)
+        dimer_scores = 100 * concs[:, 2:].sum(1) / (2 * conc)
+        for n, intsc in zip(todo, dimer_scores):
+            scores[n] = float(intsc)
+            if cache is not None:
+                cache.put(keys[n], scores[n])
+            if prog is not None:
+                prog.inc()
+    return scores
+
 def NUPACK_Eval(seq_dict, TopStrandlist, BaseStrandlist, NotToInteract,\
                 ComplexSize = 2, T = 25.0, material = 'dna', \
-                clean=True, quiet=True):
+                clean=True, quiet=True, n_jobs=1, batch=False, tmpdir=None,
+                state=None):
+    # n_jobs sets the number of NUPACK processes scoring pairs at once. Use
+    # None or a value below 1 to use every available core. With batch, all
+    # pairs are scored from a single NUPACK run (see score_pairs_batch), which
+    # requires ComplexSize 2. With an incremental.ScoreState, only pairs
+    # involving a changed strand are scored.
+    if batch and ComplexSize != 2:
+        raise ValueError('Batched pair scoring requires ComplexSize 2')
+
+    def distinct_scores(pairs):
+        # Each distinct unordered pair of sequences is scored once
+        uniq, inverse = unique_pairs(pairs, seq_dict)
+        print('{} pairs, {} distinct'.format(len(pairs), len(uniq)))
+        prog = MyProgress(len(uniq)) if len(uniq) > 0 else None
+        if batch:
+            scores = score_pairs_batch(uniq, seq_dict, T, material,
+                                       clean=clean, prog=prog, tmpdir=tmpdir)
+        else:
+            scores = score_pairs(uniq, seq_dict, ComplexSize, T, material,
+                                 clean=clean, prog=prog, tmpdir=tmpdir,
+                                 max_jobs=n_jobs)
+        return [scores[k] for k in inverse]
+
+    def pair_scores(pairs):
+        # Pairs stored in the state are not scored again
+        if state is None:
+            return distinct_scores(pairs)
+        known = [state.get('pairs', pair) for pair in pairs]
+        todo = [pair for pair, score in zip(pairs, known) if score is None]
+        scores = iter(distinct_scores(todo) if todo else [])
+        out = [next(scores) if score is None else score for score in known]
+        for pair, score in zip(pairs, out):
+            state.put('pairs', pair, float(score))
+        return out
+
     numstrands = len(TopStrandlist)
 
     TopSpuriousPairwise = np.zeros([numstrands, numstrands]);
 
     print('Calculating Top Strand Pairwise interactions')
-    countmax = (numstrands**2 + numstrands)/2
-    prog = MyProgress(countmax)
-    for i in range(numstrands):
-        for j in range(i,numstrands):
-            intij = NUPACKIntScore(TopStrandlist[i], TopStrandlist[j],
-                                   seq_dict, ComplexSize, T, material, quiet, clean=clean)
-            TopSpuriousPairwise[i, j] = intij
-            TopSpuriousPairwise[j, i] = intij
-            prog.inc()
+    indices = [(i, j) for i in range(numstrands) for j in range(i, numstrands)]
+    pairs = [(TopStrandlist[i], TopStrandlist[j]) for i, j in indices]
+    scores = pair_scores(pairs)
+    for (i, j), intij in zip(indices, scores):
+        TopSpuriousPairwise[i, j] = intij
+        TopSpuriousPairwise[j, i] = intij
 
     numbase = len(BaseStrandlist)
 
     BaseSpurious = np.zeros([numbase, 1]);
 
     print('Calculating Toehold occupation')
-    countmax = sum(map(len, list(NotToInteract.values())))
-    prog = MyProgress(countmax)
-    for i in range(numbase):
-        thisstrand = BaseStrandlist[i]
-        notinteract = NotToInteract[thisstrand]
-        nonintnum = len(notinteract)
-        for j in range(nonintnum):
-            intij = NUPACKIntScore(thisstrand, notinteract[j], seq_dict,
-                                   ComplexSize, T, material, quiet, clean=clean)
-            BaseSpurious[i] = BaseSpurious[i] + intij
-            prog.inc()
+    indices = [i for i in range(numbase)
+                 for notinteract in NotToInteract[BaseStrandlist[i]]]
+    pairs = [(BaseStrandlist[i], notinteract)
+             for i in range(numbase)
+             for notinteract in NotToInteract[BaseStrandlist[i]]]
+    scores = pair_scores(pairs)
+    for i, intij in zip(indices, scores):
+        BaseSpurious[i] = BaseSpurious[i] + intij
 
     TSI_vec = TopSpuriousPairwise.sum(0)
     return [TSI_vec.mean(), TSI_vec.max(), BaseSpurious.mean(),
             BaseSpurious.max()]
 
 
-def SS_Eval(seq_dict, TopStranddict, T = 25.0, material = 'dna', clean=True):
+def SS_Eval(seq_dict, TopStranddict, T = 25.0, material = 'dna', clean=True,
+            batch=False, tmpdir=None, state=None):
+    # With batch, every strand is scored from a single NUPACK run (see
+    # SS_Eval_batch). With an incremental.ScoreState, only changed strands are
+    # scored.
+    if batch:
+        return SS_Eval_batch(seq_dict, TopStranddict, T, material, clean,
+                             tmpdir=tmpdir, state=state)
     numstrands = len(TopStranddict)
 
     MinProbs = []
@@ -374,9 +624,15 @@ def SS_Eval(seq_dict, TopStranddict, T = 25.0, material = 'dna', clean=True):
 
     prog = MyProgress(numstrands)
     for strand, toe_regions in TopStranddict.items():
+            key = [strand, str(list(toe_regions))]
+            stored = None if state is None else state.get('ss', key)
+            if stored is None:
+                stored = NUPACKSSScore(strand, seq_dict, T, material,
+                                       toe_regions, clean=clean, tmpdir=tmpdir)
+                if state is not None:
+                    state.put('ss', key, [float(x) for x in stored])
             [min_Unpaired, sum_Unpaired, min_Unpaired_toe, sum_Unpaired_toe,\
-             NumBases] = \
-                NUPACKSSScore(strand, seq_dict, T, material, toe_regions, clean=clean)
+             NumBases] = stored
             # Grow the minimum unpaired probability lists
             MinProbs.append(min_Unpaired)
             MinProbs_toe.append(min_Unpaired_toe)
@@ -393,26 +649,78 @@ def SS_Eval(seq_dict, TopStranddict, T = 25.0, material = 'dna', clean=True):
     return [min(MinProbs), np.mean(avg_Unpaired), \
             min(MinProbs_toe), np.mean(avg_Unpaired_toe)]
 
+def SS_Eval_batch(seq_dict, TopStranddict, T=25.0, material='dna', clean=True,
+                  tmpdir=None, state=None):
+    # Same scores as SS_Eval, with the unpaired probabilities of all strands
+    # coming from one NUPACK run and the statistics computed on arrays. Rows
+    # are strands and columns are bases; bases NUPACK does not report as
+    # unpaired are masked out, as NUPACKSSScore skips them. With an
+    # incremental.ScoreState, only changed strands go to NUPACK.
+    names = list(TopStranddict.keys())
+    seqs = [seq_dict[name] for name in names]
+    if state is None:
+        unpaired = NUPACK_Unpaired_batch(seqs, T, material, clean=clean,
+                                         tmpdir=tmpdir)
+    else:
+        unpaired = [state.get('unpaired', [name]) for name in names]
+        todo = [k for k, u in enumerate(unpaired) if u is None]
+        if len(todo) > 0:
+            new = NUPACK_Unpaired_batch([seqs[k] for k in todo], T, material,
+                                        clean=clean, tmpdir=tmpdir)
+            for k, u in zip(todo, new):
+                unpaired[k] = u
+                state.put('unpaired', [names[k]], u)
+    lens = np.array([len(seq) for seq in seqs])
+    probs = np.zeros((len(seqs), lens.max()))
+    present = np.zeros(probs.shape, dtype=bool)
+    toe = np.zeros(probs.shape, dtype=bool)
+    n_toe = np.zeros(len(seqs))
+    for k, name in enumerate(names):
+        entries = np.asarray(unpaired[k], dtype=float).reshape(-1, 2)
+        bases = entries[:, 0].astype(int) - 1
+        probs[k, bases] = entries[:, 1]
+        present[k, bases] = True
+        toe_regions = TopStranddict[name]
+        n_toe[k] = len(toe_regions)
+        toe_bases = np.array([b for b in toe_regions
+                              if b is not None and 0 < b <= lens[k]],
+                             dtype=int) - 1
+        toe[k, toe_bases] = True
+
+    toe = toe & present
+    min_unpaired = np.where(present, probs, 1).min(1)
+    avg_unpaired = np.where(present, probs, 0).sum(1) / lens
+    min_unpaired_toe = np.where(toe, probs, 1).min(1)
+    sum_unpaired_toe = np.where(toe, probs, 0).sum(1)
+    avg_unpaired_toe = np.where(n_toe > 0,
+                                sum_unpaired_toe / np.maximum(n_toe, 1), 0)
+    return [min_unpaired.min(), np.mean(avg_unpaired), \
+            min_unpaired_toe.min(), np.mean(avg_unpaired_toe)]
+
 def BM_Eval(seq_dict, BMlist, toeholds):
+    # Score every pair of branch migration domains by their longest shared
+    # non-toehold substring. Pairs are found all at once from a generalized
+    # suffix array over the domains, built from the packed codes when seq_dict
+    # is a SequenceStore. When the longest shared substring of a pair is a
+    # toehold, compare_sequence_notoe looks for the longest one that is not.
     w_exp = np.concatenate([np.zeros((5,)), np.power(2, np.arange(6))])
     BM_score = 0
     Largest_match = 0
 
-    numstrings = len(BMlist);
-
-    prog = MyProgress((numstrings**2 - numstrings)/2)
-    for ctr in range(numstrings):
-        strand1 = BMlist[ctr];
-        for strand2 in BMlist[ctr+1:]:
-            [ismaxmatch, maxmatch, mm_i, mm_j] = \
-                compare_sequence_notoe(seq_dict[strand1],
-                                       seq_dict[strand2],
-                                       toeholds)
-            if maxmatch > Largest_match:
-                Largest_match = maxmatch
+    toeholds = set(toeholds)
+    if isinstance(seq_dict, sequencestore.SequenceStore):
+        index = suffixarray.GeneralizedSuffixArray.from_store(seq_dict, BMlist)
+    else:
+        index = suffixarray.GeneralizedSuffixArray(
+            [seq_dict[name] for name in BMlist])
+    seqs = index.seqs
+    for (a, b), (maxmatch, d, offset) in index.common_substrings(5).items():
+        if seqs[d][offset:offset+maxmatch] in toeholds:
+            maxmatch = compare_sequence_notoe(seqs[a], seqs[b], toeholds)[1]
+        if maxmatch > Largest_match:
+            Largest_match = maxmatch
 
-            BM_score = BM_score + w_exp[int(min(maxmatch, 10))]
-            prog.inc()
+        BM_score = BM_score + w_exp[int(min(maxmatch, 10))]
 
     return [BM_score, Largest_match]
 
@@ -426,7 +734,8 @@ def Spurious_Weighted_Score(basename,
                             beta=5,
                             clean=True,
                             includes=None,
-                            tmpdir=None):
+                            tmpdir=None,
+                            native=False):
     # This function calculates Niranjan's weighted spurious interaction score, for i
     # nteractions between k and km nucleotides long. It takes the following steps:
     #   * Read in sequences from mfe file
@@ -434,9 +743,13 @@ def Spurious_Weighted_Score(basename,
     #   * Recompile circuit
     #   * Run spuriousSSM negative design and generate scores
     #   * Grab spuriousSSM scores and calculate NSIH
+    # With native, the scores are computed in process from the constraint
+    # files by the wsi module instead of running spuriousSSM. This is
+    # experimental, as the total is not yet known to match spuriousSSM's.
+    # When the constraint files written while designing these sequences are
+    # in the artifacts registry, they are used and nothing is recompiled.
 
     import sys
-    import subprocess
     import re
     import os
     import numpy as np
@@ -444,54 +757,71 @@ def Spurious_Weighted_Score(basename,
     from .designer import call_compiler, call_design
 
     # Command parameters
-    if tmpdir is None:
-        fid, prefix = mkstemp()
-    else:
-        tdir = mkdtemp(dir=tmpdir)
-        fid, prefix = mkstemp(dir=tdir)
     ssm_params = "bored=%s tmax=%s spurious_range=%s" % (bored, tmax, spurious_range)
 
-    fid, fixed_file = mkstemp(suffix='.fixed', dir=tmpdir)
-    os.close(fid)
-    fid, compiled_file = mkstemp(suffix='.pil', dir=tmpdir)
-    os.close(fid)
-    fid, save_file = mkstemp(suffix='.save', dir=tmpdir)
-    os.close(fid)
-    fid, out_file = mkstemp(suffix='.mfe', dir=tmpdir)
-    os.close(fid)
-    fid, spurious_output = mkstemp(suffix='.txt', dir=tmpdir)
-    os.close(fid)
-
-    # Write sequences to fixed file
-    f = open(fixed_file, 'w')
-    for dom in domains_list:
-        f.write('sequence ' + dom + ' = ' + seq_dict[dom] + ' \n')
-    f.close()
-
-    # Compile to a pil file
-    call_compiler(basename,
-                    args=compile_params,
-                    outputname=compiled_file,
-                    savename=save_file,
-                    fixed_file=fixed_file,
-                    includes=includes)
-
-    # Make constraint files
-    fid, design_tmp = mkstemp(dir=tmpdir)
-    os.close(fid)
-    call_design(basename, infilename=compiled_file, outfilename=out_file,
-                just_files=True, tempname=design_tmp)
-    stname = design_tmp+'.st'
-    wcname = design_tmp+'.wc'
-    eqname = design_tmp+'.eq'
+    domain_seqs = dict((dom, seq_dict[dom]) for dom in domains_list)
+    registered = artifacts.get_registry().lookup(domain_seqs, compile_params)
+    if registered is not None:
+        # Constraint files left by the design of these sequences
+        st, wc, eq = registered.constraints()
+        wcname = registered.files['.wc']
+        eqname = registered.files['.eq']
+        temp_files = []
+    else:
+        fixed_file = tmp_prefix(tmpdir, '.fixed')
+        compiled_file = tmp_prefix(tmpdir, '.pil')
+        save_file = tmp_prefix(tmpdir, '.save')
+        out_file = tmp_prefix(tmpdir, '.mfe')
+
+        # Write sequences to fixed file
+        f = open(fixed_file, 'w')
+        for dom in domains_list:
+            f.write('sequence ' + dom + ' = ' + seq_dict[dom] + ' \n')
+        f.close()
+
+        # Compile to a pil file
+        call_compiler(basename,
+                        args=compile_params,
+                        outputname=compiled_file,
+                        savename=save_file,
+                        fixed_file=fixed_file,
+                        includes=includes)
+
+        # Make constraint files
+        design_tmp = tmp_prefix(tmpdir)
+        call_design(basename, infilename=compiled_file, outfilename=out_file,
+                    just_files=True, tempname=design_tmp)
+        stname = design_tmp+'.st'
+        wcname = design_tmp+'.wc'
+        eqname = design_tmp+'.eq'
+        temp_files = [fixed_file, compiled_file, save_file, out_file, stname,
+                      wcname, eqname, design_tmp]
+        st = None
+
+    if native:
+        if st is None:
+            st, wc, eq = wsi.read_constraints(stname, wcname, eqname)
+        scores = wsi.wsi_scores(st, wc, eq, spurious_range=spurious_range,
+                                beta=beta)
+        if clean:
+            for f in temp_files:
+                if os.path.isfile(f):
+                    os.remove(f)
+        return scores
+
+    if registered is not None:
+        # The design-time .st file is a template, so spuriousSSM is given
+        # the designed sequence
+        stname = tmp_prefix(tmpdir, '.st')
+        with open(stname, 'w') as f:
+            f.write(st + '\n')
+        temp_files.append(stname)
+    spurious_output = tmp_prefix(tmpdir, '.txt')
 
     # Commented code generates MFE file
-    spur_exc = 'spuriousSSM score=automatic template=%s wc=%s eq=%s %s> %s'
-    command = spur_exc % (stname, wcname, eqname, ssm_params, spurious_output)
-    os.system(command)
-    #subprocess.check_call(spur_exc)
-
-    w_lin = np.concatenate([np.zeros((beta, )), np.arange(12-beta)+1, 7*np.ones((2,))])
+    argv = ['spuriousSSM', 'score=automatic', 'template=' + stname,
+            'wc=' + wcname, 'eq=' + eqname] + ssm_params.split()
+    runner.get_runner().run(argv, stdout=spurious_output)
 
     f = open(stname)
     st = f.readline()[:-1]
@@ -505,124 +835,80 @@ def Spurious_Weighted_Score(basename,
     spc_text = open(spurious_output).read()
     lines = spc_text[spc_text.rfind('spurious1'):].split('\n')
     i, j = [ int(x) for x in re.findall(num, lines[0])[1:]]
-    w = w_lin[i-1:j]
-    vec = np.array([ np.float(x) for x in re.findall(num, lines[2])])
+    w = wsi.linear_weights(i, j, beta)
+    vec = np.array([ float(x) for x in re.findall(num, lines[2])])
     score_vec = vec * w
     mis_intra_score = score_vec.sum()  #/ num_strands
 
-    vec = np.array([ np.float(x) for x in re.findall(num, lines[4])])
+    vec = np.array([ float(x) for x in re.findall(num, lines[4])])
     score_vec = vec * w
     mis_inter_score = score_vec.sum()  #/ num_strands
 
     lines = spc_text[spc_text.rfind('spurious('):].split('\n')
     i, j = [ int(x) for x in re.findall(num, lines[0])]
-    w = w_lin[i-1:j]
-    vec = np.array([ np.float(x) for x in re.findall(num, lines[2])])
+    w = wsi.linear_weights(i, j, beta)
+    vec = np.array([ float(x) for x in re.findall(num, lines[2])])
     score_vec = vec * w
     spc_intra_score = score_vec.sum()  #/ num_strands
 
-    vec = np.array([ np.float(x) for x in re.findall(num, lines[4])])
+    vec = np.array([ float(x) for x in re.findall(num, lines[4])])
     score_vec = vec * w
     spc_inter_score = score_vec.sum()  #/ num_strands
 
     vec_str = spc_text[spc_text.rfind('** score_verboten'):]
-    verboten_score = np.float(re.findall(num, vec_str)[0])  #/ num_strands
+    verboten_score = float(re.findall(num, vec_str)[0])  #/ num_strands
 
     vec_str = spc_text[spc_text.rfind('-weighted score = '):].split('\n')[0]
-    wsi_score = np.float(re.findall(num, vec_str)[-1])  #/ num_strands
+    wsi_score = float(re.findall(num, vec_str)[-1])  #/ num_strands
 
     if clean:
-        for f in [fixed_file, compiled_file, save_file, out_file,
-                  stname, wcname, eqname, spurious_output]:
-            os.remove(f)
+        for f in temp_files + [spurious_output]:
+            if os.path.isfile(f):
+                os.remove(f)
 
     return [spc_intra_score, spc_inter_score, \
             mis_intra_score, mis_inter_score, \
             verboten_score, wsi_score]
 
+def cache_lookup(seqs, command, T, material, ComplexSize):
+    # Look up a NUPACK result in the shared on-disk cache. Returns the cache
+    # (None when caching is disabled), the key for storing a fresh result, and
+    # the cached value (None on a miss).
+    cache = nupackcache.get_cache()
+    if cache is None:
+        return None, None, None
+    key = nupackcache.make_key(seqs, nupackpath + command, T, material, 0.5,
+                               'some', ComplexSize)
+    return cache, key, cache.get(key)
+
 def NUPACK_Cmpx_Conc(seqs, params=[3, 25, 'dna', 1, 'ted_calc'], clean=True, tmpdir=None):
-    # This function calls the NUPACK methods 'complexes' and 'concentrations' to
-    # calculate the expected concentration of the desired complex. Note that the
-    # output of 'concentrations' will contain the expected concentrations of all
-    # possible complexes, but this function returns only that of the desired com
-    # plex, which is always 1 1 1.
+    # This function calls the NUPACK method 'complexes' and solves for the
+    # equilibrium of the resulting tube to calculate the expected concentration
+    # of the desired complex. Every complex in the tube gets a concentration,
+    # but this function returns only that of the desired complex, which is
+    # always 1 1 1.
     # Retrieve parameters
     ComplexSize, T, material, quiet, f_prefix = params
-    # Setup input files to nupack commands
-    intsc = 0;
-    if tmpdir is None:
-        fid, prefix = mkstemp()
-    else:
-        tdir = mkdtemp(dir=tmpdir)
-        fid, prefix = mkstemp(dir=tdir)
-    os.close(fid)
-    ofile = prefix + '.out'
-    cfile = prefix + '.con'
-    ifile = prefix + '.in'
-    efile = prefix + '.eq'
-    xfile = prefix + '.osx'
-    file_list = [ofile, cfile, ifile, efile, xfile, prefix]
-    #for fn in file_list:
-    #    with open(fn, 'w') as f:
-    #        f.write('')
-    #        f.close()
-
-    # Complexes input file
-    n_seqs = len(seqs)
-    f = open(ifile,'w')
-    f.write(str(n_seqs) + '\n')
-    for seq in seqs:
-      f.write(seq + '\n')
-
-    f.write(str(ComplexSize))
-    f.close()
-
-    # Concentrations input file, start with 1uM for all
-    f = open(cfile,'w')
-    for i in range(n_seqs):
-      f.write('1e-6\n')
-
-    f.close()
-
-    # Run NUPACK's complexes function
-    cmd = nupackpath + 'complexes -T %.1f '+\
-          '-material %s -ordered -pairs -mfe -dangles some -sodium 0.5 %s > %s'
-    cmd = cmd % (T,material,prefix,ofile)
-    os.system(cmd)
-
-    # Run NUPACK's concentrations function
-    if quiet:
-        cmd = nupackpath + 'concentrations '+\
-              '-ordered -pairs -cutoff 0.000001 -sort 0 -quiet ' + prefix
-    else:
-        cmd = nupackpath + 'concentrations '+\
-              '-ordered -pairs -cutoff 0.000001 -sort 0 ' + prefix
-    os.system(cmd)
-
-    # Read the equilibrium concentrations
-    f = open(efile)
-    lines = f.readlines()
-    f.close()
-
-    if clean:
-        for f in file_list:
-            if os.path.isfile(f):
-                os.remove(f)
+    seqs = list(seqs)
+    cache, key, out = cache_lookup(seqs, 'complexes cmpx_conc', T, material,
+                                   ComplexSize)
+    if out is not None:
+        return out
+
+    # Start with 1uM for all strands. Each strand ordering is its own species,
+    # as in NUPACK's 'concentrations -ordered'.
+    ids, counts, energies = NUPACK_Complexes(seqs, ComplexSize, T, material,
+                                             clean=clean, tmpdir=tmpdir)[:3]
+    concs = equilibrium.solve_tubes(counts, energies, [1e-6] * len(seqs), T)[0]
 
-    # Count the number of commented lines
-    ctr = 0;
-    while (lines[ctr][0] == '%'):
-        ctr = ctr + 1
-
-    # Scrape the concentrations from the output file
     out = 0.0
-    for count in range(ctr, len(lines)):
-        lineData = whiteSpaceSearch.split(lines[count])
-        if lineData[2:(ComplexSize+2)] == (ComplexSize ) * ['1'] :
-            trial_out = float(lineData[-2])
-            if trial_out > out:
-                out = trial_out
+    if counts.shape[1] >= ComplexSize:
+        target = (counts[:, :ComplexSize] == 1).all(1)
+        if target.any():
+            out = float(concs[target].max())
 
+    if cache is not None:
+        cache.put(key, out)
     return out
 
 
@@ -635,15 +921,15 @@ def NUPACK_Cmpx_Defect(seqs, struct, params=[3, 25, 'dna', 1, 'ted_calc'], clean
     ## TODO : Add error for when complex size is less than the number of provided sequences
     # Retrieve parameters
     ComplexSize, T, material, quiet, prefix = params
+    seqs = list(seqs)
+    cache, key, defect = cache_lookup(seqs, 'defect ' + struct, T, material,
+                                      ComplexSize)
+    if defect is not None:
+        return defect
     cmpx_string = ' '.join(["{}".format(x+1) for x in range(ComplexSize)]) + '\n'
     # Setup input files to nupack commands
     intsc = 0;
-    if tmpdir is None:
-        fid, prefix = mkstemp()
-    else:
-        tdir = mkdtemp(dir=tmpdir)
-        fid, prefix = mkstemp(dir=tdir)
-    os.close(fid)
+    prefix = tmp_prefix(tmpdir)
     ofile = prefix + '.out'
     ifile = prefix + '.in'
     file_list = [prefix, ofile, ifile]
@@ -661,10 +947,9 @@ def NUPACK_Cmpx_Defect(seqs, struct, params=[3, 25, 'dna', 1, 'ted_calc'], clean
     f.close()
 
     # Run NUPACK's defect function
-    cmd = nupackpath + 'defect -T %.1f '+\
-          '-material %s -dangles some -multi -sodium 0.5 %s > %s'
-    cmd = cmd % (T,material,prefix,ofile)
-    os.system(cmd)
+    argv = [nupackpath + 'defect', '-T', '%.1f' % T, '-material', material,
+            '-dangles', 'some', '-multi', '-sodium', '0.5', prefix]
+    runner.get_runner().run(argv, stdout=ofile)
 
     # Read the equilibrium concentrations
     f = open(ofile)
@@ -680,82 +965,311 @@ def NUPACK_Cmpx_Defect(seqs, struct, params=[3, 25, 'dna', 1, 'ted_calc'], clean
     ctr = 0
     while (lines[ctr][0] == '%'):
         ctr = ctr + 1
-    return float(lines[ctr])
+    defect = float(lines[ctr])
+    if cache is not None:
+        cache.put(key, defect)
+    return defect
+
+
+def NUPACK_Cmpx_Conc_Defect(seqs, struct, params=[3, 25, 'dna', 1, 'ted_calc'],
+                            clean=True, tmpdir=None):
+    # Combines NUPACK_Cmpx_Conc and NUPACK_Cmpx_Defect using a single run of
+    # NUPACK's 'complexes'. The concentration of the 1 1 1 complex comes from
+    # the tube equilibrium, and the ensemble defect of struct comes from the
+    # pair probabilities of the ordering in which seqs are given.
+    ComplexSize, T, material, quiet, f_prefix = params
+    seqs = list(seqs)
+    cache, key, out = cache_lookup(seqs, 'complexes conc_defect ' + struct, T,
+                                   material, ComplexSize)
+    if out is not None:
+        return tuple(out)
+
+    ids, counts, energies, ppairs, orders = NUPACK_Complexes(
+        seqs, ComplexSize, T, material, pairs=True, cutoff=1e-8, clean=clean,
+        tmpdir=tmpdir)
+    concs = equilibrium.solve_tubes(counts, energies, [1e-6] * len(seqs), T)[0]
+
+    conc = 0.0
+    if counts.shape[1] >= ComplexSize:
+        target = (counts[:, :ComplexSize] == 1).all(1)
+        if target.any():
+            conc = float(concs[target].max())
+
+    # NUPACK lists each ordering under one rotation, so find the rotation of
+    # 1, 2, ..., n and the base offset it implies.
+    n_seqs = len(seqs)
+    lens = [len(seq) for seq in seqs]
+    for cmpx_id, order in orders.items():
+        if len(order) != n_seqs or order[0] < 1:
+            continue
+        first = order[0] - 1
+        if list(order) == [(first + i) % n_seqs + 1 for i in range(n_seqs)]:
+            offset = sum(lens[:first])
+            break
+    else:
+        raise ValueError('NUPACK reported no ordering {}'.format(
+            ' '.join(str(i + 1) for i in range(n_seqs))))
+    N, entries = ppairs[cmpx_id]
+    entries = entries.copy()
+    entries[:, 0] = (entries[:, 0] - 1 + offset) % N + 1
+    paired = entries[:, 1] <= N
+    entries[paired, 1] = (entries[paired, 1] - 1 + offset) % N + 1
+    defect = ensemble_defect(N, entries, struct)
+
+    if cache is not None:
+        cache.put(key, [conc, defect])
+    return conc, defect
+
+def struct_partners(struct):
+    # Convert a dot-paren structure, with strands separated by '+', into a list
+    # giving the base each base is paired to. Bases are numbered from 1, and
+    # unpaired bases get N + 1, matching NUPACK's ppairs files.
+    struct = struct.replace('+', '')
+    N = len(struct)
+    partners = [N + 1] * N
+    stack = []
+    for i, c in enumerate(struct):
+        if c == '(':
+            stack.append(i)
+        elif c == ')':
+            j = stack.pop()
+            partners[i] = j + 1
+            partners[j] = i + 1
+    return partners
+
+def ensemble_defect(N, entries, struct):
+    # Complex ensemble defect of struct: the expected number of bases whose
+    # pairing state differs from struct. entries are (i, j, probability) pair
+    # probabilities as read by read_ppairs, where each pair i < j <= N is
+    # listed once and j = N + 1 means base i is unpaired.
+    partners = np.array(struct_partners(struct))
+    if len(partners) != N:
+        raise ValueError('Structure has {} bases but the complex has '
+                         '{}'.format(len(partners), N))
+    entries = np.asarray(entries, dtype=float).reshape(-1, 3)
+    i = entries[:, 0].astype(int)
+    j = entries[:, 1].astype(int)
+    match = partners[i-1] == j
+    # A pair counts toward both of its bases
+    weight = np.where(j == N + 1, 1, 2)
+    return float(N - (weight * entries[:, 2])[match].sum())
+
+def read_cx(filename):
+    # Read a NUPACK complexes .cx file. Returns an integer array of strand
+    # counts, one row per complex, and the vector of complex free energies in
+    # kcal/mol.
+    counts = []
+    energies = []
+    f = open(filename)
+    for line in f:
+        if line[0] == '%' or line.strip() == '':
+            continue
+        lineData = line.split()
+        counts.append([int(x) for x in lineData[1:-1]])
+        energies.append(float(lineData[-1]))
+    f.close()
+    return np.array(counts, dtype=int), np.array(energies)
+
+def read_ocx(filename):
+    # Read a NUPACK complexes .ocx file, where each strand ordering of a
+    # complex is listed separately. Returns the (complex, ordering) ids, the
+    # strand counts and the free energies in kcal/mol, one row per ordering.
+    ids = []
+    counts = []
+    energies = []
+    f = open(filename)
+    for line in f:
+        if line[0] == '%' or line.strip() == '':
+            continue
+        lineData = line.split()
+        ids.append([int(x) for x in lineData[:2]])
+        counts.append([int(x) for x in lineData[2:-1]])
+        energies.append(float(lineData[-1]))
+    f.close()
+    return np.array(ids, dtype=int), np.array(counts, dtype=int), \
+           np.array(energies)
+
+def read_ppairs(filename):
+    # Read a NUPACK .ocx-ppairs file. Returns a dictionary keyed by (complex,
+    # ordering) ids, holding the number of bases N in that ordering and an
+    # array of (i, j, probability) rows. Bases are numbered from 1 and j = N + 1
+    # marks base i as unpaired.
+    f = open(filename)
+    text = f.read()
+    f.close()
+    # Splitting on the section headers leaves the preamble followed by
+    # (complex, ordering, body) triples. Each body is N and then the entries.
+    sections = re.split(r'^%.*complex(\d+)-order(\d+).*$', text, flags=re.M)
+    ppairs = dict()
+    for k in range(1, len(sections), 3):
+        body = np.array(sections[k+2].split(), dtype=float)
+        ppairs[(int(sections[k]), int(sections[k+1]))] = \
+            (int(body[0]), body[1:].reshape(-1, 3))
+    return ppairs
+
+def read_ocx_key(filename):
+    # Read a NUPACK .ocx-key file. Returns a dictionary mapping (complex,
+    # ordering) ids to the tuple of strands, numbered from 1, in that ordering.
+    orders = dict()
+    f = open(filename)
+    for line in f:
+        if line[0] == '%' or line.strip() == '':
+            continue
+        lineData = [int(x) for x in line.split()]
+        orders[tuple(lineData[:2])] = tuple(lineData[2:])
+    f.close()
+    return orders
 
+def complexes_job(seqs, ComplexSize=2, T=25.0, material='dna', pairs=False,
+                  cutoff=None, tmpdir=None):
+    # Write the input file for an ordered run of NUPACK's complexes. Returns the
+    # file prefix and the (argv, stdout) job to hand to the runner.
+    fname = tmp_prefix(tmpdir)
+    n_seqs = len(seqs)
+    f = open(fname + '.in','w')
+    f.write(str(n_seqs) + '\n')
+    for seq in seqs:
+        f.write(seq + '\n')
+    f.write(str(ComplexSize))
+    f.close()
 
-def NUPACKIntScore(str1, str2, seq_dict,
-                   ComplexSize=2,
-                   T=25.0,
-                   material='dna',
-                   quiet=True,
-                   clean=True,
-                   tmpdir=None):
-    # Formerly IntScore
-    import os
+    argv = [nupackpath + 'complexes', '-T', '%.1f' % T, '-material', material,
+            '-ordered']
+    if pairs:
+        argv.append('-pairs')
+    if cutoff is not None:
+        argv += ['-cutoff', '%g' % cutoff]
+    argv += ['-dangles', 'some', '-sodium', '0.5', fname]
+    return fname, (argv, fname + '.out')
+
+def complexes_result(fname, pairs=False, clean=True):
+    # Read the output of a complexes_job, removing its files when clean is set.
+    # See NUPACK_Complexes for the values returned.
+    xfile = fname + '.ocx'
+    pfile = fname + '.ocx-ppairs'
+    file_list = [fname, fname + '.out', fname + '.in', xfile, pfile,
+                 fname + '.cx', fname + '.ocx-key', fname + '.cx-epairs']
+
+    ids, counts, energies = read_ocx(xfile)
+    ppairs = None
+    orders = None
+    if pairs:
+        ppairs = read_ppairs(pfile)
+        orders = read_ocx_key(fname + '.ocx-key')
 
-    intsc = 0;
-    if tmpdir is None:
-        fid, fname = mkstemp()
-    else:
-        tdir = mkdtemp(dir=tmpdir)
-        fid, fname = mkstemp(dir=tdir)
-    os.close(fid)
+    if clean:
+        for f in file_list:
+            if os.path.isfile(f):
+                os.remove(f)
+
+    return ids, counts, energies, ppairs, orders
+
+def NUPACK_Complexes(seqs, ComplexSize=2, T=25.0, material='dna', pairs=False,
+                     cutoff=None, clean=True, tmpdir=None):
+    # Run NUPACK's complexes on seqs, resolving strand orderings. Returns the
+    # ordering ids, strand counts and free energies read by read_ocx. When pairs
+    # is set, also returns the pair probabilities read by read_ppairs and the
+    # strand orderings read by read_ocx_key (None otherwise). cutoff sets the
+    # smallest pair probability NUPACK reports. The counts and energies can be
+    # handed directly to equilibrium.solve_tubes.
+    fname, job = complexes_job(seqs, ComplexSize, T, material, pairs, cutoff,
+                               tmpdir)
+    runner.get_runner().run(*job)
+    return complexes_result(fname, pairs, clean)
+
+def NUPACK_Complexes_many(seq_lists, ComplexSize=2, T=25.0, material='dna',
+                          pairs=False, cutoff=None, clean=True, tmpdir=None,
+                          max_jobs=None):
+    # NUPACK_Complexes for several independent strand lists, with up to
+    # max_jobs runs of complexes in flight at once. Returns one result per
+    # entry of seq_lists.
+    fnames = []
+    jobs = []
+    for seqs in seq_lists:
+        fname, job = complexes_job(seqs, ComplexSize, T, material, pairs,
+                                   cutoff, tmpdir)
+        fnames.append(fname)
+        jobs.append(job)
+    runner.get_runner().run_many(jobs, max_jobs)
+    return [complexes_result(fname, pairs, clean) for fname in fnames]
+
+def NUPACK_Dimer_Energies(seqs, T=25.0, material='dna', clean=True,
+                          tmpdir=None):
+    # Run NUPACK's complexes once over every strand in seqs with ComplexSize=2.
+    # Returns the monomer free energies and the symmetric matrix of dimer free
+    # energies, in kcal/mol, indexed like seqs.
+    fname = tmp_prefix(tmpdir)
     ofile = fname + '.out'
-    cfile = fname + '.con'
     ifile = fname + '.in'
-    efile = fname + '.eq'
-    file_list = [fname, ofile, cfile, ifile, efile]
+    xfile = fname + '.cx'
+    file_list = [fname, ofile, ifile, xfile]
 
+    n_seqs = len(seqs)
     f = open(ifile,'w')
-    f.write('2\n')
-    f.write(seq_dict[str1] + '\n')
-    f.write(seq_dict[str2] + '\n')
-    f.write(str(ComplexSize))
-    f.close()
-
-    f = open(cfile,'w')
-    f.write('1e-6\n')
-    f.write('1e-6\n')
+    f.write(str(n_seqs) + '\n')
+    for seq in seqs:
+        f.write(seq + '\n')
+    f.write('2')
     f.close()
 
-    cmd = nupackpath + 'complexes -T %.1f '+\
-          '-material %s -ordered -pairs -mfe -dangles some -sodium 0.5 %s > %s'
-    cmd = cmd % (T,material,fname,ofile)
-    os.system(cmd)
-    #cmd = '/home/juic/Downloads/PROGS/nupack3.0.4/bin/concentrations
-    # -ordered -pairs -cutoff 0.000001 -sort 0 -quiet ' + fname
-    if quiet:
-        cmd = nupackpath + 'concentrations '+\
-              '-ordered -pairs -cutoff 0.000001 -sort 0 -quiet ' + fname
-    else:
-        cmd = nupackpath + 'concentrations '+\
-              '-ordered -pairs -cutoff 0.000001 -sort 0 ' + fname
-    os.system(cmd)
+    argv = [nupackpath + 'complexes', '-T', '%.1f' % T, '-material', material,
+            '-dangles', 'some', '-sodium', '0.5', fname]
+    runner.get_runner().run(argv, stdout=ofile)
 
-    f = open(efile)
-    lines = f.readlines()
-    f.close()
-    ctr = 0;
-    while (lines[ctr][0] == '%'):
-        ctr = ctr + 1
-    ctr = ctr + 2;
+    counts, energies = read_cx(xfile)
 
     if clean:
         for f in file_list:
             if os.path.isfile(f):
                 os.remove(f)
 
-    for count in range(ctr, len(lines)):
-        lineData = whiteSpaceSearch.split(lines[count])
-        rawsc = float(lineData[-2])
-        intsc = intsc + 100*rawsc/(2*1e-6)
+    dG_mono = np.zeros(n_seqs)
+    dG_dimer = np.zeros((n_seqs, n_seqs))
+    for row, dG in zip(counts, energies):
+        strands = np.repeat(np.arange(n_seqs), row)
+        if len(strands) == 1:
+            dG_mono[strands[0]] = dG
+        else:
+            i, j = strands
+            dG_dimer[i, j] = dG
+            dG_dimer[j, i] = dG
+    return dG_mono, dG_dimer
+
+def int_score(counts, energies, T=25.0):
+    # Interaction score of a two-strand tube from its complexes output: the
+    # percentage of strand found outside the monomers, each strand at 1uM.
+    concs = equilibrium.solve_tubes(counts, energies, [1e-6, 1e-6], T)[0]
+    return float(100*concs[counts.sum(1) > 1].sum()/(2*1e-6))
 
+def NUPACKIntScore(str1, str2, seq_dict,
+                   ComplexSize=2,
+                   T=25.0,
+                   material='dna',
+                   quiet=True,
+                   clean=True,
+                   tmpdir=None):
+    # Formerly IntScore
+    # Percentage of the two strands, each at 1uM, found in any complex other
+    # than the two monomers at equilibrium.
+    cache, key, cached = cache_lookup([seq_dict[str1], seq_dict[str2]],
+                                      'complexes int_score',
+                                      T, material, ComplexSize)
+    if cached is not None:
+        return cached
+
+    ids, counts, energies = NUPACK_Complexes(
+        [seq_dict[str1], seq_dict[str2]], ComplexSize, T, material,
+        clean=clean, tmpdir=tmpdir)[:3]
+    intsc = int_score(counts, energies, T)
+
+    if cache is not None:
+        cache.put(key, intsc)
     return intsc
 
 def NUPACKSSScore(str1, seq_dict, T=25.0, material='dna', toe_region=[None], clean=True, tmpdir=None):
-    # This function calls NUPACK's complexes and concentrations functions, which
-    # allows one to calculate the unpaired probabilities of each nucleotide across
-    # the most common secondary structures.
+    # This function calls NUPACK's complexes function, which allows one to
+    # calculate the unpaired probabilities of each nucleotide across the most
+    # common secondary structures.
     import os
     ComplexSize = 1
     min_Unpaired = 1;
@@ -768,66 +1282,24 @@ def NUPACKSSScore(str1, seq_dict, T=25.0, material='dna', toe_region=[None], cle
     seq = seq_dict[str1]
     UnpairedIndex = len(seq) + 1
 
-    # Prepare filenames
-    if tmpdir is None:
-        fid, fname = mkstemp()
-    else:
-        tdir = mkdtemp(dir=tmpdir)
-        fid, fname = mkstemp(dir=tdir)
-    os.close(fid)
-    ofile = fname + '.out'
-    ofile2 = fname + '.con.out'
-    cfile = fname + '.con'
-    ifile = fname + '.in'
-    pfile = fname + '.fpairs'
-    file_list = (fname, ofile, ofile2, cfile, ifile, pfile)
-
-    # Write the number of strands, the sequence, and the maximum complex size
-    # to the input file, to be read by NUPACK
-    f = open(ifile,'w')
-    f.write('1\n')
-    f.write(seq + '\n')
-    f.write(str(ComplexSize))
-    f.close()
-
-    f = open(cfile,'w')
-    f.write('1e-6\n')
-    f.close()
-
-    cmd = nupackpath + 'complexes -T %.1f '+\
-          '-material %s -ordered -pairs -mfe -dangles some -sodium 0.5 %s > %s'
-    cmd = cmd % (T,material,fname,ofile)
-    os.system(cmd)
-    cmd = nupackpath + 'concentrations  '+\
-          '-ordered -pairs -cutoff 0.000001 -sort 0 -quiet ' + fname
-    os.system(cmd)
-
-    # Read in nucleotide pairing information
-    f = open(pfile)
-    lines = f.readlines()
-    f.close()
-
-    if clean:
-        for f in file_list:
-            if os.path.isfile(f):
-                os.remove(f)
-
-    ctr = 0
-    while (lines[ctr][0] == '%'):
-        ctr = ctr + 1
-    ctr = ctr + 1
-
-    for count in range(ctr, len(lines)):
-        lineData = whiteSpaceSearch.split(lines[count])
-        if lineData[1]==str(UnpairedIndex):
-            frac_unp = float(lineData[-2])
-            sum_Unpaired = sum_Unpaired + frac_unp
-            if frac_unp < min_Unpaired:
-                min_Unpaired = frac_unp
-            if int(lineData[0]) in toe_region:
-                sum_Unpaired_toe = sum_Unpaired_toe + frac_unp
-                if frac_unp < min_Unpaired_toe:
-                    min_Unpaired_toe = frac_unp
+    # The cache holds the (base, unpaired probability) entries NUPACK reports,
+    # so the same strand can be reused with different toehold regions. The key
+    # names the cutoff, so entries reported under another cutoff are not used.
+    cache, key, unpaired = cache_lookup([seq], 'complexes ppairs cutoff=1e-06',
+                                        T, material, ComplexSize)
+    if unpaired is None:
+        unpaired = NUPACK_Unpaired(seq, T, material, clean=clean, tmpdir=tmpdir)
+        if cache is not None:
+            cache.put(key, unpaired)
+
+    for base, frac_unp in unpaired:
+        sum_Unpaired = sum_Unpaired + frac_unp
+        if frac_unp < min_Unpaired:
+            min_Unpaired = frac_unp
+        if base in toe_region:
+            sum_Unpaired_toe = sum_Unpaired_toe + frac_unp
+            if frac_unp < min_Unpaired_toe:
+                min_Unpaired_toe = frac_unp
 
     #avg_Unpaired = float(sum_Unpaired)/(UnpairedIndex-1)
     if None in toe_region:
@@ -835,3 +1307,49 @@ def NUPACKSSScore(str1, seq_dict, T=25.0, material='dna', toe_region=[None], cle
     else:
         return [min_Unpaired, sum_Unpaired, min_Unpaired_toe, \
                 sum_Unpaired_toe, UnpairedIndex-1]
+
+def NUPACK_Unpaired(seq, T=25.0, material='dna', clean=True, tmpdir=None):
+    # Run NUPACK on a single strand and return a list of [base, probability]
+    # entries, one for each base whose unpaired probability passes the cutoff.
+    # The cutoff is the 1e-6 the concentrations run used, rather than NUPACK's
+    # default of 1e-3, so strongly paired bases still count towards the scores.
+    # Bases are numbered from 1. A lone strand only forms the monomer, so its
+    # pair probabilities in the tube are those of the monomer ensemble.
+    UnpairedIndex = len(seq) + 1
+    ppairs = NUPACK_Complexes([seq], 1, T, material, pairs=True, cutoff=1e-6,
+                              clean=clean, tmpdir=tmpdir)[3]
+    N, entries = ppairs[(1, 1)]
+    unpaired = entries[entries[:, 1] == UnpairedIndex]
+    return [[int(i), float(p)] for i, j, p in unpaired]
+
+def NUPACK_Unpaired_batch(seqs, T=25.0, material='dna', clean=True, tmpdir=None):
+    # NUPACK_Unpaired for many strands at once. Strands missing from the cache
+    # are scored together in one ComplexSize=1 run of complexes, where complex
+    # k is the monomer of the k-th distinct sequence. As in NUPACK_Unpaired,
+    # bases are reported down to a 1e-6 cutoff. Returns one list of
+    # [base, probability] entries per strand in seqs.
+    out = [None] * len(seqs)
+    todo = dict()
+    for k, seq in enumerate(seqs):
+        cache, key, unpaired = cache_lookup([seq],
+                                            'complexes ppairs cutoff=1e-06',
+                                            T, material, 1)
+        if unpaired is None:
+            todo.setdefault(seq, []).append((k, key))
+        else:
+            out[k] = unpaired
+    if len(todo) > 0:
+        uniq = list(todo.keys())
+        ppairs, orders = NUPACK_Complexes(uniq, 1, T, material, pairs=True,
+                                          cutoff=1e-6, clean=clean,
+                                          tmpdir=tmpdir)[3:]
+        for cmpx_id, order in orders.items():
+            seq = uniq[order[0] - 1]
+            N, entries = ppairs[cmpx_id]
+            entries = entries[entries[:, 1] == N + 1]
+            unpaired = [[int(i), float(p)] for i, j, p in entries]
+            for k, key in todo[seq]:
+                out[k] = unpaired
+            if cache is not None:
+                cache.put(todo[seq][0][1], unpaired)
+    return out
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import artifacts, tdm, wsi
+from .test_data import curdir
+
+class TestArtifacts(unittest.TestCase):
+    params = (7, 15, 2)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.tempname = os.path.join(self.tmpdir, 'design')
+        for ext in ['.st', '.wc', '.eq', '.sp']:
+            shutil.copy(os.path.join(curdir, 'test_tdm' + ext),
+                        self.tempname + ext)
+        self.domains = tdm.Read_Finished(os.path.join(curdir,
+                                                      'test_tdm.seq'))[0]
+        self.registry = artifacts.Registry()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lookup(self):
+        self.assertIsNotNone(self.registry.register(self.domains, self.params,
+                                                    self.tempname))
+        entry = self.registry.lookup(self.domains, self.params)
+        st, wc, eq = entry.constraints()
+        trues = wsi.read_constraints(*[self.tempname + ext
+                                       for ext in ['.sp', '.wc', '.eq']])
+        self.assertEqual(st, trues[0])
+        self.assertEqual(wc.tolist(), trues[1].tolist())
+        self.assertEqual(eq.tolist(), trues[2].tolist())
+        self.assertIsNone(self.registry.lookup(self.domains, (7, 15, 3)))
+        other = dict(self.domains)
+        name = sorted(other)[0]
+        other[name] = other[name][::-1]
+        self.assertIsNone(self.registry.lookup(other, self.params))
+
+    def test_stale(self):
+        self.registry.register(self.domains, self.params, self.tempname)
+        # A later design writing over the files invalidates the entry
+        info = os.stat(self.tempname + '.wc')
+        os.utime(self.tempname + '.wc', (info.st_atime, info.st_mtime + 10))
+        self.assertIsNone(self.registry.lookup(self.domains, self.params))
+        self.assertEqual(self.registry.entries, {})
+        self.registry.register(self.domains, self.params, self.tempname)
+        os.remove(self.tempname + '.eq')
+        self.assertIsNone(self.registry.lookup(self.domains, self.params))
+        # So does an edit of the designed sequence that keeps size and mtime
+        shutil.copy(os.path.join(curdir, 'test_tdm.eq'), self.tempname + '.eq')
+        self.registry.register(self.domains, self.params, self.tempname)
+        spname = self.tempname + '.sp'
+        info = os.stat(spname)
+        with open(spname) as f:
+            text = f.read()
+        last = text.rstrip('\n').rfind('\n') + 1
+        base = text[last]
+        swap = {'A': 'C', 'C': 'A', 'G': 'T', 'T': 'G'}[base]
+        with open(spname, 'w') as f:
+            f.write(text[:last] + swap + text[last + 1:])
+        os.utime(spname, (info.st_atime, info.st_mtime))
+        self.assertEqual(artifacts.stamp(spname),
+                         (info.st_size, info.st_mtime))
+        self.assertIsNone(self.registry.lookup(self.domains, self.params))
+
+    def test_register(self):
+        # The .sp file must end with a sequence in the layout of the .st
+        with open(self.tempname + '.sp', 'w') as f:
+            f.write('ACGT\n')
+        self.assertIsNone(self.registry.register(self.domains, self.params,
+                                                 self.tempname))
+        os.remove(self.tempname + '.sp')
+        self.assertIsNone(self.registry.register(self.domains, self.params,
+                                                 self.tempname))
+        self.assertEqual(self.registry.entries, {})
+        # The designed sequence is rebuilt from the domain sequences
+        shutil.copy(os.path.join(curdir, 'test_tdm.sp'), self.tempname + '.sp')
+        entry = self.registry.register(self.domains, self.params,
+                                       self.tempname)
+        self.assertEqual(entry.sequence(self.domains), entry.constraints()[0])
+        self.assertIsNone(self.registry.register({'a': 'GGGG'}, self.params,
+                                                 self.tempname))
+
+    def test_spurious_score(self):
+        artifacts.set_registry().register(self.domains, self.params,
+                                          self.tempname)
+        seqs, strands = tdm.Read_Finished(os.path.join(curdir, 'test_tdm.seq'))
+        seq_dict = dict(seqs)
+        seq_dict.update(strands)
+        try:
+            scores = tdm.Spurious_Weighted_Score(
+                self.tempname, list(seqs.keys()), seq_dict, native=True,
+                tmpdir=self.tmpdir)
+        finally:
+            artifacts.set_registry()
+        st, wc, eq = wsi.read_constraints(*[self.tempname + ext
+                                            for ext in ['.sp', '.wc', '.eq']])
+        self.assertEqual(scores, wsi.wsi_scores(st, wc, eq))
+        # Registered files are left in place
+        self.assertTrue(all(os.path.isfile(self.tempname + ext)
+                            for ext in ['.st', '.wc', '.eq', '.sp']))
+
+def suite():
+    tests = ['test_lookup', 'test_stale', 'test_register',
+             'test_spurious_score']
+    return unittest.TestSuite(list(map(TestArtifacts, tests)))
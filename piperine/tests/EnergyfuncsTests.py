@@ -0,0 +1,179 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import stickydesign as sd
+
+from .. import energyfuncs_james as efj
+from .THTests import Capturing
+
+def reference_loopmismatch(ef, seqs1, seqs2):
+    # uniform_loopmismatch as written before vectorizing, one shift at a time
+    plen = seqs1.endlen - 1
+    if seqs1.endtype == 'DT':
+        ps1 = seqs1[:,1:-1]*4+seqs1[:,2:]
+        pa1 = seqs1[:,0]*4+seqs1[:,1]
+        pac1 = (3-seqs1[:,0])*4+seqs2[:,-1]
+        ps2 = seqs2[:,::-1][:,:-2]*4+seqs2[:,::-1][:,1:-1]
+        pa2 = seqs2[:,0]*4+seqs2[:,1]
+        pac2 = (3-seqs2[:,0])*4+seqs1[:,-1]
+    else:
+        ps1 = seqs1[:,:-2]*4+seqs1[:,1:-1]
+        pa1 = seqs1[:,-2]*4+seqs1[:,-1]
+        pac1 = seqs2[:,0]*4+(3-seqs1[:,-1])
+        ps2 = seqs2[:,::-1][:,1:-1]*4+seqs2[:,::-1][:,2:]
+        pa2 = seqs2[:,-2]*4+seqs2[:,-1]
+        pac2 = (seqs1[:,0])*4+(3-seqs2[:,-1])
+    en = np.zeros((ps1.shape[0], 2*plen))
+    for shift in range(-plen+1, plen):
+        en[:,plen+shift-1] = np.sum(
+            ef.nndG_full[ps1[:,max(shift,0):plen+shift],
+                         ps2[:,max(-shift,0):plen-shift]], axis=1)
+    en[:,plen-1] = en[:,plen-1] + ef.nndG_full[pa1,pac1] + ef.nndG_full[pa2,pac2]
+    return en
+
+class TestParamTables(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'params', 'tables.npz')
+        self.trues = efj.build_tables(*efj.read_param_csvs())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertTables(self, tables):
+        self.assertEqual(sorted(tables), sorted(efj.table_names))
+        for name in efj.table_names:
+            np.testing.assert_array_equal(tables[name], self.trues[name])
+            self.assertEqual(tables[name].dtype, self.trues[name].dtype)
+            self.assertFalse(tables[name].flags.writeable)
+
+    def test_build(self):
+        self.assertEqual(self.trues['nndG_full'].shape, (16, 16))
+        self.assertEqual(self.trues['nndG'].shape, (16,))
+        self.assertEqual(self.trues['dgldG_fixedC'].shape, (4,))
+        self.assertTables(efj.load_tables(self.filename))
+        self.assertTrue(os.path.isfile(self.filename))
+
+    def test_reuse(self):
+        efj.load_tables(self.filename)
+        # The stored tables are used without parsing the CSVs again
+        def fail(dsb, dgl):
+            raise AssertionError('tables rebuilt')
+        build_tables = efj.build_tables
+        efj.build_tables = fail
+        try:
+            self.assertTables(efj.load_tables(self.filename))
+        finally:
+            efj.build_tables = build_tables
+
+    def test_rebuild(self):
+        # Tables built from other CSV contents are replaced
+        tables = dict((name, np.zeros(1)) for name in efj.table_names)
+        os.makedirs(os.path.dirname(self.filename))
+        np.savez(self.filename, digest=np.array('0'), **tables)
+        self.assertTables(efj.load_tables(self.filename))
+        with open(self.filename, 'wb') as f:
+            f.write(b'not an npz file')
+        self.assertTables(efj.load_tables(self.filename))
+        self.assertTables(efj.load_tables(''))
+
+    def test_energyfuncs(self):
+        ef = efj.energyfuncs(targetdG=7.7)
+        for name in efj.table_names:
+            np.testing.assert_array_equal(getattr(ef, name), self.trues[name])
+
+class TestLoopMismatch(unittest.TestCase):
+    def setUp(self):
+        self.ef = efj.energyfuncs(targetdG=7.7)
+        self.rng = np.random.RandomState(20)
+
+    def random_ends(self, n, endlen, endtype):
+        return sd.endarray(self.rng.randint(0, 4, (n, endlen+1)), endtype)
+
+    def test_ordered_sum(self):
+        for width in [1, 5, 7, 8, 9, 16, 17, 40]:
+            lengths = self.rng.randint(1, width+1, 30)
+            vals = self.rng.randn(4, 30, width)
+            trues = [[np.sum(vals[i, k, :lengths[k]]) for k in range(30)]
+                     for i in range(4)]
+            self.assertEqual(efj.ordered_sum(vals, lengths).tolist(), trues)
+
+    def test_loopmismatch(self):
+        # Ends longer than 8 stacks exercise np.sum's blocked order
+        for endtype in ['TD', 'DT']:
+            for endlen in [3, 5, 7, 9, 10, 12, 20]:
+                seqs1 = self.random_ends(300, endlen, endtype)
+                seqs2 = self.random_ends(300, endlen, endtype)
+                seqs2[:50] = seqs1[:50]
+                en = reference_loopmismatch(self.ef, seqs1, seqs2)
+                for chunk_size in [300, 64, 1]:
+                    out = self.ef.uniform_loopmismatch(seqs1, seqs2,
+                                                       chunk_size=chunk_size)
+                    self.assertEqual(out.tolist(), np.amax(en, 1).tolist())
+                full = self.ef.uniform_loopmismatch(seqs1, seqs2, chunk_size=64,
+                                                    full=True)
+                self.assertEqual(full.tolist(), en.tolist())
+
+def reference_min_sum(row):
+    # The reduction of uniform_danglemismatch(fast=False), for one row
+    g = gm = 0
+    for y in row:
+        if y == 0:
+            g = 0
+        else:
+            g += y
+            if gm > g:
+                gm = g
+    return gm
+
+class TestDangleMismatch(unittest.TestCase):
+    def setUp(self):
+        self.ef = efj.energyfuncs(targetdG=7.7)
+        self.rng = np.random.RandomState(21)
+        self.fastsub = efj.fastsub
+        # Use the NumPy reduction even where the extension is built
+        efj.fastsub = None
+
+    def tearDown(self):
+        efj.fastsub = self.fastsub
+
+    def test_running_min_sum(self):
+        m = self.rng.randn(500, 40) * (self.rng.rand(500, 40) > 0.3)
+        trues = [reference_min_sum(row) for row in m]
+        for chunk_size in [500, 7, 1]:
+            self.assertEqual(efj.running_min_sum(m, chunk_size).tolist(), trues)
+
+    def test_danglemismatch(self):
+        for endtype in ['TD', 'DT']:
+            for endlen in [4, 7, 10]:
+                seqs1 = sd.endarray(self.rng.randint(0, 4, (400, endlen+1)),
+                                    endtype)
+                seqs2 = sd.endarray(self.rng.randint(0, 4, (400, endlen+1)),
+                                    endtype)
+                seqs2[:50] = 3 - seqs1[:50][:, ::-1]
+                with Capturing():
+                    trues = self.ef.uniform_danglemismatch(seqs1, seqs2,
+                                                           fast=False)
+                for chunk_size in [400, 64]:
+                    out = self.ef.uniform_danglemismatch(seqs1, seqs2,
+                                                         chunk_size=chunk_size)
+                    self.assertEqual(out.tolist(), trues.tolist())
+                # A single end against many
+                out = self.ef.uniform_danglemismatch(seqs1[0], seqs2,
+                                                     chunk_size=64)
+                with Capturing():
+                    trues = self.ef.uniform_danglemismatch(
+                        sd.endarray(np.repeat(np.array([seqs1[0]]), 400, 0),
+                                    endtype), seqs2, fast=False)
+                self.assertEqual(out.tolist(), trues.tolist())
+
+def suite():
+    tests = ['test_build', 'test_reuse', 'test_rebuild', 'test_energyfuncs']
+    loop_tests = ['test_ordered_sum', 'test_loopmismatch']
+    dangle_tests = ['test_running_min_sum', 'test_danglemismatch']
+    return unittest.TestSuite(list(map(TestParamTables, tests)) +
+                              list(map(TestLoopMismatch, loop_tests)) +
+                              list(map(TestDangleMismatch, dangle_tests)))
@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+
+from .. import equilibrium
+
+class TestEquilibrium(unittest.TestCase):
+    T = 25.0
+    c0 = 1e-6
+
+    def heterodimer(self, dG):
+        # Closed form for A + B <-> AB with unit-free monomer energies of 0
+        K = np.exp(-dG / equilibrium.kT(self.T)) / equilibrium.water_density(self.T)
+        b = 2 * K * self.c0 + 1
+        return 2 * K * self.c0**2 / (b + np.sqrt(b * b - 4 * K**2 * self.c0**2))
+
+    def test_water_density(self):
+        self.assertTrue(np.isclose(equilibrium.water_density(25.0), 55.3448,
+                                   rtol=1e-5))
+
+    def test_heterodimer(self):
+        dGs = np.array([5., 0., -5., -10., -15., -20.])
+        dG = np.column_stack([np.zeros(len(dGs)), np.zeros(len(dGs)), dGs])
+        out = equilibrium.solve_tubes([[1, 0], [0, 1], [1, 1]], dG,
+                                      [self.c0, self.c0], self.T)
+        trues = np.array([self.heterodimer(x) for x in dGs])
+        self.assertTrue(np.allclose(out[:, 2], trues, rtol=1e-8),
+                        msg="test:{}\ntrue:{}".format(out[:, 2], trues))
+
+    def test_mass_balance(self):
+        rng = np.random.RandomState(0)
+        stoich = np.array([[1, 0], [0, 1], [2, 0], [1, 1], [0, 2]])
+        dG = np.column_stack([rng.uniform(-10, 0, (500, 2)),
+                              rng.uniform(-80, 0, (500, 3))])
+        out = equilibrium.solve_tubes(stoich, dG, [self.c0, 2 * self.c0],
+                                      self.T)
+        totals = out.dot(stoich)
+        self.assertTrue(np.allclose(totals, [self.c0, 2 * self.c0], rtol=1e-8))
+
+    def test_dimer_tubes_same_strand(self):
+        # Two copies of one strand must behave like a single strand at twice
+        # the concentration forming its homodimer
+        dG_mono = np.array([-2.0])
+        dG_dimer = np.array([[-14.0]])
+        out = equilibrium.dimer_tubes(dG_mono, dG_dimer, [(0, 0)], self.c0,
+                                      self.T)
+        single = equilibrium.solve_tubes([[1], [2]], [-2.0, -14.0],
+                                         [2 * self.c0], self.T)
+        self.assertTrue(np.isclose(out[0, 2:].sum(), single[0, 1], rtol=1e-8))
+
+    def test_orderings(self):
+        # Two orderings of one complex listed as separate species, as in
+        # NUPACK's ordered output, hold as much as a single species carrying
+        # both orderings' Boltzmann weight
+        dG = -12.0
+        split = equilibrium.solve_tubes([[1, 0, 0], [0, 1, 0], [0, 0, 1],
+                                         [1, 1, 1], [1, 1, 1]],
+                                        [0., 0., 0., dG, dG],
+                                        [self.c0] * 3, self.T)
+        merged = equilibrium.solve_tubes([[1, 0, 0], [0, 1, 0], [0, 0, 1],
+                                          [1, 1, 1]],
+                                         [0., 0., 0.,
+                                          dG - equilibrium.kT(self.T) * np.log(2)],
+                                         [self.c0] * 3, self.T)
+        self.assertTrue(np.isclose(split[0, 3:].sum(), merged[0, 3],
+                                   rtol=1e-8))
+        self.assertTrue(np.isclose(split[0, 3], split[0, 4], rtol=1e-8))
+
+def suite():
+    tests = ['test_water_density', 'test_heterodimer', 'test_mass_balance',
+             'test_dimer_tubes_same_strand', 'test_orderings']
+    return unittest.TestSuite(list(map(TestEquilibrium, tests)))
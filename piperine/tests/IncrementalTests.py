@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import incremental
+
+class TestScoreState(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.seqs = {'r0-a': 'ACGTACGT', 'r0-b': 'TTTTGGGG', 'r0-Gate': 'CCCCAAAA'}
+        self.state = incremental.ScoreState()
+        self.state.update(self.seqs, {'compile_params': [7, 15, 2]})
+        self.state.put('pairs', ['r0-a', 'r0-b'], 1.5)
+        self.state.put('pairs', ['r0-a', 'r0-a'], 0.5)
+        self.state.put('complexes', ['r0-Gate', '((..))'], [1e-6, 0.1])
+        self.state.put('wsi', [], [1, 2, 3, 4, 5, 6])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_update(self):
+        seqs = dict(self.seqs, **{'r0-b': 'TTTTGGGC'})
+        changed = self.state.update(seqs, {'compile_params': [7, 15, 2]})
+        self.assertEqual(changed, set(['r0-b']))
+        self.assertIsNone(self.state.get('pairs', ['r0-a', 'r0-b']))
+        self.assertIsNone(self.state.get('wsi', []))
+        self.assertEqual(self.state.get('pairs', ['r0-a', 'r0-a']), 0.5)
+        self.assertEqual(self.state.get('complexes', ['r0-Gate', '((..))']),
+                         [1e-6, 0.1])
+        self.assertEqual(self.state.reused, 2)
+        # Nothing changed: everything is kept
+        self.state.update(seqs, {'compile_params': [7, 15, 2]})
+        self.assertEqual(self.state.get('pairs', ['r0-a', 'r0-a']), 0.5)
+        # Other parameters: nothing is kept
+        self.state.update(seqs, {'compile_params': [7, 15, 3]})
+        self.assertIsNone(self.state.get('pairs', ['r0-a', 'r0-a']))
+
+    def test_save_load(self):
+        filename = os.path.join(self.tmpdir, 'design.state')
+        self.state.save(filename)
+        state = incremental.ScoreState.load(filename)
+        self.assertEqual(state.items, self.state.items)
+        self.assertEqual(state.update(self.seqs, {'compile_params': [7, 15, 2]}),
+                         set())
+        self.assertEqual(state.get('wsi', []), [1, 2, 3, 4, 5, 6])
+        missing = incremental.ScoreState.load(filename + '.missing')
+        self.assertEqual(missing.items, dict())
+
+def suite():
+    tests = ['test_update', 'test_save_load']
+    return unittest.TestSuite(list(map(TestScoreState, tests)))
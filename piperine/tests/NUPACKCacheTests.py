@@ -0,0 +1,93 @@
+import os
+import unittest
+from tempfile import mkdtemp
+import shutil
+import sqlite3
+
+from .. import nupackcache
+
+class TestNUPACKCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'cache.sqlite')
+        self.cache = nupackcache.NUPACKCache(self.filename)
+        self.key = nupackcache.make_key(['ACGT', 'TTTT'], 'complexes', 25.0,
+                                        'dna', 0.5, 'some', 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hit_miss(self):
+        self.assertIsNone(self.cache.get(self.key))
+        self.cache.put(self.key, [[1, 0.5], [2, 0.25]])
+        self.assertEqual(self.cache.get(self.key), [[1, 0.5], [2, 0.25]])
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['entries'], 1)
+
+    def test_persistence(self):
+        self.cache.put(self.key, 1.5)
+        other = nupackcache.NUPACKCache(self.filename)
+        self.assertEqual(other.get(self.key), 1.5)
+
+    def test_key_inputs(self):
+        keys = set([self.key,
+            nupackcache.make_key(['TTTT', 'ACGT'], 'complexes', 25.0, 'dna',
+                                 0.5, 'some', 2),
+            nupackcache.make_key(['ACGT', 'TTTT'], 'complexes', 37.0, 'dna',
+                                 0.5, 'some', 2),
+            nupackcache.make_key(['ACGT', 'TTTT'], 'complexes', 25.0, 'dna',
+                                 0.5, 'some', 3),
+            nupackcache.make_key(['ACGT', 'TTTT'], 'defect', 25.0, 'dna',
+                                 0.5, 'some', 2)])
+        self.assertEqual(len(keys), 5, 'Sequence order and parameters must '
+                                       'change the key')
+
+    def test_eviction(self):
+        cache = nupackcache.NUPACKCache(self.filename, max_size=2000)
+        for i in range(200):
+            cache.put(str(i), [i] * 10)
+        cache.evict()
+        self.assertLessEqual(cache.size(), 2000)
+        self.assertEqual(cache.get('199'), [199] * 10)
+        self.assertIsNone(cache.get('0'))
+
+    def atime(self, key):
+        conn = sqlite3.connect(self.filename)
+        try:
+            return conn.execute('SELECT atime FROM results WHERE key = ?',
+                                (key,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_hit_times(self):
+        self.cache.put(self.key, 1.5)
+        put_time = self.atime(self.key)
+        # Hits are not written until flushed
+        self.assertEqual(self.cache.get(self.key), 1.5)
+        self.assertEqual(self.atime(self.key), put_time)
+        self.cache.flush()
+        self.assertGreater(self.atime(self.key), put_time)
+        self.cache.get(self.key)
+        hit_time = self.atime(self.key)
+        self.cache.close()
+        self.assertGreater(self.atime(self.key), hit_time)
+        # The cache reopens after close
+        self.assertEqual(self.cache.get(self.key), 1.5)
+
+    def test_eviction_hits(self):
+        cache = nupackcache.NUPACKCache(self.filename, max_size=10**6)
+        for i in range(60):
+            cache.put(str(i), [i] * 10)
+        # An unflushed hit still protects the oldest entry from eviction
+        cache.get('0')
+        cache.max_size = 2000
+        cache.evict()
+        self.assertEqual(cache.get('0'), [0] * 10)
+        self.assertIsNone(cache.get('1'))
+
+def suite():
+    tests = ['test_hit_miss', 'test_persistence', 'test_key_inputs',
+             'test_eviction', 'test_hit_times', 'test_eviction_hits']
+    return unittest.TestSuite(list(map(TestNUPACKCache, tests)))
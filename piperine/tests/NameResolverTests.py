@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+from .. import nameresolver
+
+def legacy_resolve(pepperlist, seq_dict, update=False):
+    s_keys = sorted(seq_dict.keys(), reverse=True)
+    out = dict()
+    for pname in pepperlist:
+        pswap, pmem = nameresolver.replace_names(pname, s_keys, seq_dict)
+        if not update or pmem == '':
+            out[pname] = pswap
+    return out
+
+class TestNameResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.seq_dict = {'r0-a': 'ACGT', 'r0-b': 'TTTT', 'r0-c': 'NNNN',
+                         'x1': 'GGG', 'T': 'CCCC'}
+        self.names = ['r0-a+r0-b', 'r0-a+r0-c', 'r0-ab', 'x1-T', 'r0-a',
+                      'x1+T']
+
+    def test_resolve(self):
+        resolver = nameresolver.PepperNameResolver(self.names,
+                                                   self.seq_dict.keys())
+        for update in [False, True]:
+            self.assertEqual(resolver.resolve(self.seq_dict, update),
+                             legacy_resolve(self.names, self.seq_dict, update))
+        out = resolver.resolve(self.seq_dict)
+        self.assertEqual(out['r0-a+r0-b'], 'ACGT+TTTT')
+        self.assertEqual(out['r0-a+r0-c'], 'ACGT+r0-c')
+        self.assertNotIn('r0-a+r0-c', resolver.resolve(self.seq_dict, True))
+        # Plans are kept per set of names holding an 'N'
+        seq_dict = dict(self.seq_dict, **{'r0-c': 'AAAA'})
+        self.assertEqual(resolver.resolve(seq_dict)['r0-a+r0-c'], 'ACGT+AAAA')
+
+    def test_random(self):
+        rng = np.random.RandomState(13)
+        alphabet = list('ab-AT+')
+        def word(lo, hi):
+            return ''.join(rng.choice(alphabet, rng.randint(lo, hi)))
+        for trial in range(300):
+            keys = set(word(1, 5) for k in range(rng.randint(1, 8)))
+            names = [word(1, 10) for k in range(10)] + list(keys)
+            resolver = nameresolver.PepperNameResolver(names, keys)
+            for rep in range(2):
+                seq_dict = dict((k, ''.join(rng.choice(list('ACGTN'),
+                                                       rng.randint(0, 5))))
+                                for k in keys)
+                for update in [False, True]:
+                    self.assertEqual(resolver.resolve(seq_dict, update),
+                                     legacy_resolve(names, seq_dict, update))
+
+def suite():
+    tests = ['test_resolve', 'test_random']
+    return unittest.TestSuite(list(map(TestNameResolver, tests)))
@@ -0,0 +1,27 @@
+import sys
+import unittest
+
+from .. import profiling, runner
+
+class TestProfiling(unittest.TestCase):
+
+    def test_stages(self):
+        prof = profiling.Profile()
+        run = runner.Runner(max_jobs=2)
+        argv = [sys.executable, '-c', 'pass']
+        with prof.stage('A'):
+            run.run_many([(argv, None)] * 3)
+        with prof.stage('B'):
+            pass
+        # Calls outside a stage are not counted
+        run.run(argv)
+        out = prof.as_dict()
+        self.assertEqual(out['A']['processes'], 3)
+        self.assertEqual(sum(out['A']['latency_counts']), 3)
+        self.assertEqual(out['B']['processes'], 0)
+        self.assertEqual(out['total']['processes'], 3)
+        self.assertGreaterEqual(out['A']['wall'], out['A']['latency_max'])
+
+def suite():
+    tests = ['test_stages']
+    return unittest.TestSuite(list(map(TestProfiling, tests)))
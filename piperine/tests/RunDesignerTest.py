@@ -75,6 +75,21 @@ class Test_run_designer(unittest.TestCase):
             mod = argsplit[-1]
             self.fail("Found no module named {}".format(mod))
     
+    def test_run_designer_keeps_toeholds(self):
+        with Capturing() as output:
+            designer.run_designer(basename=self.basename, quick=True)
+        old = designer.read_toehold_file(self.fixed)
+        # Add a species, then design again keeping the toeholds
+        with open(self.crn, 'a') as f:
+            f.write('D + E -> F\n')
+        with Capturing() as output:
+            designer.run_designer(basename=self.basename, quick=True,
+                                  keep_toeholds=True)
+        new = designer.read_toehold_file(self.fixed)
+        self.assertGreater(len(new), len(old))
+        self.assertEqual(dict((k, new[k]) for k in old), old)
+        self.assertEqual(len(set(new.values())), len(new))
+
     def test_run_designer_alerts_unfound_modules(self):
         fakemod1 = "notAmodule"
         fakemod2 = "notAmodule"
@@ -86,5 +101,6 @@ class Test_run_designer(unittest.TestCase):
 
 def suite():
     tests = ['test_run_designer_accepts_string_modules', 'test_run_designer_noargs',
-             'test_run_designer_alerts_unfound_modules']
+             'test_run_designer_alerts_unfound_modules',
+             'test_run_designer_keeps_toeholds']
     return unittest.TestSuite(list(map(Test_run_designer, tests)))
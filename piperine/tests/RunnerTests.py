@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import unittest
+from tempfile import mkdtemp
+import shutil
+
+from .. import runner
+
+class TestRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.runner = runner.Runner(max_jobs=4, timeout=10)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def python(self, code):
+        return [sys.executable, '-c', code]
+
+    def test_stdout(self):
+        out = os.path.join(self.tmpdir, 'out')
+        self.runner.run(self.python('print("hello")'), stdout=out)
+        with open(out) as f:
+            self.assertEqual(f.read().strip(), 'hello')
+
+    def test_failure(self):
+        with self.assertRaises(runner.ToolError) as cm:
+            self.runner.run(self.python('import sys; sys.exit(3)'))
+        self.assertEqual(cm.exception.returncode, 3)
+        with self.assertRaises(runner.ToolError):
+            self.runner.run([os.path.join(self.tmpdir, 'no_such_tool')])
+
+    def test_timeout(self):
+        start = time.time()
+        with self.assertRaises(runner.ToolError):
+            self.runner.run(self.python('import time; time.sleep(30)'),
+                            timeout=0.5)
+        self.assertLess(time.time() - start, 10)
+
+    def test_run_many(self):
+        outs = [os.path.join(self.tmpdir, 'out{}'.format(i)) for i in range(8)]
+        jobs = [(self.python('print({})'.format(i)), out)
+                for i, out in enumerate(outs)]
+        self.runner.run_many(jobs, max_jobs=3)
+        for i, out in enumerate(outs):
+            with open(out) as f:
+                self.assertEqual(f.read().strip(), str(i))
+
+def suite():
+    tests = ['test_stdout', 'test_failure', 'test_timeout', 'test_run_many']
+    return unittest.TestSuite(list(map(TestRunner, tests)))
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+
+from .. import sequencestore, suffixarray
+
+def revcomp(seq):
+    comp = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+    return ''.join(comp.get(c, c) for c in reversed(seq))
+
+class TestSequenceStore(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(14)
+        self.seq_dict = dict(('s{}'.format(k),
+                              ''.join(rng.choice(list('ACGT'),
+                                                 rng.randint(0, 20))))
+                             for k in range(10))
+        self.seq_dict['cmplx'] = 'ACGTN+TTGCA'
+        self.store = sequencestore.SequenceStore(self.seq_dict)
+
+    def test_mapping(self):
+        self.assertEqual(self.store, self.seq_dict)
+        self.assertEqual(len(self.store), len(self.seq_dict))
+        self.assertIn('cmplx', self.store)
+        self.assertNotIn('r0-a', self.store)
+        self.assertIs(sequencestore.as_store(self.store), self.store)
+
+    def test_views(self):
+        for name, seq in self.seq_dict.items():
+            self.assertEqual(self.store.decode(self.store.codes(name)), seq)
+            self.assertEqual(self.store.revcomp(name), revcomp(seq))
+
+    def test_kmers(self):
+        for name, seq in self.seq_dict.items():
+            trues = []
+            for i in range(len(seq) - 3):
+                kmer = seq[i:i+4]
+                if set(kmer) <= set('ACGT'):
+                    trues.append(int(kmer.translate(str.maketrans('ACGT',
+                                                                  '0123')), 4))
+                else:
+                    trues.append(-1)
+            self.assertEqual(self.store.kmers(name, 4).tolist(), trues)
+
+    def test_revcomp_kmers(self):
+        for name, seq in self.seq_dict.items():
+            rc = sequencestore.SequenceStore({'rc': revcomp(seq)})
+            trues = rc.kmers('rc', 4)[::-1].tolist()
+            self.assertEqual(self.store.revcomp_kmers(name, 4).tolist(), trues)
+
+    def test_suffix_array(self):
+        names = sorted(self.seq_dict)
+        index = suffixarray.GeneralizedSuffixArray.from_store(self.store, names)
+        plain = suffixarray.GeneralizedSuffixArray(
+            [self.seq_dict[name] for name in names])
+        self.assertEqual(index.doc.tolist(), plain.doc.tolist())
+        self.assertEqual(index.offset.tolist(), plain.offset.tolist())
+        # Suffix order may differ, as codes sort differently from characters
+        lengths = dict((key, m[0]) for key, m in
+                       index.common_substrings(5).items())
+        trues = dict((key, m[0]) for key, m in
+                     plain.common_substrings(5).items())
+        self.assertEqual(lengths, trues)
+
+def suite():
+    tests = ['test_mapping', 'test_views', 'test_kmers', 'test_revcomp_kmers',
+             'test_suffix_array']
+    return unittest.TestSuite(list(map(TestSequenceStore, tests)))
@@ -0,0 +1,55 @@
+import os
+import unittest
+
+import numpy as np
+
+from .. import suffixarray
+
+def longest_common(s1, s2):
+    best = 0
+    for i in range(len(s1)):
+        for j in range(len(s2)):
+            k = 0
+            while i + k < len(s1) and j + k < len(s2) and s1[i+k] == s2[j+k]:
+                k += 1
+            best = max(best, k)
+    return best
+
+class TestSuffixArray(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(12)
+        self.seqs = [''.join(rng.choice(list('ACGT'), rng.randint(0, 30)))
+                     for i in range(15)]
+        self.seqs.append(self.seqs[3])
+        self.seqs.append(self.seqs[4][2:12])
+
+    def test_suffix_array(self):
+        text = 'mississippi$banana'
+        codes = np.array([ord(c) for c in text])
+        sa = suffixarray.suffix_array(codes)
+        self.assertEqual(sa.tolist(), sorted(range(len(text)),
+                                             key=lambda i: text[i:]))
+        lcp = suffixarray.lcp_array(codes, sa)
+        trues = [0] + [len(os.path.commonprefix([text[sa[k-1]:], text[sa[k]:]]))
+                       for k in range(1, len(text))]
+        self.assertEqual(lcp.tolist(), trues)
+
+    def test_common_substrings(self):
+        index = suffixarray.GeneralizedSuffixArray(self.seqs)
+        matches = index.common_substrings(5)
+        for a in range(len(self.seqs)):
+            for b in range(a + 1, len(self.seqs)):
+                true = longest_common(self.seqs[a], self.seqs[b])
+                if true < 5:
+                    self.assertNotIn((a, b), matches)
+                    continue
+                length, d, offset = matches[(a, b)]
+                self.assertEqual(length, true)
+                witness = self.seqs[d][offset:offset+length]
+                self.assertIn(witness, self.seqs[a])
+                self.assertIn(witness, self.seqs[b])
+
+def suite():
+    tests = ['test_suffix_array', 'test_common_substrings']
+    return unittest.TestSuite(list(map(TestSuffixArray, tests)))
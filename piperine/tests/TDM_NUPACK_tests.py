@@ -1,5 +1,7 @@
 from pkg_resources import resource_filename
 import os
+import shutil
+import subprocess
 import unittest
 import sys
 from tempfile import mkstemp, mkdtemp
@@ -10,6 +12,36 @@ import numpy as np
 from .. import designer, tdm, DSDClasses
 
 
+def baseline_unpaired(seq, T=25.0, material='dna'):
+    # Unpaired probabilities as NUPACKSSScore used to read them, from the
+    # .fpairs file of a run of complexes followed by concentrations with a
+    # 1e-6 cutoff. Returns [base, probability] entries like tdm.NUPACK_Unpaired.
+    tdir = mkdtemp()
+    fname = os.path.join(tdir, 'ss')
+    try:
+        with open(fname + '.in', 'w') as f:
+            f.write('1\n{}\n1'.format(seq))
+        with open(fname + '.con', 'w') as f:
+            f.write('1e-6\n')
+        with open(fname + '.out', 'w') as out:
+            subprocess.call([tdm.nupackpath + 'complexes', '-T', '%.1f' % T,
+                             '-material', material, '-ordered', '-pairs',
+                             '-mfe', '-dangles', 'some', '-sodium', '0.5',
+                             fname], stdout=out)
+        subprocess.call([tdm.nupackpath + 'concentrations', '-ordered',
+                         '-pairs', '-cutoff', '0.000001', '-sort', '0',
+                         '-quiet', fname])
+        with open(fname + '.fpairs') as f:
+            lines = [l for l in f.readlines() if not l.startswith('%')][1:]
+    finally:
+        shutil.rmtree(tdir)
+    unpaired = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) > 2 and fields[1] == str(len(seq) + 1):
+            unpaired.append([int(fields[0]), float(fields[-2])])
+    return unpaired
+
 class TestTDMNUPACK(unittest.TestCase):
     basename = resource_filename('piperine', 'tests/test_data/sequences9mut.mfe')[:-4]
     
@@ -55,8 +87,8 @@ class TestTDMNUPACK(unittest.TestCase):
                                    params=[3, 25, 'dna', True, 'ted_calc'],
                                    clean=True,
                                    tmpdir=tmpdir)
-        self.assertEqual(out, true_score, 
-                         msg="true:{}\ntest:{}\n".format(true_score, out))
+        self.assertTrue(np.isclose(out, true_score, rtol=1e-6),
+                        msg="true:{}\ntest:{}\n".format(true_score, out))
     
 
     def test_NUPACK_Cmpx_Conc_c4(self, tmpdir=None):
@@ -70,8 +102,8 @@ class TestTDMNUPACK(unittest.TestCase):
                                    params=[4, 25, 'dna', True, 'ted_calc'],
                                    clean=True,
                                    tmpdir=tmpdir)
-        self.assertEqual(out, true_score, 
-                         msg="true:{}\ntest:{}\n".format(true_score, out))
+        self.assertTrue(np.isclose(out, true_score, rtol=1e-6),
+                        msg="true:{}\ntest:{}\n".format(true_score, out))
     
     def test_NUPACK_Cmpx_Defect(self, tmpdir=None):
         # using gate r0-Gate from sequence set 9mut
@@ -102,6 +134,30 @@ class TestTDMNUPACK(unittest.TestCase):
         self.assertEqual(out, true_score, 
                          msg="true:{}\ntest:{}\n".format(true_score, out))
     
+    def test_NUPACK_Cmpx_Conc_Defect_c4(self, tmpdir=None):
+        seq_dict = {"r0-a_struct" : "TTCAGCCACAGAGTGACGCC",
+                    "r0-b_struct" : "GGCGTCACTCGACCACGGCA",
+                    "r0-c_struct" : "TGCCGTGGTCCGCAAAGGCG",
+                    "r0-d_struct" : "CGCCTTTGCGATAGCGGTTA"}
+        cmpx_ideal = "..........((((((((((+))))))))))((((((((((+))))))))))((((((((((+)))))))))).........."
+        trues = [7.547559e-07, 4.265e+00]
+        out = tdm.NUPACK_Cmpx_Conc_Defect(seq_dict.values(), 
+                                          cmpx_ideal,
+                                          params=[4, 25, 'dna', True, 'ted_calc'],
+                                          clean=True,
+                                          tmpdir=tmpdir)
+        for i, rtol in [(0, 1e-6), (1, 1e-3)]:
+            self.assertTrue(np.isclose(out[i], trues[i], rtol=rtol),
+                            msg="true:{}\ntest:{}\n".format(trues[i], out[i]))
+    
+    def test_ensemble_defect(self):
+        struct = "((.+.))"
+        entries = [(1, 6, 0.9), (2, 5, 0.8), (3, 7, 1.0), (4, 7, 0.5),
+                   (1, 7, 0.1)]
+        out = tdm.ensemble_defect(6, entries, struct)
+        self.assertTrue(np.isclose(out, 6 - (2*0.9 + 2*0.8 + 1.0 + 0.5)),
+                        msg="test:{}".format(out))
+    
     def test_Spurious_Weighted_Score(self, tmpdir=None):
         beta = 5
         w_lin = np.concatenate([np.zeros((beta, )), np.arange(12-beta)+1, 7*np.ones((2,))])
@@ -115,20 +171,25 @@ class TestTDMNUPACK(unittest.TestCase):
         true_inter_score = sum(w_lin[2:12] * spur_inter_hits)
         true_verboten = 685.00000 
         true_spc_weighted = 9310.66837 
-        out = tdm.Spurious_Weighted_Score(
-                self.basename,
-                self.sequence_dicts[2],
-                self.sequence_dicts[0],
-                clean=True,
-                tmpdir=tmpdir,
-                bored=1)
         true_scores = [true_intra_score, true_inter_score, true_mis_intra_score, true_mis_inter_score,
                        true_verboten, true_spc_weighted]
         score_names =["spc_intra_score", "spc_inter_score",
                       "mis_intra_score", "mis_inter_score",
                       "verboten_score", "wsi_score"]
-        for i in range(6):
-            self.assertTrue(np.isclose(out[i], true_scores[i]), msg="Score {}".format(score_names[i]))
+        # The in-process scores must agree with the same recorded values
+        for native in [False, True]:
+            out = tdm.Spurious_Weighted_Score(
+                    self.basename,
+                    self.sequence_dicts[2],
+                    self.sequence_dicts[0],
+                    clean=True,
+                    tmpdir=tmpdir,
+                    bored=1,
+                    native=native)
+            for i in range(6):
+                with self.subTest(native=native, score=score_names[i]):
+                    self.assertTrue(np.isclose(out[i], true_scores[i]),
+                                    msg="Score {}".format(score_names[i]))
     
     def test_NUPACK_Eval_bad_nucleotide(self, tmpdir=None):
         import re
@@ -237,6 +298,94 @@ class TestTDMNUPACK(unittest.TestCase):
             self.assertTrue(np.isclose(out[i], trues[i]), 
                             msg="Score {} Test:{} True:{}".format(score_names[i], out[i], trues[i]))
     
+    def test_NUPACKSSScore_paired(self):
+        # A stable hairpin leaves some stem bases unpaired with probability
+        # between 1e-6 and 1e-3. They must count towards the scores, as they
+        # did when the scores were read from the concentrations output.
+        seq = 'ACGCAGCGTTTTCGCTGCGT'
+        toe_region = list(range(1, 8))
+        trues = baseline_unpaired(seq)
+        self.assertTrue(any(1e-6 <= p < 1e-3 for i, p in trues))
+        self.assertEqual(tdm.NUPACK_Unpaired(seq), trues)
+        probs = [p for i, p in trues]
+        toe_probs = [p for i, p in trues if i in toe_region]
+        trues = [min(probs), sum(probs), min(toe_probs), sum(toe_probs)]
+        out = tdm.NUPACKSSScore('hairpin', {'hairpin': seq},
+                                toe_region=toe_region, clean=True)
+        for i in range(4):
+            self.assertTrue(np.isclose(out[i], trues[i]),
+                            msg="Score {} Test:{} True:{}".format(i, out[i], trues[i]))
+
+    def test_NUPACK_Unpaired_cutoff(self):
+        # Bases are reported down to the 1e-6 cutoff of concentrations, not
+        # NUPACK's default of 1e-3
+        calls = []
+        entries = np.array([[1, 4, 0.5], [2, 4, 1e-5], [1, 2, 0.5],
+                            [3, 4, 1.0]])
+        def complexes(seqs, *args, **kwargs):
+            calls.append(kwargs.get('cutoff'))
+            return None, None, None, {(1, 1): (3, entries)}, None
+        NUPACK_Complexes = tdm.NUPACK_Complexes
+        tdm.NUPACK_Complexes = complexes
+        try:
+            out = tdm.NUPACK_Unpaired('ACG')
+        finally:
+            tdm.NUPACK_Complexes = NUPACK_Complexes
+        self.assertEqual(calls, [1e-6])
+        self.assertEqual(out, [[1, 0.5], [2, 1e-5], [3, 1.0]])
+        # The batched run passes the same cutoff
+        orders = {(1, 1): [1]}
+        def complexes(seqs, *args, **kwargs):
+            calls.append(kwargs.get('cutoff'))
+            return None, None, None, {(1, 1): (3, entries)}, orders
+        tdm.NUPACK_Complexes = complexes
+        try:
+            out = tdm.NUPACK_Unpaired_batch(['ACG', 'ACG'])
+        finally:
+            tdm.NUPACK_Complexes = NUPACK_Complexes
+        self.assertEqual(calls, [1e-6, 1e-6])
+        self.assertEqual(out, [[[1, 0.5], [2, 1e-5], [3, 1.0]]] * 2)
+
+    def test_SS_Eval_batch(self):
+        strands = self.h_inputs[0][:6]
+        top_dict = dict((s, self.h_inputs[3][s]) for s in strands)
+        trues = tdm.SS_Eval(self.sequence_dicts[0], top_dict)
+        out = tdm.SS_Eval(self.sequence_dicts[0], top_dict, batch=True)
+        for i in range(4):
+            self.assertTrue(np.isclose(out[i], trues[i]),
+                            msg="Score {} Test:{} True:{}".format(i, out[i], trues[i]))
+    
+    def test_unique_pairs(self):
+        seq_dict = {'a': 'ACGT', 'b': 'TTTT', 'c': 'ACGT', 'd': 'GGGG'}
+        pairs = [('a', 'b'), ('b', 'a'), ('c', 'b'), ('a', 'c'), ('a', 'a'),
+                 ('b', 'd'), ('a', 'b')]
+        uniq, inverse = tdm.unique_pairs(pairs, seq_dict)
+        self.assertEqual(uniq, [('a', 'b'), ('a', 'c'), ('b', 'd')])
+        self.assertEqual(inverse, [0, 0, 0, 1, 1, 2, 0])
+    
+    def test_compare_sequence_notoe(self):
+        # Compare against a direct scan of every length and start
+        def scan(s1, s2, toeholds):
+            siz = min(len(s1), len(s2))
+            out = ["FALSE", 0, -1, -1]
+            for ll in range(5, siz + 1):
+                for i in range(len(s1) - ll + 1):
+                    for j in range(len(s2) - ll + 1):
+                        if s1[i:i+ll] == s2[j:j+ll] and s1[i:i+ll] not in toeholds:
+                            out = ["TRUE" if ll == siz else out[0], ll, i, j]
+            return out
+        rng = np.random.RandomState(11)
+        for trial in range(300):
+            alpha = ['AC', 'ACG', 'ACGT'][trial % 3]
+            s1 = ''.join(rng.choice(list(alpha), rng.randint(0, 25)))
+            s2 = ''.join(rng.choice(list(alpha), rng.randint(0, 25)))
+            if trial % 5 == 0:
+                s2 = s1[trial % 4:]
+            toeholds = set(s[i:i+7] for s in (s1, s2) for i in range(0, len(s) - 6, 3))
+            self.assertEqual(tdm.compare_sequence_notoe(s1, s2, toeholds),
+                             scan(s1, s2, toeholds),
+                             msg="{} {}".format(s1, s2))
+    
     def test_BM_Eval(self):
         sd = ['qwertyuiop', 'asdfghjkl', 'zxcvbnm']
         bm = range(3)
@@ -287,7 +436,10 @@ class TestTDMNUPACK(unittest.TestCase):
 def suite():
     tests = ['test_NUPACKIntScore', 'test_NUPACK_Cmpx_Conc', 'test_NUPACK_Cmpx_Defect',
              'test_NUPACK_Cmpx_Conc_c4', 'test_NUPACK_Cmpx_Defect_c4',
+             'test_NUPACK_Cmpx_Conc_Defect_c4', 'test_ensemble_defect',
              'test_Spurious_Weighted_Score', 'test_NUPACK_Eval_bad_nucleotide', 
              'test_NUPACK_Eval_bad_nucleotide_c4', 
-             'test_NUPACKSSScore', 'test_BM_Eval']
+             'test_NUPACKSSScore', 'test_NUPACKSSScore_paired',
+             'test_NUPACK_Unpaired_cutoff', 'test_SS_Eval_batch', 'test_unique_pairs',
+             'test_compare_sequence_notoe', 'test_BM_Eval']
     return unittest.TestSuite(list(map(TestTDMNUPACK, tests)))
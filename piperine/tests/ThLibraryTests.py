@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import stickydesign as sd
+
+from .. import thlibrary, gen_th, energyfuncs_james, designer
+
+class TestToeholdLibrary(unittest.TestCase):
+    params = (7, 7.7, 0.5, 0.4)
+    # A single StickyDesign run fails now and then, leaving the library empty
+    tries = 6
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.env = os.environ.get('PIPERINE_TOEHOLDS')
+        os.environ['PIPERINE_TOEHOLDS'] = self.tmpdir
+        np.random.seed(23)
+
+    def tearDown(self):
+        if self.env is None:
+            del os.environ['PIPERINE_TOEHOLDS']
+        else:
+            os.environ['PIPERINE_TOEHOLDS'] = self.env
+        thlibrary._libraries.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def test_build(self):
+        library = thlibrary.build_library(*self.params, tries=self.tries)
+        n = len(library)
+        self.assertGreater(n, 6)
+        self.assertEqual(library.energies.shape, (2 * n, 2 * n))
+        # Every end binds its complement near the target, and nothing else
+        # more strongly than the spurious limit
+        ef = gen_th.get_energyfuncs(energyfuncs_james, 7.7)
+        ends = sd.endarray(library.ends, 'TD')
+        self.assertTrue(np.all(abs(ef.th_external_dG(ends) - 7.7) <= 0.5))
+        self.assertLessEqual(library.max_spurious(np.arange(n)), 0.4 * 7.7)
+        # Submatrices match energies computed for the drawn ends alone
+        indices = library.draw(5)
+        sub = sd.endarray([library.ends[i] for i in indices], 'TD')
+        self.assertTrue(np.array_equal(library.spurious(indices),
+                                       sd.energy_array_uniform(sub, ef)))
+
+    def test_draw(self):
+        library = thlibrary.build_library(*self.params, tries=self.tries)
+        n = len(library)
+        self.assertGreater(n, 6)
+        k = n // 3
+        drawn = np.concatenate([library.draw(k, disjoint=True)
+                                for i in range(3)])
+        self.assertEqual(len(set(drawn.tolist())), 3 * k)
+        self.assertEqual(len(set(library.draw(n).tolist())), n)
+        self.assertEqual(library.toeholds([0])[0], library.ends[0][1:-1])
+        self.assertRaises(ValueError, library.draw, n + 1)
+
+    def test_get_library(self):
+        library = thlibrary.get_library(*self.params, tries=self.tries)
+        self.assertIs(thlibrary.get_library(*self.params), library)
+        key = thlibrary.make_key(*(self.params + (energyfuncs_james,)))
+        filename = os.path.join(self.tmpdir, key + '.npz')
+        self.assertTrue(os.path.isfile(filename))
+        # A new process loads the saved library instead of building one
+        thlibrary._libraries.clear()
+        loaded = thlibrary.get_library(*self.params)
+        self.assertIsNot(loaded, library)
+        self.assertEqual(loaded.ends, library.ends)
+        self.assertTrue(np.array_equal(loaded.energies.toarray(),
+                                       library.energies.toarray()))
+        self.assertEqual(loaded.params['e_module'], energyfuncs_james.__name__)
+        # Other parameters get their own library
+        self.assertNotEqual(key, thlibrary.make_key(7, 7.7, 0.5, 0.5,
+                                                    energyfuncs_james))
+
+    def test_toehold_wrapper(self):
+        library = thlibrary.get_library(7, 7.7, 1, 0.5, tries=self.tries)
+        self.assertGreaterEqual(len(library), 4)
+        ths = designer.toehold_wrapper(4, th_library=True)
+        self.assertEqual(len(ths), 4)
+        self.assertTrue(set(ths) <= set(library.toeholds(range(len(library)))))
+        # Too few toeholds in the library falls back to a search
+        key = thlibrary.make_key(7, 7.7, 1, 0.5, energyfuncs_james)
+        small = thlibrary.ToeholdLibrary(library.ends[:2],
+                                         library.spurious([0, 1]))
+        thlibrary._libraries[(key, os.path.join(self.tmpdir, key + '.npz'))] \
+            = small
+        ths = designer.toehold_wrapper(4, th_library=True)
+        self.assertEqual(len(ths), 4)
+
+def suite():
+    tests = ['test_build', 'test_draw', 'test_get_library',
+             'test_toehold_wrapper']
+    return unittest.TestSuite(map(TestToeholdLibrary, tests))
@@ -0,0 +1,140 @@
+import unittest
+from time import time
+
+import numpy as np
+import stickydesign as sd
+
+from .. import gen_th, energyfuncs_james
+
+def reference_scores(toeholds, targetdG):
+    # score_toeholds as written before batching, one set at a time
+    flanked = ['c' + th.lower() + 'c' for th in toeholds]
+    ef = energyfuncs_james.energyfuncs(targetdG=targetdG)
+    ends = sd.endarray(flanked, 'TD')
+    e_vec_all = np.concatenate((ef.th_internal_dG(ends),
+                                ef.th_external_dG(ends)))
+    return (e_vec_all.mean(), e_vec_all.max() - e_vec_all.min())
+
+class TestScoreToeholds(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(18)
+        self.sets = [[''.join(rng.choice(list('acgt'), 7)) for t in range(6)]
+                     for s in range(40)]
+
+    def tearDown(self):
+        gen_th.clear_energyfuncs()
+
+    def test_energyfuncs_cache(self):
+        ef = gen_th.get_energyfuncs(energyfuncs_james, 7.7)
+        self.assertIs(gen_th.get_energyfuncs(energyfuncs_james, 7.7), ef)
+        self.assertEqual(ef.targetdG, 7.7)
+        other = gen_th.get_energyfuncs(energyfuncs_james, 8.0)
+        self.assertIsNot(other, ef)
+        self.assertEqual(other.targetdG, 8.0)
+        self.assertIsNot(gen_th.get_energyfuncs(energyfuncs_james, 7.7, 'loop'),
+                         ef)
+        gen_th.clear_energyfuncs()
+        self.assertIsNot(gen_th.get_energyfuncs(energyfuncs_james, 7.7), ef)
+
+    def test_score_toeholds(self):
+        for ths in self.sets[:5]:
+            self.assertEqual(gen_th.score_toeholds(ths, 7.7),
+                             reference_scores(ths, 7.7))
+
+    def test_batch(self):
+        e_avg, e_rng = gen_th.score_toeholds_batch(self.sets, 7.7)
+        trues = [reference_scores(ths, 7.7) for ths in self.sets]
+        self.assertEqual(e_avg.tolist(), [t[0] for t in trues])
+        self.assertEqual(e_rng.tolist(), [t[1] for t in trues])
+        # Base codes and upper case letters give the same scores
+        codes = gen_th.toehold_codes(self.sets)
+        self.assertEqual(codes.shape, (40, 6, 7))
+        self.assertEqual(codes[0, 0].tolist(),
+                         ['acgt'.index(b) for b in self.sets[0][0]])
+        for toeholds in [codes, np.array([[list(th.upper()) for th in ths]
+                                          for ths in self.sets])]:
+            avg, rng = gen_th.score_toeholds_batch(toeholds, 7.7)
+            self.assertEqual(avg.tolist(), e_avg.tolist())
+            self.assertEqual(rng.tolist(), e_rng.tolist())
+
+    def test_bad_toeholds(self):
+        with self.assertRaises(ValueError):
+            gen_th.toehold_codes([['acgn']])
+        with self.assertRaises(ValueError):
+            gen_th.toehold_codes(['acgt', 'ttga'])
+
+class TestGetToeholds(unittest.TestCase):
+    def check_toeholds(self, ths, n_ths, thold_l):
+        self.assertEqual(len(ths), n_ths)
+        self.assertEqual(len(set(ths)), n_ths)
+        self.assertTrue(all(len(th) == thold_l and set(th) <= set('acgt')
+                            for th in ths))
+
+    def test_get_toeholds(self):
+        self.check_toeholds(gen_th.get_toeholds(6, 7, 7.7, 0.5, 0.4), 6, 7)
+
+    def test_race(self):
+        ths = gen_th.get_toeholds(6, 7, 7.7, 0.5, 0.4, timeout=30, n_jobs=2)
+        self.check_toeholds(ths, 6, 7)
+
+    def test_oldends(self):
+        old = gen_th.get_toeholds(4, 7, 7.7, 0.5, 0.4)
+        new = gen_th.get_toeholds(3, 7, 7.7, 0.5, 0.4, oldends=old)
+        self.check_toeholds(new, 3, 7)
+        self.assertFalse(set(new) & set(old))
+        # The merged set meets the spurious limit, leaving out each end with
+        # its own complement
+        ef = gen_th.get_energyfuncs(energyfuncs_james, 7.7)
+        ends = sd.endarray(['c' + th + 'c' for th in old + new], 'TD')
+        energies = sd.energy_array_uniform(ends, ef)
+        n = len(ends)
+        energies[range(n), range(n, 2 * n)] = 0
+        energies[range(n, 2 * n), range(n)] = 0
+        self.assertLessEqual(energies.max(), 0.4 * 7.7)
+
+    def test_timeout(self):
+        # Far more toeholds than the constraints allow
+        for n_jobs in [1, 2]:
+            start = time()
+            out = gen_th.get_toeholds(60, 5, 7.7, 0.05, 0.1, timeout=1,
+                                      n_jobs=n_jobs)
+            self.assertEqual(out, -1)
+            self.assertLess(time() - start, 5)
+
+class TestSpuriousMatrix(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(25)
+        self.ends = ['c' + ''.join(rng.choice(list('acgt'), 7)) + 'c'
+                     for i in range(30)]
+        ef = gen_th.get_energyfuncs(energyfuncs_james, 7.7)
+        self.dense = sd.energy_array_uniform(sd.endarray(self.ends, 'TD'), ef)
+
+    def test_blocks(self):
+        for block_size in [512, 7, 60]:
+            energies = gen_th.spurious_matrix(self.ends, block_size=block_size)
+            self.assertEqual(energies.shape, (60, 60))
+            self.assertEqual(energies.nnz, (self.dense > 0).sum())
+            self.assertTrue(np.array_equal(energies.toarray(), self.dense))
+
+    def test_threshold(self):
+        energies = gen_th.spurious_matrix(sd.endarray(self.ends, 'TD'), 3.0,
+                                          block_size=16)
+        trues = np.where(self.dense > 3.0, self.dense, 0)
+        self.assertTrue(np.array_equal(energies.toarray(), trues))
+        self.assertEqual(gen_th.spurious_matrix([], 3.0).shape, (0, 0))
+
+    def test_pool(self):
+        energies = gen_th.spurious_matrix(self.ends, 1.0, block_size=16,
+                                          n_jobs=2)
+        trues = np.where(self.dense > 1.0, self.dense, 0)
+        self.assertTrue(np.array_equal(energies.toarray(), trues))
+
+def suite():
+    tests = ['test_energyfuncs_cache', 'test_score_toeholds', 'test_batch',
+             'test_bad_toeholds']
+    get_tests = ['test_get_toeholds', 'test_race', 'test_oldends',
+                 'test_timeout']
+    matrix_tests = ['test_blocks', 'test_threshold', 'test_pool']
+    return unittest.TestSuite(list(map(TestScoreToeholds, tests)) +
+                              list(map(TestGetToeholds, get_tests)) +
+                              list(map(TestSpuriousMatrix, matrix_tests)))
@@ -0,0 +1,136 @@
+import os
+import re
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+import numpy as np
+
+from .. import wsi
+from .test_data import curdir
+
+def revcomp(seq):
+    comp = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+    return ''.join(comp[c] for c in reversed(seq))
+
+def brute_counts(st, k):
+    # Pairs of windows counted by definition, by strand and complex
+    windows = []
+    for c, cmplx in enumerate(st.split('  ')):
+        for s, strand in enumerate(cmplx.split(' ')):
+            for i in range(len(strand) - k + 1):
+                windows.append(((c, s), strand[i:i+k]))
+    counts = [0, 0, 0]
+    for a in range(len(windows)):
+        for b in range(a, len(windows)):
+            (ga, wa), (gb, wb) = windows[a], windows[b]
+            # Identical palindromes count as both kinds of match
+            n = (wa == revcomp(wb)) + (a < b and wa == wb)
+            counts[0 if ga == gb else 1 if ga[0] == gb[0] else 2] += n
+    return counts
+
+def random_design(rng):
+    return '  '.join(' '.join(''.join(rng.choice(list('ACGT'),
+                                                 rng.randint(1, 30)))
+                              for s in range(rng.randint(1, 4)))
+                     for c in range(rng.randint(1, 4)))
+
+class TestWSI(unittest.TestCase):
+    # Output of spuriousSSM score=automatic spurious_range=10 for the
+    # test_tdm sequences
+    counts = [[1016, 315, 88, 34, 13, 7, 2, 0, 0, 0],
+              [0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+              [26686, 7340, 2328, 979, 453, 212, 52, 9, 3, 3]]
+    mismatches = [[70, 23, 10, 5, 0, 0, 0, 0, 0, 0],
+                  [0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+                  [6931, 2580, 788, 263, 98, 59, 22, 13, 3, 3]]
+    verboten = 89252.5
+    spurious = 5594.75303
+    bonds = -685.33551
+    score = 53670.72815
+
+    def setUp(self):
+        names = [os.path.join(curdir, 'test_tdm' + ext)
+                 for ext in ['.sp', '.wc', '.eq']]
+        self.st, self.wc, self.eq = wsi.read_constraints(*names)
+
+    def test_counts(self):
+        counts = wsi.spurious_counts(self.st, 3, 12, self.wc, self.eq)
+        self.assertEqual(counts.tolist(), self.counts)
+        mismatches = wsi.mismatch_counts(self.st, 5, 14)
+        self.assertEqual(mismatches.tolist(), self.mismatches)
+
+    def test_brute_counts(self):
+        rng = np.random.RandomState(16)
+        for i in range(20):
+            st = random_design(rng)
+            counts = wsi.spurious_counts(st, 3, 6)
+            for col, k in enumerate(range(3, 7)):
+                self.assertEqual(counts[:, col].tolist(), brute_counts(st, k))
+        # A palindrome pairs with itself
+        self.assertEqual(wsi.spurious_counts('ACGTTTGACC', 3, 4).tolist(),
+                         [[1, 1], [0, 0], [0, 0]])
+
+    def test_scores(self):
+        self.assertEqual(wsi.verboten_score(self.st), self.verboten)
+        self.assertAlmostEqual(wsi.bonds_score(self.st, self.wc), self.bonds,
+                               places=4)
+        counts, mismatches, verboten, score = wsi.automatic_score(
+            self.st, self.wc, self.eq)
+        self.assertAlmostEqual(
+            wsi.spurious_score(self.st, counts, mismatches), self.spurious,
+            places=4)
+        self.assertAlmostEqual(score, self.score, places=4)
+
+    def test_bad6mers(self):
+        table = wsi.bad6mer_table()
+        self.assertEqual(len(table), 4**6)
+        kmers = [int(s.translate(str.maketrans('ACGT', '0123')), 4)
+                 for s in ['GGGGAA', 'CCCCCC', 'ATATAT', 'ACGTAC']]
+        self.assertEqual(table[kmers].tolist(), [2002.5, 2004.5, 2.5, 0.5])
+
+    def test_wsi_scores(self):
+        scores = wsi.wsi_scores(self.st, self.wc, self.eq)
+        w = wsi.linear_weights(3, 12)
+        w1 = wsi.linear_weights(5, 14)
+        trues = [np.dot(self.counts[0], w), np.dot(self.counts[2], w),
+                 np.dot(self.mismatches[0], w1), np.dot(self.mismatches[2], w1),
+                 self.verboten, self.score]
+        np.testing.assert_allclose(scores, trues, rtol=1e-9)
+
+    @unittest.skipUnless(shutil.which('spuriousSSM'), 'spuriousSSM not found')
+    def test_spuriousSSM(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            rng = np.random.RandomState(17)
+            for i in range(5):
+                st = random_design(rng)
+                n = len(st)
+                wc = -np.ones(n, dtype=np.int64)
+                eq = np.array([0 if c == ' ' else j + 1
+                               for j, c in enumerate(st)])
+                names = [os.path.join(tmpdir, 'x' + ext)
+                         for ext in ['.st', '.wc', '.eq']]
+                for name, text in zip(names, [st, ' '.join(map(str, wc)),
+                                              ' '.join(map(str, eq))]):
+                    with open(name, 'w') as f:
+                        f.write(text)
+                out = subprocess.check_output(
+                    ['spuriousSSM', 'score=automatic', 'template=' + names[0],
+                     'wc=' + names[1], 'eq=' + names[2], 'tmax=0', 'bored=0',
+                     'spurious_range=10', 'quiet=SCORES']).decode()
+                total = float(re.search(r'-weighted score =\s*(\S+)',
+                                        out).group(1))
+                verboten = float(re.search(r'score_verboten score =\s*(\S+)',
+                                           out).group(1))
+                counts, mismatches, v, score = wsi.automatic_score(st, wc, eq)
+                self.assertEqual(v, verboten)
+                self.assertAlmostEqual(score, total, places=4)
+        finally:
+            shutil.rmtree(tmpdir)
+
+def suite():
+    tests = ['test_counts', 'test_brute_counts', 'test_scores',
+             'test_bad6mers', 'test_wsi_scores', 'test_spuriousSSM']
+    return unittest.TestSuite(list(map(TestWSI, tests)))
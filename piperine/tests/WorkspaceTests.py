@@ -0,0 +1,37 @@
+import os
+import unittest
+from tempfile import mkdtemp
+import shutil
+
+from .. import workspace
+
+class TestWorkspace(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_prefixes(self):
+        with workspace.Workspace(self.root) as ws:
+            prefixes = [ws.prefix() for i in range(100)]
+            self.assertEqual(len(set(prefixes)), 100)
+            self.assertTrue(all(os.path.dirname(p) == ws.path for p in prefixes))
+            self.assertTrue(ws.prefix('.fixed').endswith('.fixed'))
+
+    def test_cleanup(self):
+        with workspace.Workspace(self.root) as ws:
+            open(ws.prefix() + '.in', 'w').close()
+        self.assertFalse(os.path.exists(ws.path))
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_keep(self):
+        with workspace.Workspace(self.root, keep=True) as ws:
+            fname = ws.prefix() + '.in'
+            open(fname, 'w').close()
+        self.assertTrue(os.path.isfile(fname))
+
+def suite():
+    tests = ['test_prefixes', 'test_cleanup', 'test_keep']
+    return unittest.TestSuite(list(map(TestWorkspace, tests)))
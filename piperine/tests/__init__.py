@@ -1,4 +1,8 @@
 __doc__ = ''' Doc string? '''
+import os
+# Keep the caches written by the code under test out of the home directory
+os.environ['PIPERINE_CACHE'] = ''
+os.environ['PIPERINE_PARAMS'] = ''
 from . import CompilationTests
 from . import import_test
 from . import run_unittests
@@ -7,3 +11,17 @@ from . import TDMTests
 from . import THTests
 from . import test_data
 from . import TDM_NUPACK_tests
+from . import NUPACKCacheTests
+from . import EquilibriumTests
+from . import WorkspaceTests
+from . import RunnerTests
+from . import ProfilingTests
+from . import SuffixArrayTests
+from . import NameResolverTests
+from . import SequenceStoreTests
+from . import IncrementalTests
+from . import WSITests
+from . import ArtifactsTests
+from . import ToeholdTests
+from . import EnergyfuncsTests
+from . import ThLibraryTests
@@ -6,6 +6,20 @@ from . import CompilationTests
 from . import RunDesignerTest
 from . import DSDClassesTests
 from . import TDM_NUPACK_tests
+from . import NUPACKCacheTests
+from . import EquilibriumTests
+from . import WorkspaceTests
+from . import RunnerTests
+from . import ProfilingTests
+from . import SuffixArrayTests
+from . import NameResolverTests
+from . import SequenceStoreTests
+from . import IncrementalTests
+from . import WSITests
+from . import ArtifactsTests
+from . import ToeholdTests
+from . import EnergyfuncsTests
+from . import ThLibraryTests
 
 def runem():
     suite = import_test.suite()
@@ -35,10 +49,71 @@ def run_nupack():
     suite = TDM_NUPACK_tests.suite()
     unittest.TextTestRunner(verbosity=2).run(suite)
 
+def run_cache():
+    suite = NUPACKCacheTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_equilibrium():
+    suite = EquilibriumTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_workspace():
+    suite = WorkspaceTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_runner():
+    suite = RunnerTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_profiling():
+    suite = ProfilingTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_suffixarray():
+    suite = SuffixArrayTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_nameresolver():
+    suite = NameResolverTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_sequencestore():
+    suite = SequenceStoreTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_incremental():
+    suite = IncrementalTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_wsi():
+    suite = WSITests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_artifacts():
+    suite = ArtifactsTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_toeholds():
+    suite = ToeholdTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_energyfuncs():
+    suite = EnergyfuncsTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+def run_thlibrary():
+    suite = ThLibraryTests.suite()
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
 def run_all():
     alltests = unittest.TestSuite(
         [
             x.suite() for x in 
-                [import_test, TDMTests, CompilationTests, RunDesignerTest, DSDClassesTests, TDM_NUPACK_tests]
+                [import_test, TDMTests, CompilationTests, RunDesignerTest, DSDClassesTests, TDM_NUPACK_tests,
+                 NUPACKCacheTests, EquilibriumTests, WorkspaceTests,
+                 RunnerTests, ProfilingTests, SuffixArrayTests,
+                 NameResolverTests, SequenceStoreTests, IncrementalTests,
+                 WSITests, ArtifactsTests, ToeholdTests,
+                 EnergyfuncsTests, ThLibraryTests]
         ])
     unittest.TextTestRunner(verbosity=2).run(alltests)
@@ -0,0 +1,209 @@
+""" Libraries of mutually compatible toeholds, kept on disk
+
+Toehold generation parameters rarely change between reps or runs, so rather
+than running stickydesign for every rep, a library holds a large set of
+toeholds found once, all of which satisfy the binding energy and spurious
+interaction constraints with each other. Any subset of a library is then a
+valid toehold set, and reps draw from it. The interaction energies between
+every pair of toeholds and complements are stored with the library as a
+sparse matrix, computed in blocks by gen_th.spurious_matrix.
+
+Libraries are keyed by the toehold parameters and energetics module. They are
+saved as .npz files in the directory read from the PIPERINE_TOEHOLDS
+environment variable (~/.piperine/toeholds if unset). Setting
+PIPERINE_TOEHOLDS to an empty string keeps libraries in memory only.
+
+    library = get_library(thold_l=7, thold_e=7.7, e_dev=1, m_spurious=0.5)
+    toeholds = library.toeholds(library.draw(6, disjoint=True))
+"""
+from __future__ import division, print_function
+
+import os
+import json
+import hashlib
+
+import numpy as np
+from scipy import sparse
+
+from . import gen_th
+from . import energyfuncs_james
+
+default_dir = os.path.join(os.path.expanduser('~'), '.piperine', 'toeholds')
+
+def make_key(thold_l, thold_e, e_dev, m_spurious, e_module):
+    """ Hash the parameters a toehold library is generated with
+
+    Returns:
+        key: Hex digest identifying the library
+    """
+    fields = [str(int(thold_l)), '{:.4f}'.format(thold_e),
+              '{:.4f}'.format(e_dev), '{:.4f}'.format(m_spurious),
+              e_module.__name__]
+    return hashlib.sha1('\n'.join(fields).encode('utf-8')).hexdigest()
+
+class ToeholdLibrary(object):
+    """ Mutually compatible toeholds and their interaction energies
+
+    Args:
+        ends: Toeholds with their adjacent bases, as from stickydesign
+        energies: Array or scipy.sparse matrix of shape (2n, 2n) of
+            interaction energies between the ends followed by their
+            complements, as gen_th.spurious_matrix. It is kept in CSR form.
+        params: Dictionary of the parameters the library was generated with
+
+    Attributes:
+        order: Shuffled end indices that disjoint draws are taken from
+        cursor: Position of the next disjoint draw in order
+    """
+    def __init__(self, ends, energies, params=None):
+        self.ends = list(ends)
+        self.energies = sparse.csr_matrix(energies)
+        self.params = params if params is not None else dict()
+        self.order = np.random.permutation(len(self.ends))
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.ends)
+
+    def draw(self, n, disjoint=False):
+        """ Indices of n distinct toeholds chosen at random
+
+        With disjoint, successive draws share no toeholds until the library
+        is used up, after which it is shuffled again.
+
+        Raises:
+            ValueError: If the library holds fewer than n toeholds
+        """
+        if n > len(self):
+            raise ValueError('Library holds {} toeholds, {} were asked '
+                             'for'.format(len(self), n))
+        if not disjoint:
+            return np.random.choice(len(self), n, replace=False)
+        if self.cursor + n > len(self):
+            self.order = np.random.permutation(len(self))
+            self.cursor = 0
+        indices = self.order[self.cursor:self.cursor + n]
+        self.cursor += n
+        return indices
+
+    def toeholds(self, indices):
+        """ Toehold sequences of ends, without their adjacent bases """
+        return [self.ends[i][1:-1] for i in indices]
+
+    def spurious(self, indices):
+        """ Interaction energies among some ends and their complements
+
+        Returns:
+            energies: Dense array of shape (2k, 2k) for k indices, the ends
+                followed by their complements, taken from the stored matrix
+        """
+        indices = np.asarray(indices, dtype=int)
+        both = np.concatenate((indices, indices + len(self)))
+        return self.energies[both][:, both].toarray()
+
+    def max_spurious(self, indices):
+        """ Strongest interaction among ends and complements, leaving out each
+        end with its own complement """
+        energies = self.spurious(indices)
+        k = len(indices)
+        energies[np.arange(k), np.arange(k) + k] = -np.inf
+        energies[np.arange(k) + k, np.arange(k)] = -np.inf
+        return energies.max()
+
+    def save(self, filename):
+        """ Write the library to an .npz file """
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmpname, 'wb') as f:
+            np.savez(f, ends=np.array(self.ends), data=self.energies.data,
+                     indices=self.energies.indices,
+                     indptr=self.energies.indptr,
+                     shape=np.array(self.energies.shape),
+                     params=np.array(json.dumps(self.params, sort_keys=True)))
+        os.replace(tmpname, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """ Read a library written by save """
+        with np.load(filename) as npz:
+            energies = sparse.csr_matrix((npz['data'], npz['indices'],
+                                          npz['indptr']),
+                                         shape=tuple(npz['shape']))
+            return cls(npz['ends'].tolist(), energies,
+                       json.loads(str(npz['params'])))
+
+def build_library(thold_l=7, thold_e=7.7, e_dev=1, m_spurious=0.5,
+                  e_module=energyfuncs_james, tries=10, n_jobs=1):
+    """ Generate a toehold library with stickydesign
+
+    Each try asks stickydesign for as many compatible toeholds as it can
+    find; the largest set is kept.
+
+    Args:
+        thold_l: Nt in a toehold (7)
+        thold_e: Target deltaG in kCal/Mol (7.7)
+        e_dev: Allowable deviation in kCal/mole (1)
+        m_spurious: Maximum spurious dG as fraction of thold_e (0.5)
+        e_module: Thermodynamics used by stickydesign (energyfuncs_james)
+        tries: Runs of stickydesign (10)
+        n_jobs: Processes computing the interaction energies (1)
+    Returns:
+        library: ToeholdLibrary
+    """
+    ef = gen_th.get_energyfuncs(e_module, thold_e)
+    # Avoid single-nucleotide toeholds, as get_toeholds does
+    avoid_list = [i * int(thold_l + 2) for i in ['a', 'c', 't']]
+    best = []
+    for n in range(tries):
+        th_cands = gen_th.toehold_attempt(0, thold_l, thold_e, e_dev,
+                                          m_spurious, ef, avoid_list)
+        if th_cands is not None and len(th_cands) > len(best):
+            best = th_cands
+    if best:
+        energies = gen_th.spurious_matrix(best, 0.0, thold_e, e_module,
+                                          n_jobs=n_jobs)
+    else:
+        energies = np.zeros((0, 0))
+    params = {'thold_l': int(thold_l), 'thold_e': thold_e, 'e_dev': e_dev,
+              'm_spurious': m_spurious, 'e_module': e_module.__name__}
+    return ToeholdLibrary(best, energies, params)
+
+# Libraries loaded or built by this process, by key
+_libraries = dict()
+
+def get_library(thold_l=7, thold_e=7.7, e_dev=1, m_spurious=0.5,
+                e_module=energyfuncs_james, tries=10, dirname=None, n_jobs=1):
+    """ The toehold library for a set of parameters
+
+    The library is loaded from dirname (PIPERINE_TOEHOLDS or default_dir if
+    None), or built with build_library and saved there. Libraries are kept
+    for the rest of the process, so successive disjoint draws do not repeat
+    toeholds. n_jobs is passed to build_library.
+
+    Returns:
+        library: ToeholdLibrary
+    """
+    key = make_key(thold_l, thold_e, e_dev, m_spurious, e_module)
+    if dirname is None:
+        dirname = os.environ.get('PIPERINE_TOEHOLDS', default_dir)
+    filename = os.path.join(dirname, key + '.npz') if dirname else None
+    if (key, filename) in _libraries:
+        return _libraries[(key, filename)]
+    library = None
+    if filename and os.path.isfile(filename):
+        try:
+            library = ToeholdLibrary.load(filename)
+        except (IOError, ValueError, KeyError):
+            library = None
+    if library is None:
+        library = build_library(thold_l, thold_e, e_dev, m_spurious, e_module,
+                                tries, n_jobs)
+        if filename and len(library):
+            try:
+                library.save(filename)
+            except (IOError, OSError):
+                print('Could not write toehold library to {}'.format(filename))
+    _libraries[(key, filename)] = library
+    return library
@@ -0,0 +1,64 @@
+""" Scratch space for the temporary files written while scoring a design
+
+NUPACK and spuriousSSM communicate through files, so every score writes a
+handful of inputs and outputs. A Workspace gathers them in one directory,
+placed on RAM-backed /dev/shm when it is available, hands out unique file
+prefixes without touching the filesystem, and removes the whole directory
+when scoring is done.
+
+    with Workspace() as ws:
+        prefix = ws.prefix()      # e.g. /dev/shm/piperine-x1y2/p4242-0
+"""
+from __future__ import division, print_function
+
+import os
+import shutil
+from tempfile import mkdtemp
+
+shm_dir = '/dev/shm'
+
+def default_root():
+    """ /dev/shm if it is a writable directory, otherwise None (the system
+    temporary directory) """
+    if os.path.isdir(shm_dir) and os.access(shm_dir, os.W_OK | os.X_OK):
+        return shm_dir
+    return None
+
+class Workspace(object):
+    """ A single scratch directory with cheap unique file prefixes
+
+    Prefixes combine the process id with a counter, so a Workspace may be
+    handed to multiprocessing workers and every process still gets distinct
+    names.
+
+    Args:
+        root: Directory in which to create the workspace. Defaults to
+            default_root().
+        keep: Leave the files in place on cleanup, for debugging (False)
+    """
+    def __init__(self, root=None, keep=False):
+        if root is None:
+            root = default_root()
+        self.keep = keep
+        self.path = mkdtemp(prefix='piperine-', dir=root)
+        self._count = 0
+
+    def prefix(self, suffix=''):
+        """ Unique path inside the workspace. No file is created. """
+        self._count += 1
+        name = 'p{}-{}{}'.format(os.getpid(), self._count, suffix)
+        return os.path.join(self.path, name)
+
+    def cleanup(self):
+        """ Delete the workspace and everything in it, unless keep is set """
+        if self.keep:
+            print('Keeping temporary files in {}'.format(self.path))
+        elif os.path.isdir(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+        return False
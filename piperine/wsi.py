@@ -0,0 +1,337 @@
+""" Weighted spurious interaction (WSI) scores computed in process
+
+spuriousSSM scores a design from three constraint files: the .st file holding
+the sequence, strands separated by a space and complexes by two, and the .wc
+and .eq files giving, for every position, its target partner and the
+representative of its equivalence class (1-based, -1 and 0 for none). This
+module computes the same quantities from that data with NumPy:
+
+    * spurious_counts: pairs of k-mers that are reverse complements, or
+      identical, and are not designed to be, by k and by whether the pair is
+      within a strand, between strands of a complex or between complexes
+    * mismatch_counts: the same for reverse complements with one mismatch
+    * verboten_score: penalties of disallowed 6-mers
+    * bonds_score: nearest neighbor energy of the target stacks
+    * automatic_score: spuriousSSM's score=automatic total of the three
+
+This is experimental. The counts and component scores match those printed by
+the spuriousSSM in peppercompiler 0.1.3, but the weighted total for the
+sequences9mut test design is 9311.037, while the value recorded for it in
+TDM_NUPACK_tests is 9310.668. The verboten, spurious and bonds scores and their
+weights all agree with that binary, so the recorded value most likely comes
+from another spuriousSSM build. Until the two agree, scores from this module
+should not be compared with scores from spuriousSSM.
+
+    st, wc, eq = read_constraints('design.st', 'design.wc', 'design.eq')
+    scores = wsi_scores(st, wc, eq)
+"""
+from __future__ import division, print_function
+
+import itertools
+
+import numpy as np
+
+from .sequencestore import SequenceStore
+
+# spuriousSSM defaults
+beta = 5.0
+mismatch = 25.0
+temperature = 37.0
+verboten_weak = 1.0
+verboten_strong = 2.0
+verboten_regular = 0.5
+
+# Nearest neighbor stack enthalpies (kcal/mol) and entropies (cal/mol/K),
+# indexed by the codes of the 5' and 3' bases of the top strand
+nnDH = np.array([[-7.9, -8.4, -7.8, -7.2],
+                 [-8.5, -8.0, -10.6, -7.8],
+                 [-8.2, -9.8, -8.0, -8.4],
+                 [-7.2, -8.2, -8.5, -7.9]])
+nnDS = np.array([[-22.2, -22.4, -21.0, -20.4],
+                 [-22.7, -19.9, -27.2, -21.0],
+                 [-22.2, -24.4, -19.9, -22.4],
+                 [-21.3, -22.2, -22.7, -22.2]])
+
+# Largest number of candidate pairs held in memory at once
+block_pairs = 1 << 22
+
+def read_constraints(stname, wcname, eqname):
+    """ Read the constraint files written for spuriousSSM
+
+    Returns:
+        st: Sequence string, strands separated by spaces
+        wc: int array, 1-based target partner of each position, -1 if none
+        eq: int array, 1-based representative of the equivalence class of
+            each position, 0 for spaces
+    """
+    with open(stname) as f:
+        st = f.readline().rstrip('\n')
+    with open(wcname) as f:
+        wc = np.array(f.read().split(), dtype=np.int64)
+    with open(eqname) as f:
+        eq = np.array(f.read().split(), dtype=np.int64)
+    return st, wc, eq
+
+def linear_weights(kmin, kmax, beta=5):
+    """ Weights of match lengths kmin to kmax used for the WSI histograms.
+    Matches shorter than beta+1 are ignored and the weight grows by one per
+    base up to 7 at 12. """
+    w_lin = np.concatenate([np.zeros((beta, )), np.arange(12-beta)+1,
+                            7*np.ones((2,))])
+    return w_lin[kmin-1:kmax]
+
+def layout(st):
+    """ Sequence store of st and the strand and complex of every position
+
+    Returns:
+        store: SequenceStore holding st under the name 'st'
+        strand: Number of spaces up to each position
+        cmpx: Number of double spaces up to each position
+    """
+    if len(set(st) - set('ACGT ')) > 0:
+        raise ValueError('st holds characters other than A, C, G, T and '
+                         'spaces')
+    store = SequenceStore({'st': st})
+    space = np.array([c == ' ' for c in st], dtype=bool)
+    double = space.copy()
+    double[0] = False
+    double[1:] &= space[:-1]
+    return store, np.cumsum(space), np.cumsum(double)
+
+def join(left, right):
+    """ All pairs (i, j) with left[i] == right[j], in blocks of at most
+    block_pairs pairs """
+    order = np.argsort(left, kind='stable')
+    ordered = left[order]
+    lo = np.searchsorted(ordered, right, 'left')
+    n = np.searchsorted(ordered, right, 'right') - lo
+    ends = np.cumsum(n)
+    j0 = 0
+    while j0 < len(right):
+        j1 = max(j0 + 1, int(np.searchsorted(ends, ends[j0] - n[j0] +
+                                             block_pairs, 'right')))
+        nb = n[j0:j1]
+        j = np.repeat(np.arange(j0, j1), nb)
+        first = np.repeat(lo[j0:j1] - (np.cumsum(nb) - nb), nb)
+        yield order[first + np.arange(len(j))], j
+        j0 = j1
+
+def designed(first, second, k):
+    """ Whether first(t) == second(t) for every t < k, first and second
+    giving an array over the candidate pairs for each t """
+    same = first(0) == second(0)
+    for t in range(1, k):
+        idx = np.flatnonzero(same)
+        if len(idx) == 0:
+            break
+        same[idx] = first(t)[idx] == second(t)[idx]
+    return same
+
+def tally(counts, col, pa, pb, strand, cmpx):
+    """ Add pairs of windows starting at pa and pb to column col of the
+    intra-strand, inter-strand and inter-complex rows """
+    same_strand = strand[pa] == strand[pb]
+    same_cmpx = cmpx[pa] == cmpx[pb]
+    counts[0, col] += np.count_nonzero(same_strand)
+    counts[1, col] += np.count_nonzero(same_cmpx & ~same_strand)
+    counts[2, col] += np.count_nonzero(~same_cmpx)
+
+def spurious_counts(st, kmin, kmax, wc=None, eq=None):
+    """ Spurious k-mer matches of a sequence, as spuriousSSM's spurious()
+
+    Every pair of windows of length k within strands is counted once when one
+    is the reverse complement of the other, including a window with itself,
+    or when they are identical. With wc and eq, pairs whose every base is
+    designed to pair with (or equivalent to) its counterpart are left out.
+
+    Returns:
+        counts: 3 x (kmax-kmin+1) int array, rows holding the pairs within a
+            strand, between strands of a complex and between complexes,
+            columns the values of k
+    """
+    store, strand, cmpx = layout(st)
+    if wc is not None:
+        wc = np.asarray(wc)
+        eq = np.asarray(eq)
+    counts = np.zeros((3, kmax - kmin + 1), dtype=np.int64)
+    for col, k in enumerate(range(kmin, kmax + 1)):
+        fwd = store.kmers('st', k)
+        rc = store.revcomp_kmers('st', k)
+        pos = np.flatnonzero(fwd >= 0)
+        fwd, rc = fwd[pos], rc[pos]
+        # Reverse complements, the later window pb being scored against the
+        # earlier pa
+        for a, b in join(fwd, rc):
+            keep = a <= b
+            pa, pb = pos[a[keep]], pos[b[keep]]
+            if wc is not None:
+                skip = designed(lambda t: wc[pb + t],
+                                lambda t: eq[pa + k - 1 - t], k)
+                pa, pb = pa[~skip], pb[~skip]
+            tally(counts, col, pa, pb, strand, cmpx)
+        # Identities
+        for a, b in join(fwd, fwd):
+            keep = a < b
+            pa, pb = pos[a[keep]], pos[b[keep]]
+            if eq is not None:
+                skip = designed(lambda t: eq[pb + t], lambda t: eq[pa + t], k)
+                pa, pb = pa[~skip], pb[~skip]
+            tally(counts, col, pa, pb, strand, cmpx)
+    return counts
+
+def count_equal(left, right):
+    """ Number of pairs (i, j) with left[i] == right[j] """
+    lv, lc = np.unique(left, return_counts=True)
+    rv, rc = np.unique(right, return_counts=True)
+    common, li, ri = np.intersect1d(lv, rv, assume_unique=True,
+                                    return_indices=True)
+    return int((lc[li] * rc[ri]).sum())
+
+def mismatch_counts(st, kmin, kmax):
+    """ Matches with one mismatch, as spuriousSSM's spurious1()
+
+    Every pair of windows of length k within strands is counted once when one
+    differs from the reverse complement of the other at exactly one base
+    other than the first and last. Designed pairs are not left out.
+
+    Returns:
+        counts: 3 x (kmax-kmin+1) int array, rows as in spurious_counts
+    """
+    store, strand, cmpx = layout(st)
+    counts = np.zeros((3, kmax - kmin + 1), dtype=np.int64)
+    for col, k in enumerate(range(kmin, kmax + 1)):
+        if k <= 2:
+            continue
+        fwd = store.kmers('st', k)
+        rc = store.revcomp_kmers('st', k)
+        pos = np.flatnonzero(fwd >= 0)
+        fwd, rc = fwd[pos], rc[pos]
+        # Windows one mismatch from their own reverse complement
+        diff = fwd ^ rc
+        bases = np.array([(diff >> (2*t)) & 3 for t in range(k)]) != 0
+        self_pairs = np.count_nonzero((bases.sum(0) == 1) &
+                                      ~bases[0] & ~bases[k-1])
+        # Ordered pairs agreeing everywhere but at one inner base, counted
+        # within a strand, within a complex and overall. The relation is
+        # symmetric, so each unordered pair appears twice.
+        found = []
+        for group in [strand[pos], cmpx[pos], np.zeros(len(pos), np.int64)]:
+            offset = group * 4**k
+            total = -(k - 2) * count_equal(offset + fwd, offset + rc)
+            for m in range(1, k - 1):
+                mask = ~np.int64(3 << (2*m))
+                total += count_equal(offset + (fwd & mask),
+                                     offset + (rc & mask))
+            found.append((total + self_pairs) // 2)
+        counts[:, col] = [found[0], found[1] - found[0], found[2] - found[1]]
+    return counts
+
+bad6mers = dict()
+
+def bad6mer_table(weak=verboten_weak, strong=verboten_strong,
+                  regular=verboten_regular):
+    """ Penalty of every 6-mer, indexed as SequenceStore.kmers
+
+    Weak penalties go to runs of A/T, strong ones to runs of G/C, with
+    GGGG and CCCC all but forbidden, and regular ones to purine or
+    pyrimidine runs, alternations and GC repeats.
+    """
+    key = (weak, strong, regular)
+    if key not in bad6mers:
+        table = np.zeros(4**6)
+        for i, s in enumerate(itertools.product('ACGT', repeat=6)):
+            s = ''.join(s)
+            n_weak = sum(c in 'AT' for c in s)
+            n_strong = 6 - n_weak
+            w = (n_strong == 0) + ('TTTT' in s) + ('AAAA' in s) + (n_weak > 3)
+            if n_weak == 5:
+                w += (s[0] in 'CG') + (s[-1] in 'CG')
+            g = (n_weak == 0) + ('GGG' in s) + ('CCC' in s) + \
+                1000 * (('GGGG' in s) + ('CCCC' in s))
+            if n_strong == 5:
+                g += (s[0] in 'AT') + (s[-1] in 'AT')
+            even, odd = set(s[0::2]), set(s[1::2])
+            r = (set(s) <= set('CT')) + (set(s) <= set('AG')) + \
+                (even <= set('CT') and odd <= set('AG')) + \
+                (even <= set('AG') and odd <= set('CT'))
+            r += sum(m in s for m in ['GCGC', 'GGCC', 'CCGG', 'CGCG'])
+            table[i] = weak * w + strong * g + regular * r
+        bad6mers[key] = table
+    return bad6mers[key]
+
+def verboten_score(st, weak=verboten_weak, strong=verboten_strong,
+                   regular=verboten_regular):
+    """ Sum of the bad6mer_table penalties of the 6-mers within strands """
+    store, strand, cmpx = layout(st)
+    kmers = store.kmers('st', 6)
+    return float(bad6mer_table(weak, strong, regular)[kmers[kmers >= 0]].sum())
+
+def stacks(wc):
+    """ Positions i such that bases i-1 and i stack in a target structure """
+    wc = np.asarray(wc)
+    return np.flatnonzero(wc[:-1] == wc[1:] + 1) + 1
+
+def bonds_score(st, wc, temperature=temperature):
+    """ Half the nearest neighbor free energy of the target stacks """
+    store, strand, cmpx = layout(st)
+    codes = store.codes('st')
+    i = stacks(wc)
+    a, b = codes[i - 1], codes[i]
+    dG = nnDH[a, b] - (temperature + 273.15) * nnDS[a, b] / 1000
+    return 0.5 * float(dG.sum())
+
+def spurious_score(st, counts, mismatches, beta=beta, mismatch=mismatch):
+    """ Weighted sum of spurious_counts and mismatch_counts
+
+    A match one base longer weighs beta times more. Matches within a strand,
+    within a complex and between complexes start from beta to the power of
+    minus half the log2 length of the longest strand, complex and of the
+    whole sequence. Mismatches weigh mismatch / beta**2 times a match of the
+    same column.
+    """
+    strands = [s for s in st.split(' ') if s]
+    cmpxs = [c.replace(' ', '') for c in st.split('  ')]
+    lengths = [max(len(s) for s in strands), max(len(c) for c in cmpxs),
+               sum(len(s) for s in strands)]
+    base = np.array([beta ** (-0.5 * np.log2(n)) for n in lengths])
+    w = base[:, None] * beta ** np.arange(counts.shape[1])
+    return float((counts * w).sum() +
+                 (mismatches * w).sum() * mismatch / beta**2)
+
+def automatic_score(st, wc, eq, spurious_range=10):
+    """ Total score of spuriousSSM with score=automatic
+
+    Verboten, spurious and bonds scores are weighted by 640 / number of
+    bases, 1 and 10 / number of target stacks, as in the spuriousSSM of
+    peppercompiler 0.1.3. The total differs from the value recorded in
+    TDM_NUPACK_tests for sequences9mut; see the module docstring.
+
+    Returns:
+        counts: spurious_counts from 3 to spurious_range+2
+        mismatches: mismatch_counts from 5 to spurious_range+4
+        verboten: verboten_score
+        score: Weighted total
+    """
+    counts = spurious_counts(st, 3, spurious_range + 2, wc, eq)
+    mismatches = mismatch_counts(st, 5, spurious_range + 4)
+    verboten = verboten_score(st)
+    n_bases = len(st.replace(' ', ''))
+    score = 640 / n_bases * verboten + \
+        spurious_score(st, counts, mismatches) + \
+        10 / max(len(stacks(wc)), 1) * bonds_score(st, wc)
+    return counts, mismatches, verboten, score
+
+def wsi_scores(st, wc, eq, spurious_range=10, beta=5):
+    """ The scores of tdm.Spurious_Weighted_Score
+
+    Returns:
+        scores: Intra-strand and inter-complex match scores, the same for
+            mismatches, the verboten score and the total score
+    """
+    counts, mismatches, verboten, score = automatic_score(st, wc, eq,
+                                                          spurious_range)
+    w = linear_weights(3, spurious_range + 2, beta)
+    w1 = linear_weights(5, spurious_range + 4, beta)
+    return [float(counts[0].dot(w)), float(counts[2].dot(w)),
+            float(mismatches[0].dot(w1)), float(mismatches[2].dot(w1)),
+            verboten, score]